@@ -1,4 +1,5 @@
 import logging
+import time
 from urllib.parse import quote, urlparse, urlunparse
 
 import datetime
@@ -7,9 +8,16 @@ from requests import Session
 
 from pajbot import constants
 from pajbot.apiwrappers.response_cache import APIResponseCache
+from pajbot.metrics import Histogram
 
 log = logging.getLogger(__name__)
 
+api_request_seconds = Histogram(
+    "pajbot_api_request_seconds",
+    "Duration of requests to external APIs, by endpoint and response status",
+    ["api", "method", "endpoint", "status"],
+)
+
 
 class BaseAPI:
     def __init__(self, base_url, redis=None):
@@ -73,13 +81,35 @@ class BaseAPI:
         else:
             return BaseAPI.join_base_and_string(base, endpoint)
 
+    @staticmethod
+    def endpoint_label(base, endpoint):
+        """Returns the endpoint in a form that's suitable as a metrics label, i.e. without
+        any user-supplied values: ["users", username] -> "/users/*", "/streams/123" -> "/streams/*".
+        For absolute endpoint URLs only the host is used."""
+        if base is None:
+            return urlparse(endpoint).netloc
+
+        if isinstance(endpoint, list):
+            return "/" + "/".join([str(endpoint[0])] + ["*"] * (len(endpoint) - 1)) if endpoint else "/"
+
+        segments = endpoint.strip("/").split("/")
+        return "/" + "/".join("*" if any(c.isdigit() for c in segment) else segment for segment in segments)
+
     def request(self, method, endpoint, params, headers, json=None, **request_options):
         full_url = self.join_base_and_endpoint(self.base_url, endpoint)
-        response = self.session.request(
-            method, full_url, params=params, headers=headers, json=json, timeout=self.timeout, **request_options
-        )
-        response.raise_for_status()
-        return response
+        status = "error"
+        started_at = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, full_url, params=params, headers=headers, json=json, timeout=self.timeout, **request_options
+            )
+            status = str(response.status_code)
+            response.raise_for_status()
+            return response
+        finally:
+            api_request_seconds.labels(
+                type(self).__name__, method, self.endpoint_label(self.base_url, endpoint), status
+            ).observe(time.perf_counter() - started_at)
 
     def get(self, endpoint, params=None, headers=None, **request_options):
         return self.request("GET", endpoint, params, headers, **request_options).json()
@@ -6,6 +6,7 @@ import logging
 
 from pajbot import utils
 from pajbot.models.emote import Emote
+from pajbot.utils import iterate_in_chunks
 
 log = logging.getLogger(__name__)
 
@@ -85,6 +86,10 @@ class TwitchChannelEmotesSerializer(BaseJsonSerializer):
 
 
 class APIResponseCache:
+    # Maximum amount of keys in a single MGET, and of SETEX commands in a single pipeline.
+    # Bounds the time redis is blocked by a single command, and the size of a single request/response.
+    BULK_CHUNK_SIZE = 1000
+
     def __init__(self, redis):
         self.redis = redis
 
@@ -108,43 +113,59 @@ class APIResponseCache:
         return fetch_result
 
     def cache_bulk_fetch_fn(
-        self, input_data, redis_key_fn, fetch_fn, serializer=JsonSerializer(), expiry=120, force_fetch=False
+        self,
+        input_data,
+        redis_key_fn,
+        fetch_fn,
+        serializer=JsonSerializer(),
+        expiry=120,
+        force_fetch=False,
+        memoize=False,
     ):
+        """
+        Looks up the cached results of all entries of input_data at once, and fetches the missing ones with
+        a single call to fetch_fn (which receives the list of input entries to fetch).
+        Returns the results in the same order as input_data.
+
+        With memoize, input entries that share the same redis key are only looked up and fetched once,
+        and share the same result object.
+        """
+        redis_keys = [redis_key_fn(input_entry) for input_entry in input_data]
+
+        if memoize:
+            # redis key -> index of the first input entry with that key
+            first_indexes = {}
+            first_index_of = [first_indexes.setdefault(redis_key, idx) for idx, redis_key in enumerate(redis_keys)]
+            lookup_indexes = list(first_indexes.values())
+        else:
+            lookup_indexes = range(len(redis_keys))
+
         # results contains the wanted results, already in the correct list index (e.g. if we had a cache
-        # hit for the third element (index 2),
-        # then the cache result for the third element will be in this list, at index 2)
-        results = []
+        # hit for the third element (index 2), then the cache result for the third element will be at index 2)
+        results = [None] * len(redis_keys)
 
-        # to_fetch contains is a list of tuples (idx, input_entry) of input entries (with their index)
-        # that did not have a cache hit, and that need to be fetched. After successful fetch, the result
-        # should be inserted into `results` at `idx`.
-        to_fetch = []
+        # indexes of the input entries that did not have a cache hit, and that need to be fetched
+        to_fetch_indexes = []
 
-        # redis MGET (Multi-GET) to check all at once quickly
         if not force_fetch:
-            cache_results = self.redis.mget([redis_key_fn(input_entry) for input_entry in input_data])
-            for idx, cache_result in enumerate(cache_results):
-                if cache_result is not None:
-                    results.insert(idx, serializer.deserialize(cache_result))
-                else:
-                    to_fetch.append((idx, input_data[idx]))
+            # redis MGET (Multi-GET) to check many keys at once quickly
+            for indexes_chunk in iterate_in_chunks(lookup_indexes, self.BULK_CHUNK_SIZE):
+                cache_results = self.redis.mget([redis_keys[idx] for idx in indexes_chunk])
+                for idx, cache_result in zip(indexes_chunk, cache_results):
+                    if cache_result is not None:
+                        results[idx] = serializer.deserialize(cache_result)
+                    else:
+                        to_fetch_indexes.append(idx)
         else:
-            # yields a list zipping [(0, first_element), (1, second_element)] which is what we need in to_fetch
-            to_fetch = enumerate(input_data)
-
-        # https://stackoverflow.com/a/19343/4464702
-        # unzip [(0, 'first'), (1, 'second'), (4, 'fourtf')] to
-        #   to_fetch_indexes = (0, 1, 4) and
-        #   to_fetch_values = ('first', 'second', 'fourtf')
-        # except that zip() returns an iterator, not a list (so the extra call to tuple() is needed)
-
-        # the check for length is needed, because tuple(zip(*[])) returns () (an empty tuple),
-        # not a tuple with two empty lists.
-        if len(to_fetch) > 0:
-            to_fetch_indexes, to_fetch_values = tuple(zip(*to_fetch))
-            fetch_results = fetch_fn(to_fetch_values)
+            to_fetch_indexes = list(lookup_indexes)
+
+        if len(to_fetch_indexes) > 0:
+            fetch_results = fetch_fn([input_data[idx] for idx in to_fetch_indexes])
+
+            # (redis key, expiry, serialized result) of the results that should be cached
+            to_cache = []
             for idx, fetch_result in zip(to_fetch_indexes, fetch_results):
-                results.insert(idx, fetch_result)
+                results[idx] = fetch_result
 
                 if callable(expiry):
                     # then expiry is a lambda that computes the expiry based upon the fetch result
@@ -153,6 +174,18 @@ class APIResponseCache:
                     expiry_value = expiry
 
                 if expiry_value > 0:
-                    self.redis.setex(redis_key_fn(input_data[idx]), expiry_value, serializer.serialize(fetch_result))
+                    to_cache.append((redis_keys[idx], expiry_value, serializer.serialize(fetch_result)))
+
+            # SETEX them in pipelines instead of waiting for a round-trip to redis for every single one
+            for to_cache_chunk in iterate_in_chunks(to_cache, self.BULK_CHUNK_SIZE):
+                pipeline = self.redis.pipeline(transaction=False)
+                for redis_key, expiry_value, serialized_result in to_cache_chunk:
+                    pipeline.setex(redis_key, expiry_value, serialized_result)
+                pipeline.execute()
+
+        if memoize:
+            for idx, first_idx in enumerate(first_index_of):
+                if idx != first_idx:
+                    results[idx] = results[first_idx]
 
         return results
@@ -1,14 +1,15 @@
 import logging
+import threading
 import time
+from concurrent.futures.thread import ThreadPoolExecutor
 
-from datetime import datetime, timezone
-
-import math
 from requests import HTTPError
+from requests import ConnectionError as RequestsConnectionError
+from requests import Timeout
 
-from pajbot import utils
 from pajbot.apiwrappers.response_cache import DateTimeSerializer
 from pajbot.apiwrappers.twitch.base import BaseTwitchAPI
+from pajbot.apiwrappers.twitch.rate_limit import TokenBucket
 from pajbot.models.user import UserBasics
 from pajbot.utils import iterate_in_chunks
 
@@ -18,26 +19,88 @@ log = logging.getLogger(__name__)
 class TwitchHelixAPI(BaseTwitchAPI):
     authorization_header_prefix = "Bearer"
 
+    # Amount of requests that bulk lookups (e.g. of all chatters) make at the same time
+    MAX_CONCURRENT_REQUESTS = 4
+    # How often a request is tried when it gets rate limited
+    MAX_RATE_LIMITED_ATTEMPTS = 3
+    # How often a chunk of a bulk lookup is tried when Twitch fails to respond (5xx, timeouts, connection errors)
+    MAX_CHUNK_ATTEMPTS = 3
+
     def __init__(self, redis, app_token_manager):
         super().__init__(base_url="https://api.twitch.tv/helix", redis=redis)
         self.app_token_manager = app_token_manager
 
+        # Twitch keeps a separate rate limit bucket for the app token and for every user token
+        self.rate_limit_buckets = {}
+        self.rate_limit_buckets_lock = threading.Lock()
+
+        self.executor = ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT_REQUESTS, thread_name_prefix="Helix")
+
     @property
     def default_authorization(self):
         return self.app_token_manager
 
+    def rate_limit_bucket(self, authorization):
+        if authorization is None:
+            authorization = self.default_authorization
+
+        with self.rate_limit_buckets_lock:
+            bucket = self.rate_limit_buckets.get(authorization, None)
+            if bucket is None:
+                bucket = self.rate_limit_buckets[authorization] = TokenBucket()
+            return bucket
+
     def request(self, method, endpoint, params, headers, authorization=None, json=None):
-        try:
-            return super().request(method, endpoint, params, headers, authorization, json)
-        except HTTPError as e:
-            if e.response.status_code == 429:
-                # retry once after rate limit resets...
-                rate_limit_reset = datetime.fromtimestamp(int(e.response.headers["Ratelimit-Reset"]), tz=timezone.utc)
-                time_to_wait = rate_limit_reset - utils.now()
-                time.sleep(math.ceil(time_to_wait.total_seconds()))
-                return super().request(method, endpoint, params, headers, authorization, json)
-            else:
-                raise e
+        bucket = self.rate_limit_bucket(authorization)
+
+        attempt = 1
+        while True:
+            bucket.acquire()
+            try:
+                response = super().request(method, endpoint, params, headers, authorization, json)
+            except HTTPError as e:
+                bucket.update(e.response.headers)
+                if e.response.status_code != 429 or attempt >= self.MAX_RATE_LIMITED_ATTEMPTS:
+                    raise e
+
+                # retry after the rate limit resets...
+                bucket.block_until_reset(e.response.headers)
+                attempt += 1
+                continue
+
+            bucket.update(response.headers)
+            return response
+
+    def _fetch_chunk(self, fetch_fn, chunk):
+        """ Calls fetch_fn with the chunk, and retries if Twitch fails to respond """
+        attempt = 1
+        while True:
+            try:
+                return fetch_fn(chunk)
+            except (HTTPError, RequestsConnectionError, Timeout) as e:
+                if isinstance(e, HTTPError) and e.response.status_code < 500:
+                    raise e
+
+                if attempt >= self.MAX_CHUNK_ATTEMPTS:
+                    raise e
+
+                log.warning(f"Failed to fetch a chunk of {len(chunk)} entries from Helix ({e}), retrying")
+                time.sleep(attempt)
+                attempt += 1
+
+    def _fetch_in_chunks(self, fetch_fn, entries, chunk_size):
+        """
+        Splits the entries into chunks of chunk_size, and calls fetch_fn (which must return a list) with each of them,
+        up to MAX_CONCURRENT_REQUESTS at the same time. Returns all results in the same order as the entries.
+        """
+        chunks = list(iterate_in_chunks(entries, chunk_size))
+
+        if len(chunks) <= 1:
+            chunk_results = [self._fetch_chunk(fetch_fn, chunk) for chunk in chunks]
+        else:
+            chunk_results = self.executor.map(lambda chunk: self._fetch_chunk(fetch_fn, chunk), chunks)
+
+        return [result for results in chunk_results for result in results]
 
     @staticmethod
     def _with_pagination(after_pagination_cursor=None):
@@ -182,23 +245,22 @@ class TwitchHelixAPI(BaseTwitchAPI):
         """Fetch a list of all subscribers (user IDs) of a broadcaster."""
         return self._fetch_all_pages(self._fetch_subscribers_page, broadcaster_id, authorization)
 
-    def _bulk_fetch_user_data(self, key_type, lookup_keys):
-        all_entries = []
-
-        # We can fetch a maximum of 100 users on each helix request
-        # so we do it in chunks of 100
-        for lookup_keys_chunk in iterate_in_chunks(lookup_keys, 100):
-            response = self.get("/users", {key_type: lookup_keys_chunk})
+    def _fetch_user_data_chunk(self, key_type, lookup_keys_chunk):
+        response = self.get("/users", {key_type: lookup_keys_chunk})
 
-            # using a response map means we don't rely on twitch returning the data entries in the exact
-            # order we requested them
-            response_map = {response_entry[key_type]: response_entry for response_entry in response["data"]}
+        # using a response map means we don't rely on twitch returning the data entries in the exact
+        # order we requested them
+        response_map = {response_entry[key_type]: response_entry for response_entry in response["data"]}
 
-            # then fill in the gaps with None
-            for lookup_key in lookup_keys_chunk:
-                all_entries.append(response_map.get(lookup_key, None))
+        # then fill in the gaps with None
+        return [response_map.get(lookup_key, None) for lookup_key in lookup_keys_chunk]
 
-        return all_entries
+    def _bulk_fetch_user_data(self, key_type, lookup_keys):
+        # We can fetch a maximum of 100 users on each helix request
+        # so we do it in chunks of 100, a few of them at the same time
+        return self._fetch_in_chunks(
+            lambda lookup_keys_chunk: self._fetch_user_data_chunk(key_type, lookup_keys_chunk), list(lookup_keys), 100
+        )
 
     def bulk_get_user_data_by_id(self, user_ids):
         return self.cache.cache_bulk_fetch_fn(
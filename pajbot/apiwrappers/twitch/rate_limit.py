@@ -0,0 +1,78 @@
+import math
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Client-side copy of a Helix rate limit bucket, so concurrent requests are spread out instead of running
+    into 429 Too Many Requests responses.
+
+    Twitch gives every client (app token, or client + user token) a bucket of Ratelimit-Limit points that refills
+    continuously over a minute, and every request takes one point. The bucket is kept in sync with the
+    Ratelimit-* headers of every response (see update()).
+    """
+
+    REFILL_PERIOD = 60
+
+    def __init__(self, capacity=800):
+        self.condition = threading.Condition()
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        # time.monotonic() until which no requests may be made, after a 429 response
+        self.blocked_until = 0.0
+
+    @property
+    def refill_rate(self):
+        return self.capacity / self.REFILL_PERIOD
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """ Takes one token from the bucket, waits until there is one if the bucket is empty """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.refill_rate
+
+                self.condition.wait(wait)
+
+    def update(self, headers):
+        """ Syncs the bucket with the Ratelimit-Limit and Ratelimit-Remaining headers of a response """
+        try:
+            limit = int(headers["Ratelimit-Limit"])
+            remaining = int(headers["Ratelimit-Remaining"])
+        except (KeyError, ValueError):
+            return
+
+        with self.condition:
+            self._refill(time.monotonic())
+            self.capacity = max(1, limit)
+            # Responses of concurrent requests can arrive out of order, so an older (higher) remaining count
+            # must not give back tokens that were already taken
+            self.tokens = min(self.tokens, remaining)
+
+    def block_until_reset(self, headers):
+        """ Stops all requests until the time in the Ratelimit-Reset header of a 429 response """
+        try:
+            reset_at = int(headers["Ratelimit-Reset"])
+        except (KeyError, ValueError):
+            # Twitch always sends the header, but just in case: wait until there's one token again
+            reset_at = time.time() + 1 / self.refill_rate
+
+        with self.condition:
+            self.tokens = 0.0
+            self.updated_at = time.monotonic()
+            self.blocked_until = max(self.blocked_until, time.monotonic() + max(0, math.ceil(reset_at - time.time())))
+            self.condition.notify_all()
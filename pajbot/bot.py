@@ -24,23 +24,30 @@ from pajbot.apiwrappers.twitch.tmi import TwitchTMIAPI
 from pajbot.constants import VERSION
 from pajbot.eventloop import SafeDefaultScheduler
 from pajbot.managers.command import CommandManager
+from pajbot.managers.cooldown import SharedCooldowns
+from pajbot.managers.connection import OutboundPriority, outbound_priority
 from pajbot.managers.db import DBManager
 from pajbot.managers.deck import DeckManager
 from pajbot.managers.emote import EmoteManager, EpmManager, EcountManager
 from pajbot.managers.handler import HandlerManager
+from pajbot.managers.handler_watchdog import HandlerWatchdog
 from pajbot.managers.irc import IRCManager
 from pajbot.managers.kvi import KVIManager
 from pajbot.managers.redis import RedisManager
 from pajbot.managers.discord_bot import DiscordBotManager
 from pajbot.managers.schedule import ScheduleManager
 from pajbot.managers.twitter import TwitterManager, PBTwitterManager
+from pajbot.managers.user_cache import UserCacheManager
 from pajbot.managers.user_ranks_refresh import UserRanksRefreshManager
 from pajbot.managers.websocket import WebSocketManager
+from pajbot.message_pipeline import MessagePipeline
+from pajbot.metrics import MetricsServer
 from pajbot.migration.db import DatabaseMigratable
 from pajbot.migration.migrate import Migration
 from pajbot.migration.redis import RedisMigratable
 from pajbot.models.action import ActionParser
 from pajbot.models.banphrase import BanphraseManager
+from pajbot.models.command import Command
 from pajbot.models.module import ModuleManager
 from pajbot.models.pleblist import PleblistManager
 from pajbot.models.sock import SocketManager
@@ -151,6 +158,12 @@ class Bot:
         # Thread pool executor for async actions
         self.action_queue = ActionQueue()
 
+        self.metrics_server = None
+        metrics_port = self.config["main"].getint("metrics_port", None)
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(self.config["main"].get("metrics_host", "127.0.0.1"), metrics_port)
+            self.metrics_server.start()
+
         # refresh points_rank and num_lines_rank regularly
         UserRanksRefreshManager.start(self.action_queue)
 
@@ -160,10 +173,34 @@ class Bot:
         self.reactor.scheduler_class = SafeDefaultScheduler
         self.reactor.scheduler = SafeDefaultScheduler()
 
+        # Module handlers and commands share state (cooldowns, running games, ...) with everything the IRC thread
+        # runs (timers, delayed callbacks, commit_all, IRC events) without locking it. The reactor holds this lock
+        # while it runs any of those, so message handlers hold it too and they all take turns.
+        self.handler_lock = self.reactor.mutex
+
+        # Worker threads that handle incoming chat messages, so loading and saving the users of the messages does
+        # not block the IRC thread. Module handlers still take turns with the IRC thread (see handler_lock)
+        message_workers = self.config["main"].getint("message_workers", 1)
+        if message_workers > 1:
+            log.warning(
+                f"Handling chat messages on {message_workers} worker threads. Changes that handlers make to "
+                "other users than the message's author (e.g. givepoints) can be lost!"
+            )
+        self.message_pipeline = MessagePipeline(
+            num_workers=message_workers,
+            overload_threshold=self.config["main"].getint("message_overload_threshold", 200),
+            lock=self.handler_lock,
+        )
+
         self.start_time = utils.now()
         ActionParser.bot = self
+        if self.config["main"].getboolean("share_cooldowns", False):
+            Command.shared_cooldowns = SharedCooldowns(self.streamer)
 
         HandlerManager.init_handlers()
+        watchdog_config = self.config["handler_watchdog"] if self.config.has_section("handler_watchdog") else None
+        HandlerManager.watchdog = HandlerWatchdog.from_config(self, watchdog_config)
+        HandlerManager.watchdog.start()
 
         self.socket_manager = SocketManager(self.streamer, self.execute_now)
         self.stream_manager = StreamManager(self)
@@ -173,6 +210,10 @@ class Bot:
         self.banphrase_manager = BanphraseManager(self).load()
         self.timer_manager = TimerManager(self).load()
         self.kvi = KVIManager()
+        self.user_cache = UserCacheManager(
+            max_size=self.config["main"].getint("user_cache_size", 10000),
+            ttl=self.config["main"].getint("user_cache_ttl", 300),
+        )
 
         # bot access token
         if "password" in self.config["main"]:
@@ -201,7 +242,7 @@ class Bot:
 
         self.emote_manager = EmoteManager(self.twitch_v5_api, self.action_queue)
         self.epm_manager = EpmManager()
-        self.ecount_manager = EcountManager()
+        self.ecount_manager = EcountManager(flush_interval=self.config["main"].getint("ecount_flush_interval", 5))
         if "twitter" in self.config and self.config["twitter"].get("streaming_type", "twitter") == "tweet-provider":
             self.twitter_manager = PBTwitterManager(self)
         else:
@@ -216,7 +257,12 @@ class Bot:
         HandlerManager.trigger("on_managers_loaded")
 
         # Commitable managers
-        self.commitable = {"commands": self.commands, "banphrases": self.banphrase_manager}
+        self.commitable = {
+            "commands": self.commands,
+            "banphrases": self.banphrase_manager,
+            "users": self.user_cache,
+            "ecounts": self.ecount_manager,
+        }
 
         self.execute_every(60, self.commit_all)
         self.execute_every(1, self.do_tick)
@@ -488,11 +534,14 @@ class Bot:
             log.exception("BabyRage")
             self.whisper_login(event.source.user.lower(), "Exception BabyRage")
 
-    def privmsg(self, message, channel=None, increase_message=True):
+    def privmsg(self, message, channel=None, increase_message=True, priority=None):
+        """ Sends a message to the given channel (or the streamer's channel).
+        priority is an OutboundPriority. If it's not set, moderation commands (e.g. /timeout) are sent
+        as moderation, and other messages by the priority of the current thread (see outbound_priority) """
         if channel is None:
             channel = self.channel
 
-        return self.irc.privmsg(message, channel, increase_message=increase_message)
+        return self.irc.privmsg(message, channel, increase_message=increase_message, priority=priority)
 
     def c_uptime(self):
         return utils.time_ago(self.start_time)
@@ -636,7 +685,7 @@ class Bot:
     def on_disconnect(self, chatconn, event):
         self.irc.on_disconnect(chatconn, event)
 
-    def parse_message(self, message, source, event, tags={}, whisper=False):
+    def parse_message(self, message, source, event, tags={}, whisper=False, overloaded=False):
         msg_lower = message.lower()
 
         emote_tag = tags["emotes"]
@@ -654,9 +703,7 @@ class Bot:
         # Parse emotes in the message
         emote_instances, emote_counts = self.emote_manager.parse_all_emotes(message, emote_tag)
 
-        now = utils.now()
-        source.last_seen = now
-        source.last_active = now
+        self.user_cache.touch(source, utils.now())
 
         if not whisper:
             # increment epm and ecount
@@ -675,6 +722,8 @@ class Bot:
             urls=urls,
             msg_id=msg_id,
             event=event,
+            # Under overload, only run the essential (e.g. moderation) handlers
+            min_priority=HandlerManager.ESSENTIAL_PRIORITY if overloaded else None,
         )
         if res is False:
             return False
@@ -685,6 +734,10 @@ class Bot:
         if whisper:
             self.whisper_login("datguy1", "{} said: {}".format(source, message))
 
+        if overloaded and not source.moderator and source.level < 500:
+            # Under overload, only moderators' commands are run
+            return False
+
         if msg_lower[:1] == "!":
             msg_lower_parts = msg_lower.split(" ")
             trigger = msg_lower_parts[0][1:]
@@ -702,14 +755,16 @@ class Bot:
 
     def on_whisper(self, chatconn, event):
         tags = {tag["key"]: tag["value"] if tag["value"] is not None else "" for tag in event.tags}
+        self.message_pipeline.submit(tags["user-id"], self.handle_whisper, event, tags)
 
+    def handle_whisper(self, event, tags, overloaded=False):
         id = tags["user-id"]
         login = event.source.user
         name = tags["display-name"]
 
-        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
-            source = User.from_basics(db_session, UserBasics(id, login, name))
-            self.parse_message(event.arguments[0], source, event, tags, whisper=True)
+        with self.user_cache.user_scope(UserBasics(id, login, name)) as source:
+            with self.handler_lock, outbound_priority(OutboundPriority.REPLY):
+                self.parse_message(event.arguments[0], source, event, tags, whisper=True, overloaded=overloaded)
 
     def on_ping(self, chatconn, event):
         self.last_ping = utils.now()
@@ -719,13 +774,14 @@ class Bot:
 
     def on_usernotice(self, chatconn, event):
         tags = {tag["key"]: tag["value"] if tag["value"] is not None else "" for tag in event.tags}
+        self.message_pipeline.submit(tags["user-id"], self.handle_usernotice, event, tags)
 
+    def handle_usernotice(self, event, tags, overloaded=False):
         id = tags["user-id"]
         login = tags["login"]
         name = tags["display-name"]
 
-        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
-            source = User.from_basics(db_session, UserBasics(id, login, name))
+        with self.user_cache.user_scope(UserBasics(id, login, name)) as source, self.handler_lock:
             if event.arguments and len(event.arguments) > 0:
                 msg = event.arguments[0]
             else:
@@ -733,28 +789,32 @@ class Bot:
             HandlerManager.trigger("on_usernotice", source=source, message=msg, tags=tags)
 
             if msg is not None:
-                self.parse_message(msg, source, event, tags)
+                with outbound_priority(OutboundPriority.REPLY):
+                    self.parse_message(msg, source, event, tags, overloaded=overloaded)
 
     def on_action(self, chatconn, event):
         self.on_pubmsg(chatconn, event)
 
     def on_pubmsg(self, chatconn, event):
+        if event.source.user == self.nickname:
+            return False
+
         tags = {tag["key"]: tag["value"] if tag["value"] is not None else "" for tag in event.tags}
+        self.message_pipeline.submit(tags["user-id"], self.handle_pubmsg, event, tags)
 
+    def handle_pubmsg(self, event, tags, overloaded=False):
         id = tags["user-id"]
         login = event.source.user
         name = tags["display-name"]
 
-        if event.source.user == self.nickname:
-            return False
-
-        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
-            source = User.from_basics(db_session, UserBasics(id, login, name))
+        with self.user_cache.user_scope(UserBasics(id, login, name)) as source, self.handler_lock:
             res = HandlerManager.trigger("on_pubmsg", source=source, message=event.arguments[0])
             if res is False:
                 return False
 
-            self.parse_message(event.arguments[0], source, event, tags=tags)
+            # Messages sent by message handlers and commands are replies to this message
+            with outbound_priority(OutboundPriority.REPLY):
+                self.parse_message(event.arguments[0], source, event, tags=tags, overloaded=overloaded)
 
     def on_pubnotice(self, chatconn, event):
         tags = {tag["key"]: tag["value"] if tag["value"] is not None else "" for tag in event.tags}
@@ -770,6 +830,8 @@ class Bot:
         for key, manager in self.commitable.items():
             manager.commit()
 
+        log.debug(f"Message pipeline: {self.message_pipeline.stats()}")
+
         HandlerManager.trigger("on_commit", stop_on_false=False)
 
     @staticmethod
@@ -793,7 +855,13 @@ class Bot:
         self.execute_delayed(quit_delay, self.quit_bot)
 
     def quit_bot(self, **options):
+        # Handle the messages that are already queued before the final commit
+        self.message_pipeline.stop(timeout=5)
         self.commit_all()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.irc.stop_recording()
+        HandlerManager.watchdog.stop()
         HandlerManager.trigger("on_quit")
         phrase_data = {"nickname": self.nickname, "version": self.version_long}
 
@@ -814,7 +882,8 @@ class Bot:
 
         sys.exit(0)
 
-    def apply_filter(self, resp, f):
+    def get_filter(self, name):
+        """ Returns the filter function (value, arguments) -> filtered value with the given name, or None """
         available_filters = {
             "strftime": _filter_strftime,
             "lower": lambda var, args: var.lower(),
@@ -835,8 +904,12 @@ class Bot:
             "or_broadcaster": self._filter_or_broadcaster,
             "or_streamer": self._filter_or_broadcaster,
         }
-        if f.name in available_filters:
-            return available_filters[f.name](resp, f.arguments)
+        return available_filters.get(name, None)
+
+    def apply_filter(self, resp, f):
+        filter_function = self.get_filter(f.name)
+        if filter_function is not None:
+            return filter_function(resp, f.arguments)
         return resp
 
     def _filter_or_broadcaster(self, var, args):
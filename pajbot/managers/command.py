@@ -392,6 +392,9 @@ class CommandManager(UserDict):
 
         def merge_commands(in_dict, out):
             for alias, command in in_dict.items():
+                if command.cooldown_key is None:
+                    command.cooldown_key = f"alias-{alias}"
+
                 if command.action:
                     # Resets any previous modifications to the action.
                     # Right now, the only thing this resets is the MultiAction
@@ -1,6 +1,11 @@
+import enum
 import logging
 import socket
 import ssl
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 
 import irc
 from irc.client import InvalidCharacters
@@ -9,10 +14,15 @@ from irc.client import ServerNotConnectedError
 from irc.connection import Factory
 from ratelimiter import RateLimiter
 
+from pajbot.metrics import Counter, Gauge
 from pajbot.tmi import TMI
 
 log = logging.getLogger("pajbot")
 
+outbound_queue_depth = Gauge("pajbot_outbound_queue_depth", "Messages waiting to be sent")
+messages_queued = Counter("pajbot_messages_queued_total", "Messages queued to be sent, by priority", ["priority"])
+messages_sent = Counter("pajbot_messages_sent_total", "Messages sent, by connection", ["connection"])
+
 
 class CustomServerConnection(irc.client.ServerConnection):
     """
@@ -47,21 +57,206 @@ class CustomServerConnection(irc.client.ServerConnection):
 
 
 class Connection(CustomServerConnection):
-    def __init__(self, reactor):
+    def __init__(self, reactor, name, channels=[]):
         super().__init__(reactor)
 
-        self.num_msgs_sent = 0
+        self.name = name
+        # Channels this connection joins and reads messages from. Send-only connections don't join any channels
+        self.channels = channels
         self.in_channel = False
 
-    def reduce_msgs_sent(self):
-        self.num_msgs_sent -= 1
+        # time.monotonic() of every message sent from this connection in the last `SENT_WINDOW` seconds
+        self.sent = deque()
+        self.num_msgs_sent = 0
+
+    SENT_WINDOW = 31
+
+    @property
+    def reads(self):
+        return len(self.channels) > 0
+
+    def record_sent(self, now):
+        self.sent.append(now)
+        self.num_msgs_sent += 1
+
+    def load(self, now):
+        """ Returns the amount of messages sent from this connection in the last `SENT_WINDOW` seconds """
+        while self.sent and self.sent[0] + self.SENT_WINDOW <= now:
+            self.sent.popleft()
+        return len(self.sent)
+
+
+class OutboundPriority(enum.IntEnum):
+    """ Lanes of outgoing messages. Messages in a lower lane are only sent when all higher lanes are empty """
+
+    MODERATION = 0
+    REPLY = 1
+    ANNOUNCEMENT = 2
+    TIMER = 3
+
+
+_outbound_priority = threading.local()
+
+
+@contextmanager
+def outbound_priority(priority):
+    """ Sets the priority of messages sent from this thread without an explicit priority """
+    previous_priority = getattr(_outbound_priority, "priority", None)
+    _outbound_priority.priority = priority
+    try:
+        yield
+    finally:
+        _outbound_priority.priority = previous_priority
+
+
+def current_outbound_priority():
+    priority = getattr(_outbound_priority, "priority", None)
+    if priority is None:
+        return OutboundPriority.ANNOUNCEMENT
+    return priority
+
+
+class OutboundMessage:
+    __slots__ = ("channel", "message", "counts", "punishment")
+
+    def __init__(self, channel, message, counts, punishment=None):
+        self.channel = channel
+        self.message = message
+        # Whether this message counts towards the message limit
+        self.counts = counts
+        # (login, duration in seconds) for timeouts/bans, which can be coalesced. Bans have a duration of None
+        self.punishment = punishment
+
+
+class OutboundMessageQueue:
+    """
+    Outgoing chat messages, in one lane per OutboundPriority.
+
+    Sending a message takes a token, which is given back `period` seconds later.
+    At most `message_limit` tokens can be taken at once, so the message limit of Twitch is never exceeded
+    in any window of 30 seconds.
+
+    Queued timeouts/bans for the same user are coalesced into a single message (the longest one is kept).
+    """
+
+    MODERATION_COMMANDS = {"/timeout", "/ban", "/unban", "/untimeout", "/delete"}
+
+    def __init__(self, period=31):
+        self.period = period
+
+        self.lanes = [deque() for _ in OutboundPriority]
+
+        # time.monotonic() of every message that counts towards the limit, sent in the last `period` seconds
+        self.sent = deque()
+
+        # (channel, login) -> queued OutboundMessage with a timeout or ban for that user
+        self.queued_punishments = {}
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    def put(self, channel, message, priority, counts=True):
+        command, _, arguments = message.partition(" ")
+        command = command.lower()
+        if command in self.MODERATION_COMMANDS:
+            priority = OutboundPriority.MODERATION
+
+        punishment = None
+        arguments = arguments.split(" ")
+        login = arguments[0].lower()
+        if command in ("/unban", "/untimeout"):
+            # Timeouts/bans queued after this must not be coalesced into ones queued before this
+            self.queued_punishments.pop((channel, login), None)
+        elif command == "/ban" and login:
+            punishment = (login, None)
+        elif command == "/timeout" and login:
+            try:
+                duration = int(arguments[1]) if len(arguments) > 1 else 600
+                punishment = (login, duration)
+            except ValueError:
+                # e.g. "/timeout user 10m", we don't bother coalescing these
+                pass
+
+        outbound_message = OutboundMessage(channel, message, counts, punishment)
+
+        if punishment is not None:
+            queued_message = self.queued_punishments.get((channel, login), None)
+            if queued_message is not None:
+                if self._is_harsher(punishment, queued_message.punishment):
+                    queued_message.message = message
+                    queued_message.punishment = punishment
+                    queued_message.counts = queued_message.counts or counts
+                return
+
+            self.queued_punishments[(channel, login)] = outbound_message
+
+        self.lanes[priority].append(outbound_message)
+
+    @staticmethod
+    def _is_harsher(punishment, other_punishment):
+        duration = punishment[1]
+        other_duration = other_punishment[1]
+        if other_duration is None:
+            return False
+        if duration is None:
+            return True
+        return duration > other_duration
+
+    def _release_tokens(self, now):
+        while self.sent and self.sent[0] + self.period <= now:
+            self.sent.popleft()
+
+    def pop(self, now, message_limit):
+        """ Returns the next message that may be sent right now, or None """
+        self._release_tokens(now)
+        has_token = len(self.sent) < message_limit
+
+        for lane in self.lanes:
+            if not lane:
+                continue
+
+            outbound_message = lane[0]
+            if outbound_message.counts and not has_token:
+                continue
+
+            lane.popleft()
+            if outbound_message.counts:
+                self.sent.append(now)
+            if outbound_message.punishment is not None:
+                key = (outbound_message.channel, outbound_message.punishment[0])
+                if self.queued_punishments.get(key, None) is outbound_message:
+                    del self.queued_punishments[key]
+            return outbound_message
+
+        return None
+
+    def wait_time(self, now):
+        """ Returns the amount of seconds until the next queued message can be sent, or None if nothing is queued """
+        if len(self) == 0:
+            return None
 
-    def can_send(self):
-        return self.num_msgs_sent < TMI.message_limit
+        self._release_tokens(now)
+        if not self.sent:
+            return 0
+
+        return max(0, self.sent[0] + self.period - now)
 
 
 class ConnectionManager:
-    def __init__(self, reactor, bot, streamer, control_hub_channel, host, port):
+    """
+    Manages the IRC connections of the bot:
+    - The main connection joins the streamer's channel, and reads all events
+    - Optionally, a separate connection for the control hub channel (reads and sends control hub messages)
+    - Optionally, `num_write_connections` send-only connections that don't join any channels.
+      Messages are sent from the least busy one, the main connection is only used if none of them is connected.
+    """
+
+    # Seconds between (re)connecting two send-only connections, so they don't all reconnect at once
+    RECONNECT_STAGGER = 2
+
+    def __init__(
+        self, reactor, bot, streamer, control_hub_channel, host, port, num_write_connections=0, control_hub_connection=False
+    ):
         self.host = host
         self.port = port
 
@@ -75,54 +270,194 @@ class ConnectionManager:
         self.reactor = reactor
         self.bot = bot
         self.main_conn = None
+        self.control_hub_conn = None
+        self.use_control_hub_connection = control_hub_connection and self.control_hub_channel is not None
+        self.write_conns = [None] * num_write_connections
+        self.ping_scheduled = False
+
+        self.outbound = OutboundMessageQueue()
+        outbound_queue_depth.set_function(lambda: len(self.outbound))
+        # Guards self.outbound, and makes sure only one thread writes to a connection at a time
+        self.outbound_lock = threading.Lock()
+        self.send_scheduled = False
 
     @RateLimiter(max_calls=1, period=2)
     def start(self):
         try:
-            self.make_new_connection()
+            channels = [self.channel]
+            if self.control_hub_channel and not self.use_control_hub_connection:
+                channels.append(self.control_hub_channel)
+            self.main_conn = self.make_new_connection("main", channels)
+
+            if self.use_control_hub_connection and self.control_hub_conn is None:
+                self.control_hub_conn = self.make_new_connection("control hub", [self.control_hub_channel])
+
+            for index, conn in enumerate(self.write_conns):
+                if conn is None:
+                    self.bot.execute_delayed(self.RECONNECT_STAGGER * (index + 1), self.reconnect_write_connection, index)
 
             phrase_data = {"nickname": self.bot.nickname, "version": self.bot.version_long}
 
             for p in self.bot.phrases["welcome"]:
                 self.bot.privmsg(p.format(**phrase_data))
 
-            # XXX
-            self.bot.execute_every(30, lambda: self.main_conn.ping("tmi.twitch.tv"))
+            if not self.ping_scheduled:
+                self.ping_scheduled = True
+                self.bot.execute_every(30, self.ping_all)
 
             return True
         except:
             log.exception("babyrage")
             return False
 
-    def make_new_connection(self):
+    def make_new_connection(self, name, channels=[]):
         ip = self.host
         port = self.port
 
+        ssl_factory = Factory(wrapper=ssl.wrap_socket)
+        conn = Connection(self.reactor, name, channels)
+        with self.reactor.mutex:
+            self.reactor.connections.append(conn)
+
         try:
-            ssl_factory = Factory(wrapper=ssl.wrap_socket)
-            self.main_conn = Connection(self.reactor)
-            with self.reactor.mutex:
-                self.reactor.connections.append(self.main_conn)
-            self.main_conn.connect(
-                ip, port, self.bot.nickname, self.bot.password, self.bot.nickname, connect_factory=ssl_factory
-            )
-            self.main_conn.cap("REQ", "twitch.tv/commands", "twitch.tv/tags")
+            conn.connect(ip, port, self.bot.nickname, self.bot.password, self.bot.nickname, connect_factory=ssl_factory)
+            conn.cap("REQ", "twitch.tv/commands", "twitch.tv/tags")
         except irc.client.ServerConnectionError:
+            log.exception(f"Failed to connect the {name} connection")
+
+        return conn
+
+    @property
+    def connections(self):
+        return [conn for conn in [self.main_conn, self.control_hub_conn, *self.write_conns] if conn is not None]
+
+    # Events about the connection itself, which are handled for every connection
+    CONNECTION_EVENTS = ("welcome", "disconnect")
+
+    def should_dispatch(self, conn, event):
+        """ Returns whether the given event received by the given connection should be handled by the bot.
+        Every connection receives the events that aren't bound to a channel (e.g. whispers), so those are only
+        handled when received by the main connection. """
+        if event.type in self.CONNECTION_EVENTS:
+            return True
+
+        if not conn.reads:
+            # Send-only connections don't read any channel
             return False
 
-    def on_disconnect(self, _chatconn):
+        if conn is self.main_conn:
+            return True
+
+        return isinstance(event.target, str) and event.target.lower() in conn.channels
+
+    def ping_all(self):
+        for conn in self.connections:
+            if conn.is_connected():
+                conn.ping("tmi.twitch.tv")
+
+    def reconnect_write_connection(self, index):
+        conn = self.write_conns[index]
+        if conn is not None and conn.is_connected():
+            return
+
+        self.write_conns[index] = conn = self.make_new_connection(f"write #{index + 1}")
+        if not conn.is_connected():
+            self.bot.execute_delayed(
+                self.RECONNECT_STAGGER * (len(self.write_conns) + 1), self.reconnect_write_connection, index
+            )
+
+    def reconnect_control_hub_connection(self):
+        if self.control_hub_conn is not None and self.control_hub_conn.is_connected():
+            return
+
+        self.control_hub_conn = self.make_new_connection("control hub", [self.control_hub_channel])
+        if not self.control_hub_conn.is_connected():
+            self.bot.execute_delayed(self.RECONNECT_STAGGER, self.reconnect_control_hub_connection)
+
+    def on_disconnect(self, chatconn):
+        if chatconn in self.write_conns:
+            index = self.write_conns.index(chatconn)
+            log.warning(f"Write connection #{index + 1} disconnected from IRC")
+            self.bot.execute_delayed(self.RECONNECT_STAGGER * (index + 1), self.reconnect_write_connection, index)
+            return
+
+        if chatconn is not None and chatconn is self.control_hub_conn:
+            log.warning("Control hub connection disconnected from IRC")
+            self.bot.execute_delayed(self.RECONNECT_STAGGER, self.reconnect_control_hub_connection)
+            return
+
+        if chatconn is not None and chatconn is not self.main_conn:
+            # An old connection that has already been replaced
+            return
+
         log.error("Disconnected from IRC")
         self.start()
 
-    def privmsg(self, channel, message, increase_message=True):
-        conn = self.main_conn
+    def pick_connection(self, channel, now):
+        """ Returns the connection a message to the given channel should be sent from, or None """
+        if channel == self.control_hub_channel and self.control_hub_conn is not None:
+            if self.control_hub_conn.is_connected():
+                return self.control_hub_conn
+
+        write_conns = [conn for conn in self.write_conns if conn is not None and conn.is_connected()]
+        if write_conns:
+            return min(write_conns, key=lambda conn: conn.load(now))
+
+        if self.main_conn is not None and self.main_conn.is_connected():
+            return self.main_conn
 
-        if conn is None or not conn.can_send():
-            log.error("No available connections to send messages from. Delaying message a few seconds.")
-            self.bot.execute_delayed(2, self.privmsg, channel, message, increase_message)
+        return None
+
+    def privmsg(self, channel, message, increase_message=True, priority=None):
+        if priority is None:
+            priority = current_outbound_priority()
+
+        with self.outbound_lock:
+            self.outbound.put(channel, message, priority, counts=increase_message)
+        messages_queued.labels(OutboundPriority(priority).name.lower()).inc()
+
+        self.send_queued_messages()
+
+    def send_queued_messages(self):
+        with self.outbound_lock:
+            if not any(conn.is_connected() for conn in self.connections):
+                if len(self.outbound) > 0:
+                    log.error("No available connections to send messages from. Delaying messages a few seconds.")
+                    self._schedule_send(2)
+                return
+
+            while True:
+                now = time.monotonic()
+                outbound_message = self.outbound.pop(now, TMI.message_limit)
+                if outbound_message is None:
+                    break
+
+                conn = self.pick_connection(outbound_message.channel, now)
+                if conn is None:
+                    log.error(f"No available connections to send message {outbound_message.message!r} from")
+                    continue
+
+                try:
+                    conn.privmsg(outbound_message.channel, outbound_message.message)
+                    conn.record_sent(now)
+                    messages_sent.labels(conn.name).inc()
+                except:
+                    log.exception(f"Failed to send message {outbound_message.message!r}")
+
+            wait_time = self.outbound.wait_time(time.monotonic())
+            if wait_time is not None:
+                self._schedule_send(wait_time)
+
+    def _schedule_send(self, delay):
+        # Only one send is scheduled at a time, no matter how many messages are waiting
+        if self.send_scheduled:
             return
 
-        conn.privmsg(channel, message)
-        if increase_message:
-            conn.num_msgs_sent += 1
-            self.bot.execute_delayed(31, conn.reduce_msgs_sent)
+        self.send_scheduled = True
+        self.bot.execute_delayed(delay, self._scheduled_send)
+
+    def _scheduled_send(self):
+        with self.outbound_lock:
+            self.send_scheduled = False
+
+        self.send_queued_messages()
@@ -0,0 +1,89 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from redis import RedisError
+
+from pajbot.managers.redis import RedisManager
+
+log = logging.getLogger(__name__)
+
+
+class UserCooldowns:
+    """
+    When each user last ran a command, as unix timestamps.
+
+    Users are forgotten once the command's user cooldown has passed for them, so the amount of entries is bounded
+    by the amount of users that ran the command within one cooldown period instead of growing forever.
+    Entries are kept in the order they were last updated, so expired entries are always at the front,
+    and removing them costs O(1) each.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # user ID -> timestamp of when the user last ran the command
+        self.last_runs = OrderedDict()
+
+    def __len__(self):
+        return len(self.last_runs)
+
+    def _expire(self, now, cooldown):
+        while self.last_runs:
+            user_id, last_run = next(iter(self.last_runs.items()))
+            if last_run + cooldown > now:
+                break
+            self.last_runs.popitem(last=False)
+
+    def get(self, user_id, now, cooldown):
+        """ Returns when the given user last ran the command, or 0 if that was at least `cooldown` seconds ago """
+        with self.lock:
+            self._expire(now, cooldown)
+            return self.last_runs.get(user_id, 0)
+
+    def set(self, user_id, now, cooldown):
+        with self.lock:
+            self.last_runs[user_id] = now
+            self.last_runs.move_to_end(user_id)
+            self._expire(now, cooldown)
+
+
+class SharedCooldowns:
+    """
+    Stores the cooldowns of commands in redis, so they survive restarts and are shared by all bot processes
+    of the same streamer.
+
+    Every command has one sorted set of user ID -> timestamp of when the user last ran the command.
+    The member GLOBAL_MEMBER holds when anyone last ran the command. Members are removed once both cooldowns
+    of the command have passed for them, and the whole key expires once nobody ran the command for that long.
+    """
+
+    GLOBAL_MEMBER = "*"
+
+    def __init__(self, streamer):
+        self.key_prefix = f"{streamer}:cooldowns:"
+
+    def get(self, cooldown_key, user_id):
+        """ Returns (when anyone last ran the command, when the given user last ran the command).
+        Each is 0 if it's unknown, or if redis could not be reached. """
+        try:
+            with RedisManager.get().pipeline(transaction=False) as pipe:
+                pipe.zscore(self.key_prefix + cooldown_key, self.GLOBAL_MEMBER)
+                pipe.zscore(self.key_prefix + cooldown_key, user_id)
+                last_run, last_run_by_user = pipe.execute()
+        except RedisError:
+            log.warning(f"Failed to get the shared cooldowns of {cooldown_key}", exc_info=True)
+            return 0, 0
+
+        return last_run or 0, last_run_by_user or 0
+
+    def set(self, cooldown_key, user_id, now, delay_all, delay_user):
+        key = self.key_prefix + cooldown_key
+        max_delay = max(delay_all, delay_user, 1)
+
+        try:
+            with RedisManager.pipeline_context() as pipe:
+                pipe.zadd(key, {self.GLOBAL_MEMBER: now, user_id: now})
+                pipe.zremrangebyscore(key, "-inf", now - max_delay)
+                pipe.expire(key, int(max_delay) + 1)
+        except RedisError:
+            log.warning(f"Failed to set the shared cooldowns of {cooldown_key}", exc_info=True)
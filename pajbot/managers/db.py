@@ -1,6 +1,10 @@
+import datetime
+import json
 import logging
+import time
 from contextlib import contextmanager
 
+from psycopg2 import sql
 from psycopg2.extensions import STATUS_IN_TRANSACTION
 from sqlalchemy import create_engine
 from sqlalchemy import event
@@ -9,10 +13,72 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 
+from pajbot.metrics import Counter, Histogram
+
 Base = declarative_base()
 
 log = logging.getLogger("pajbot")
 
+db_scope_seconds = Histogram(
+    "pajbot_db_scope_seconds",
+    "Time database session/cursor scopes were held open, by scope type and outcome (commit or rollback)",
+    ["scope", "outcome"],
+)
+
+bulk_load_rows = Counter("pajbot_db_bulk_load_rows", "Rows loaded with DBManager.bulk_load, by table", ["table"])
+bulk_load_seconds = Histogram("pajbot_db_bulk_load_seconds", "Duration of DBManager.bulk_load, by table", ["table"])
+
+
+def format_csv_value(value):
+    """ Formats a value for PostgreSQL's CSV COPY format, where NULL is an unquoted empty value """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, datetime.timedelta):
+        value = f"{value.total_seconds()} seconds"
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    else:
+        value = str(value)
+
+    return '"' + value.replace('"', '""') + '"'
+
+
+class CSVRowStream:
+    """
+    File-like object that COPY ... FROM STDIN reads from. The rows are converted to CSV lines only when they are
+    read, so rows coming from a generator never all need to be in memory at once.
+    """
+
+    def __init__(self, rows):
+        self.lines = (",".join(map(format_csv_value, row)) + "\n" for row in rows)
+        self.buffer = ""
+        self.num_rows = 0
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+
+        while size < 0 or length < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+
+            chunks.append(line)
+            length += len(line)
+            self.num_rows += 1
+
+        data = "".join(chunks)
+        if size < 0:
+            self.buffer = ""
+            return data
+
+        self.buffer = data[size:]
+        return data[:size]
+
 
 class ServerNoticeLogger:
     def append(self, notice):
@@ -89,15 +155,19 @@ class DBManager:
     @staticmethod
     @contextmanager
     def create_session_scope(**options):
+        started_at = time.perf_counter()
+        outcome = "rollback"
         session = DBManager.create_session(**options)
         try:
             yield session
             session.commit()
+            outcome = "commit"
         except:
             session.rollback()
             raise
         finally:
             session.close()
+            db_scope_seconds.labels("session", outcome).observe(time.perf_counter() - started_at)
 
     @staticmethod
     @contextmanager
@@ -189,22 +259,53 @@ class DBManager:
     @staticmethod
     @contextmanager
     def create_dbapi_cursor_scope(autocommit=False):
-        # The create_dbapi_connection_scope context manager just does basic setup/cleanup of resources,
-        # not transaction control
-        with DBManager.create_dbapi_connection_scope(autocommit=autocommit) as sql_conn:
-            if autocommit:
-                # Using the cursor as a context manager just does cleanup on the resources of the cursor,
-                # it does not perform transaction control with BEGIN/COMMIT/ROLLBACK.
-                with sql_conn.cursor() as cursor:
-                    yield cursor
-            else:
-                # Using the connection as a context manager however gives us BEGIN/COMMIT/ROLLBACK transaction control.
-                # The connection is automatically COMMITed should the inner block return without an exception,
-                # or the connection is ROLLBACKed if an exception occurs.
-                with sql_conn:
-                    # Now use cursor as context manager, to release resources correctly
+        started_at = time.perf_counter()
+        outcome = "rollback"
+        try:
+            # The create_dbapi_connection_scope context manager just does basic setup/cleanup of resources,
+            # not transaction control
+            with DBManager.create_dbapi_connection_scope(autocommit=autocommit) as sql_conn:
+                if autocommit:
+                    # Using the cursor as a context manager just does cleanup on the resources of the cursor,
+                    # it does not perform transaction control with BEGIN/COMMIT/ROLLBACK.
                     with sql_conn.cursor() as cursor:
                         yield cursor
+                else:
+                    # Using the connection as a context manager however gives us BEGIN/COMMIT/ROLLBACK transaction control.
+                    # The connection is automatically COMMITed should the inner block return without an exception,
+                    # or the connection is ROLLBACKed if an exception occurs.
+                    with sql_conn:
+                        # Now use cursor as context manager, to release resources correctly
+                        with sql_conn.cursor() as cursor:
+                            yield cursor
+            outcome = "commit"
+        finally:
+            db_scope_seconds.labels("dbapi", outcome).observe(time.perf_counter() - started_at)
+
+    @staticmethod
+    def bulk_load(cursor, table, columns, rows):
+        """
+        Loads rows (an iterable of tuples in the order of `columns`, e.g. a generator) into the given table
+        with COPY ... FROM STDIN, which is much faster than an INSERT per row.
+        cursor is a psycopg2 cursor, e.g. from create_dbapi_cursor_scope. Returns the amount of rows loaded.
+        """
+        query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+            sql.Identifier(table), sql.SQL(", ").join(sql.Identifier(column) for column in columns)
+        )
+        stream = CSVRowStream(rows)
+
+        started_at = time.perf_counter()
+        cursor.copy_expert(query.as_string(cursor), stream)
+        seconds = time.perf_counter() - started_at
+
+        bulk_load_rows.labels(table).inc(stream.num_rows)
+        bulk_load_seconds.labels(table).observe(seconds)
+        log.debug(
+            f"Loaded {stream.num_rows} rows into {table} in {seconds:.3f}s "
+            f"({stream.num_rows / seconds if seconds > 0 else 0:,.0f} rows/sec)"
+        )
+
+        return stream.num_rows
 
     @staticmethod
     def debug(raw_object):
@@ -1,6 +1,8 @@
 import logging
 
 import random
+import threading
+import time
 
 from pajbot.managers.redis import RedisManager
 from pajbot.managers.schedule import ScheduleManager
@@ -24,6 +26,12 @@ class GenericChannelEmoteManager:
         self.streamer_id = StreamHelper.get_streamer_id()
         self.global_lookup_table = {}
         self.channel_lookup_table = {}
+        # called whenever the global or channel emotes change
+        self.on_emotes_updated = None
+
+    def _emotes_updated(self):
+        if self.on_emotes_updated is not None:
+            self.on_emotes_updated()
 
     @property
     def global_emotes(self):
@@ -33,6 +41,7 @@ class GenericChannelEmoteManager:
     def global_emotes(self, value):
         self._global_emotes = value
         self.global_lookup_table = {emote.code: emote for emote in value} if value is not None else {}
+        self._emotes_updated()
 
     @property
     def channel_emotes(self):
@@ -42,6 +51,7 @@ class GenericChannelEmoteManager:
     def channel_emotes(self, value):
         self._channel_emotes = value
         self.channel_lookup_table = {emote.code: emote for emote in value} if value is not None else {}
+        self._emotes_updated()
 
     def load_global_emotes(self):
         """Load channel emotes from the cache if available, or else, query the API."""
@@ -140,6 +150,50 @@ class BTTVEmoteManager(GenericChannelEmoteManager):
         self.channel_emotes = self.api.get_channel_emotes(self.streamer_id, force_fetch=True)
 
 
+class ThirdPartyEmoteIndex:
+    """
+    Maps emote codes to FFZ and BTTV emotes, with the precedence between the providers already resolved:
+    FFZ channel -> BTTV channel -> FFZ global -> BTTV global.
+    The index is never modified after it's built, so it can be swapped out atomically by assigning a new one.
+    """
+
+    def __init__(self, ffz_channel_emotes=[], bttv_channel_emotes=[], ffz_global_emotes=[], bttv_global_emotes=[]):
+        self.emotes = {}
+
+        # from lowest to highest precedence, so emotes with a higher precedence overwrite the others
+        for emotes in (bttv_global_emotes, ffz_global_emotes, bttv_channel_emotes, ffz_channel_emotes):
+            if emotes is None:
+                continue
+            for emote in emotes:
+                self.emotes[emote.code] = emote
+
+    def __len__(self):
+        return len(self.emotes)
+
+    def match(self, word):
+        return self.emotes.get(word, None)
+
+    def find_instances(self, message, ignored_start_indices=()):
+        """Returns the EmoteInstances of all emotes in the given message (split by spaces),
+        except for the words starting at any of the ignored_start_indices"""
+        words = message.split(" ")
+
+        # Fast path: Most messages don't contain any third-party emotes. Checking this for all words at once
+        # is a lot faster than looking up the words one by one.
+        if self.emotes.keys().isdisjoint(words):
+            return []
+
+        emote_instances = []
+        for current_word_index, word in iterate_split_with_index(words):
+            emote = self.emotes.get(word, None)
+            if emote is None or current_word_index in ignored_start_indices:
+                continue
+
+            emote_instances.append(EmoteInstance(start=current_word_index, end=current_word_index + len(word), emote=emote))
+
+        return emote_instances
+
+
 class EmoteManager:
     def __init__(self, twitch_v5_api, action_queue):
         self.action_queue = action_queue
@@ -149,6 +203,11 @@ class EmoteManager:
         self.ffz_emote_manager = FFZEmoteManager()
         self.bttv_emote_manager = BTTVEmoteManager()
 
+        self.third_party_emote_index = ThirdPartyEmoteIndex()
+        self.third_party_emote_index_lock = threading.Lock()
+        self.ffz_emote_manager.on_emotes_updated = self.rebuild_third_party_emote_index
+        self.bttv_emote_manager.on_emotes_updated = self.rebuild_third_party_emote_index
+
         self.epm = {}
 
         try:
@@ -172,6 +231,16 @@ class EmoteManager:
         self.action_queue.submit(self.ffz_emote_manager.load_all)
         self.action_queue.submit(self.twitch_emote_manager.load_all)
 
+    def rebuild_third_party_emote_index(self):
+        # The lock makes sure an index built from older emotes can't replace one built from newer emotes
+        with self.third_party_emote_index_lock:
+            self.third_party_emote_index = ThirdPartyEmoteIndex(
+                ffz_channel_emotes=self.ffz_emote_manager.channel_emotes,
+                bttv_channel_emotes=self.bttv_emote_manager.channel_emotes,
+                ffz_global_emotes=self.ffz_emote_manager.global_emotes,
+                bttv_global_emotes=self.bttv_emote_manager.global_emotes,
+            )
+
     @staticmethod
     def twitch_emote_url(emote_id, size):
         return f"https://static-cdn.jtvnw.net/emoticons/v1/{emote_id}/{size}"
@@ -214,23 +283,7 @@ class EmoteManager:
         return emote_instances
 
     def match_word_to_emote(self, word):
-        emote = self.ffz_emote_manager.match_channel_emote(word)
-        if emote is not None:
-            return emote
-
-        emote = self.bttv_emote_manager.match_channel_emote(word)
-        if emote is not None:
-            return emote
-
-        emote = self.ffz_emote_manager.match_global_emote(word)
-        if emote is not None:
-            return emote
-
-        emote = self.bttv_emote_manager.match_global_emote(word)
-        if emote is not None:
-            return emote
-
-        return None
+        return self.third_party_emote_index.match(word)
 
     def parse_all_emotes(self, message, twitch_emotes_tag=""):
         # Twitch Emotes
@@ -240,24 +293,14 @@ class EmoteManager:
         # for the other providers, split the message by spaces
         # and then, if word is not a twitch emote, consider ffz channel -> bttv channel ->
         # ffz global -> bttv global in that order.
-        third_party_emote_instances = []
-
-        for current_word_index, word in iterate_split_with_index(message.split(" ")):
-            # ignore twitch emotes
-            is_twitch_emote = current_word_index in twitch_emote_start_indices
-            if is_twitch_emote:
-                continue
+        third_party_emote_instances = self.third_party_emote_index.find_instances(message, twitch_emote_start_indices)
 
-            emote = self.match_word_to_emote(word)
-            if emote is None:
-                # this word is not an emote
-                continue
-
-            third_party_emote_instances.append(
-                EmoteInstance(start=current_word_index, end=current_word_index + len(word), emote=emote)
-            )
-
-        all_instances = twitch_emote_instances + third_party_emote_instances
+        if not third_party_emote_instances:
+            if not twitch_emote_instances:
+                return [], {}
+            all_instances = twitch_emote_instances
+        else:
+            all_instances = twitch_emote_instances + third_party_emote_instances
         all_instances.sort(key=lambda instance: instance.start)
 
         return all_instances, compute_emote_counts(all_instances)
@@ -315,10 +358,60 @@ def compute_emote_counts(emote_instances):
     return emote_counts
 
 
+class EpmWindow:
+    """
+    Counts the uses of a single emote over the last `EpmWindow.SIZE` seconds, in one bucket per second.
+    Buckets are cleared lazily when time moves forward, so both adding and reading are O(1) (amortized).
+    """
+
+    SIZE = 60
+
+    __slots__ = ("buckets", "total", "last_second")
+
+    def __init__(self):
+        self.buckets = [0] * self.SIZE
+        self.total = 0
+        self.last_second = None
+
+    def advance(self, second):
+        if self.last_second is None:
+            self.last_second = second
+            return
+
+        if second <= self.last_second:
+            return
+
+        if second - self.last_second >= self.SIZE:
+            self.buckets = [0] * self.SIZE
+            self.total = 0
+        else:
+            for expired_second in range(self.last_second + 1, second + 1):
+                index = expired_second % self.SIZE
+                self.total -= self.buckets[index]
+                self.buckets[index] = 0
+
+        self.last_second = second
+
+    def add(self, second, count):
+        self.advance(second)
+        self.buckets[second % self.SIZE] += count
+        self.total += count
+
+    def get(self, second):
+        self.advance(second)
+        return self.total
+
+
 class EpmManager:
     def __init__(self):
+        # emote code -> EpmWindow
         self.epm = {}
 
+        self.lock = threading.Lock()
+
+        # emote code -> highest EPM seen since the last flush, written to redis by flush_epm_records
+        self.pending_records = {}
+
         redis = RedisManager.get()
         self.redis_zadd_if_higher = redis.register_script(
             """
@@ -337,28 +430,48 @@ end
 """
         )
 
+        ScheduleManager.execute_every(1, self.flush_epm_records)
+
     def handle_emotes(self, emote_counts):
         # passed dict maps emote code (e.g. "Kappa") to an EmoteInstanceCount instance
-        for emote_code, obj in emote_counts.items():
-            self.epm_incr(emote_code, obj.count)
+        now = int(time.monotonic())
+        with self.lock:
+            for emote_code, obj in emote_counts.items():
+                self.epm_incr(emote_code, obj.count, now)
+
+    def epm_incr(self, code, count, now):
+        window = self.epm.get(code)
+        if window is None:
+            window = self.epm[code] = EpmWindow()
+
+        window.add(now, count)
+        new_epm = window.total
 
-    def epm_incr(self, code, count):
-        new_epm = self.epm.get(code, 0) + count
-        self.epm[code] = new_epm
-        self.save_epm_record(code, new_epm)
-        ScheduleManager.execute_delayed(60, self.epm_decr, args=[code, count])
+        if new_epm > self.pending_records.get(code, 0):
+            self.pending_records[code] = new_epm
 
-    def epm_decr(self, code, count):
-        self.epm[code] -= count
+    def flush_epm_records(self):
+        with self.lock:
+            pending_records = self.pending_records
+            self.pending_records = {}
+
+        if not pending_records:
+            return
 
-    def save_epm_record(self, code, count):
         streamer = StreamHelper.get_streamer()
-        self.redis_zadd_if_higher(keys=[f"{streamer}:emotes:epmrecord", count], args=[code])
+        with RedisManager.pipeline_context() as pipe:
+            for code, count in pending_records.items():
+                self.redis_zadd_if_higher(keys=[f"{streamer}:emotes:epmrecord", count], args=[code], client=pipe)
 
     def get_emote_epm(self, emote_code):
         """Returns the current "emote per minute" usage of the given emote code,
         or None if the emote is unknown to the bot."""
-        return self.epm.get(emote_code, None)
+        with self.lock:
+            window = self.epm.get(emote_code, None)
+            if window is None:
+                return None
+
+            return window.get(int(time.monotonic()))
 
     @staticmethod
     def get_emote_epm_record(emote_code):
@@ -368,20 +481,94 @@ end
 
 
 class EcountManager:
-    @staticmethod
-    def handle_emotes(emote_counts):
+    """
+    Counts the total amount of uses of each emote in the {streamer}:emotes:count sorted set.
+
+    Counts are accumulated in memory and added to redis in a single pipeline every `flush_interval` seconds
+    (and whenever commit() is called, e.g. on shutdown), so chat messages don't have to wait for redis.
+    get_emote_count() includes the counts that have not been written to redis yet.
+    """
+
+    # How many times get_emote_count() reads the count from redis again when a flush started while it was read
+    MAX_READ_ATTEMPTS = 3
+    # Maximum amount of seconds get_emote_count() waits for the emote's counts to be written by a running flush
+    FLUSH_WAIT_TIMEOUT = 1
+
+    def __init__(self, flush_interval=5):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        # Notified when the counts that were being written to redis are written (or put back into pending)
+        self.flushed = threading.Condition(self.lock)
+
+        # emote code -> amount of uses not written to redis yet
+        self.pending = {}
+        # emote code -> amount of uses currently being written to redis
+        self.in_flight = {}
+        # Incremented every time a flush starts, see get_emote_count()
+        self.generation = 0
+
+        ScheduleManager.execute_every(flush_interval, self.commit)
+
+    def handle_emotes(self, emote_counts):
         # passed dict maps emote code (e.g. "Kappa") to an EmoteInstanceCount instance
+        with self.lock:
+            for emote_code, instance_counts in emote_counts.items():
+                self.pending[emote_code] = self.pending.get(emote_code, 0) + instance_counts.count
+
+    def commit(self):
+        # Only one flush at a time, so the scheduled flush and Bot.commit_all can't overlap
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+
+            self.in_flight = self.pending
+            self.pending = {}
+            self.generation += 1
+
         streamer = StreamHelper.get_streamer()
         redis_key = f"{streamer}:emotes:count"
-        with RedisManager.pipeline_context() as redis:
-            for emote_code, instance_counts in emote_counts.items():
-                redis.zincrby(redis_key, instance_counts.count, emote_code)
+        try:
+            with RedisManager.pipeline_context() as redis:
+                for emote_code, count in self.in_flight.items():
+                    redis.zincrby(redis_key, count, emote_code)
+        except:
+            log.exception("Failed to save emote counts to redis, will retry on next flush")
 
-    @staticmethod
-    def get_emote_count(emote_code):
+            with self.lock:
+                for emote_code, count in self.in_flight.items():
+                    self.pending[emote_code] = self.pending.get(emote_code, 0) + count
+                self.in_flight = {}
+                self.flushed.notify_all()
+            return
+
+        with self.lock:
+            self.in_flight = {}
+            self.flushed.notify_all()
+
+    def get_emote_count(self, emote_code):
         redis = RedisManager.get()
         streamer = StreamHelper.get_streamer()
-        emote_count = redis.zscore(f"{streamer}:emotes:count", emote_code)
+
+        for _ in range(self.MAX_READ_ATTEMPTS):
+            with self.lock:
+                # While the emote's counts are being written, redis may or may not include them yet
+                self.flushed.wait_for(lambda: emote_code not in self.in_flight, timeout=self.FLUSH_WAIT_TIMEOUT)
+                generation = self.generation
+
+            emote_count = redis.zscore(f"{streamer}:emotes:count", emote_code)
+
+            with self.lock:
+                unsaved_count = self.pending.get(emote_code, 0) + self.in_flight.get(emote_code, 0)
+                if self.generation == generation:
+                    # No flush started since, so redis and pending add up exactly
+                    break
+
         if emote_count is None:
-            return None
-        return int(emote_count)
+            if unsaved_count == 0:
+                return None
+            return unsaved_count
+        return int(emote_count) + unsaved_count
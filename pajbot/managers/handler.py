@@ -1,14 +1,29 @@
 import logging
 import operator
+import time
 
+from pajbot.metrics import Histogram
 from pajbot.utils import find
 
 log = logging.getLogger("pajbot")
 
+event_seconds = Histogram("pajbot_event_seconds", "Time spent running all handlers of an event", ["event"])
+handler_seconds = Histogram("pajbot_handler_seconds", "Time spent in a single event handler", ["event", "handler"])
+
+
+def handler_name(handler):
+    return getattr(handler, "__qualname__", None) or repr(handler)
+
 
 class HandlerManager:
     handlers = {}
 
+    # HandlerWatchdog that keeps track of how long each handler takes, or None
+    watchdog = None
+
+    # Handlers with at least this priority (e.g. moderation modules) are run even if the bot is overloaded
+    ESSENTIAL_PRIORITY = 100
+
     @staticmethod
     def init_handlers():
         HandlerManager.handlers = {}
@@ -90,8 +105,10 @@ class HandlerManager:
     @staticmethod
     def add_handler(event, method, priority=0):
         try:
-            HandlerManager.handlers[event].append((method, priority))
-            HandlerManager.handlers[event].sort(key=operator.itemgetter(1), reverse=True)
+            # The list is replaced instead of modified, since it might be iterated over by another thread
+            handlers = HandlerManager.handlers[event] + [(method, priority)]
+            handlers.sort(key=operator.itemgetter(1), reverse=True)
+            HandlerManager.handlers[event] = handlers
         except KeyError:
             # No handlers for this event found
             log.error(f"add_handler No handler for {event} found.")
@@ -106,26 +123,44 @@ class HandlerManager:
         try:
             handler = find(lambda h: HandlerManager.method_matches(h, method), HandlerManager.handlers[event])
             if handler is not None:
-                HandlerManager.handlers[event].remove(handler)
+                HandlerManager.handlers[event] = [h for h in HandlerManager.handlers[event] if h is not handler]
         except KeyError:
             # No handlers for this event found
             log.error(f"remove_handler No handler for {event} found.")
 
     @staticmethod
-    def trigger(event_name, stop_on_false=True, *args, **kwargs):
+    def trigger(event_name, stop_on_false=True, *args, min_priority=None, **kwargs):
+        """ Calls all handlers of the given event, in order of priority.
+        If min_priority is set, handlers with a lower priority are skipped. """
         if event_name not in HandlerManager.handlers:
             log.error(f"No handler set for event {event_name}")
             return False
 
-        for handler, _ in HandlerManager.handlers[event_name]:
-            res = None
-            try:
-                res = handler(*args, **kwargs)
-            except:
-                log.exception(f"Unhandled exception from {handler} in {event_name}")
-
-            if res is False and stop_on_false is True:
-                # Abort if handler returns false and stop_on_false is enabled
-                return False
-
-        return True
+        watchdog = HandlerManager.watchdog
+        event_started_at = time.perf_counter()
+        try:
+            for handler, priority in HandlerManager.handlers[event_name]:
+                if min_priority is not None and priority < min_priority:
+                    # Handlers are sorted by priority, so none of the remaining handlers would be run either
+                    break
+
+                res = None
+                handler_started_at = time.perf_counter()
+                if watchdog is not None:
+                    handler_stats = watchdog.begin(event_name, handler, handler_started_at)
+                try:
+                    res = handler(*args, **kwargs)
+                except:
+                    log.exception(f"Unhandled exception from {handler} in {event_name}")
+                handler_duration = time.perf_counter() - handler_started_at
+                handler_seconds.labels(event_name, handler_name(handler)).observe(handler_duration)
+                if watchdog is not None:
+                    watchdog.end(handler_stats, priority, handler_duration)
+
+                if res is False and stop_on_false is True:
+                    # Abort if handler returns false and stop_on_false is enabled
+                    return False
+
+            return True
+        finally:
+            event_seconds.labels(event_name).observe(time.perf_counter() - event_started_at)
@@ -0,0 +1,270 @@
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from pajbot.managers.handler import HandlerManager, handler_name
+
+log = logging.getLogger(__name__)
+
+
+class SlowHandlerAction:
+    # Log a warning with a stack sample of the handler while it was over budget
+    LOG = "log"
+    # Disable the module the handler belongs to (until the bot is restarted or the module is enabled again)
+    DISABLE = "disable"
+
+    ALL = (LOG, DISABLE)
+
+
+class HandlerStats:
+    """ Rolling wall-time statistics of a single handler of a single event """
+
+    __slots__ = (
+        "event",
+        "handler",
+        "budget",
+        "durations",
+        "num_over_budget",
+        "num_calls",
+        "total_seconds",
+        "stack_sample",
+        "sampled_call_started_at",
+        "last_action_at",
+    )
+
+    def __init__(self, event, handler, budget, window):
+        self.event = event
+        self.handler = handler
+        self.budget = budget
+
+        # Durations of the last `window` calls, and how many of those were over budget
+        self.durations = collections.deque(maxlen=window)
+        self.num_over_budget = 0
+
+        self.num_calls = 0
+        self.total_seconds = 0.0
+
+        # Stack of the handler's thread the last time it was caught running over budget
+        self.stack_sample = None
+        self.sampled_call_started_at = None
+
+        self.last_action_at = None
+
+    @property
+    def name(self):
+        return handler_name(self.handler)
+
+    def observe(self, seconds):
+        if len(self.durations) == self.durations.maxlen and self.durations[0] > self.budget:
+            self.num_over_budget -= 1
+
+        self.durations.append(seconds)
+        if seconds > self.budget:
+            self.num_over_budget += 1
+
+        self.num_calls += 1
+        self.total_seconds += seconds
+
+    def percentile(self, percent):
+        """ Returns the given percentile (nearest-rank) of the durations in the window, in seconds """
+        if not self.durations:
+            return 0.0
+
+        durations = sorted(self.durations)
+        index = max(0, min(len(durations) - 1, int(round(percent / 100 * len(durations))) - 1))
+        return durations[index]
+
+
+class HandlerWatchdog:
+    """
+    Keeps rolling wall-time statistics of every event handler called through HandlerManager.trigger,
+    and acts on handlers that keep going over the time budget of their event.
+
+    A handler "keeps going over budget" when at least `strikes` of its last `window` calls took longer than
+    the budget. The configured action (see SlowHandlerAction) is then taken. Handlers with a priority of
+    at least HandlerManager.ESSENTIAL_PRIORITY (e.g. moderation) and handlers that don't belong to a module that
+    can be disabled are never disabled, their slowness is only logged.
+
+    Slow handlers are never moved off the thread that triggered the event: Handlers modify `source` and other
+    objects of the event's database session, and module state that is only safe to touch from that thread.
+
+    Stack samples are taken by a background thread that looks at the handlers that are currently running
+    every `sample_interval` seconds, and grabs the stack of those running over budget.
+    """
+
+    DEFAULT_BUDGET = 0.25
+    DEFAULT_EVENT_BUDGETS = {"on_message": 0.05, "on_pubmsg": 0.05, "on_usernotice": 0.05}
+
+    # Minimum amount of seconds between two warnings logged about the same handler
+    LOG_INTERVAL = 300
+
+    def __init__(
+        self,
+        bot,
+        action=SlowHandlerAction.LOG,
+        default_budget=DEFAULT_BUDGET,
+        event_budgets={},
+        strikes=10,
+        window=100,
+        sample_interval=0.05,
+    ):
+        if action not in SlowHandlerAction.ALL:
+            raise ValueError(f"Invalid slow handler action {action!r}, must be one of {SlowHandlerAction.ALL}")
+
+        self.bot = bot
+        self.action = action
+        self.default_budget = default_budget
+        self.event_budgets = {**self.DEFAULT_EVENT_BUDGETS, **event_budgets}
+        self.strikes = strikes
+        self.window = window
+        self.sample_interval = sample_interval
+
+        self.lock = threading.Lock()
+        # (event, handler) -> HandlerStats
+        self.stats = {}
+
+        # thread ID -> stack of [HandlerStats, time.perf_counter() of when the call started] of running handlers
+        self.running = {}
+
+        self.sampler = None
+        self.stopped = threading.Event()
+
+    @classmethod
+    def from_config(cls, bot, section):
+        """ Creates a watchdog from the [handler_watchdog] config section, or with the defaults if section is None """
+        if section is None:
+            return cls(bot)
+
+        event_budgets = {
+            key[len("budget_") :]: float(value) / 1000 for key, value in section.items() if key.startswith("budget_")
+        }
+
+        return cls(
+            bot,
+            action=section.get("action", SlowHandlerAction.LOG),
+            default_budget=section.getfloat("default_budget", cls.DEFAULT_BUDGET * 1000) / 1000,
+            event_budgets=event_budgets,
+            strikes=section.getint("strikes", 10),
+            window=section.getint("window", 100),
+            sample_interval=section.getfloat("sample_interval", 50) / 1000,
+        )
+
+    def start(self):
+        self.sampler = threading.Thread(target=self._sample_forever, name="HandlerWatchdogSampler", daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def budget(self, event):
+        return self.event_budgets.get(event, self.default_budget)
+
+    def _get_stats(self, event, handler):
+        key = (event, handler)
+        stats = self.stats.get(key, None)
+        if stats is None:
+            with self.lock:
+                stats = self.stats.setdefault(key, HandlerStats(event, handler, self.budget(event), self.window))
+        return stats
+
+    def begin(self, event, handler, started_at):
+        stats = self._get_stats(event, handler)
+        self.running.setdefault(threading.get_ident(), []).append([stats, started_at])
+        return stats
+
+    def end(self, stats, priority, seconds):
+        running = self.running.get(threading.get_ident(), None)
+        if running:
+            running.pop()
+
+        with self.lock:
+            stats.observe(seconds)
+            keeps_going_over_budget = stats.num_over_budget >= self.strikes
+
+        if keeps_going_over_budget:
+            self._on_over_budget(stats, priority)
+
+    def _on_over_budget(self, stats, priority):
+        with self.lock:
+            now = time.monotonic()
+
+            if self.action == SlowHandlerAction.LOG or priority >= HandlerManager.ESSENTIAL_PRIORITY:
+                action = SlowHandlerAction.LOG
+            else:
+                action = self.action
+
+            if action == SlowHandlerAction.LOG:
+                if stats.last_action_at is not None and now - stats.last_action_at < self.LOG_INTERVAL:
+                    return
+            elif stats.last_action_at is not None:
+                # The handler's module has already been disabled
+                return
+
+            stats.last_action_at = now
+
+        summary = (
+            f"{stats.name} went over the {stats.budget * 1000:.0f}ms budget of {stats.event} "
+            f"in {stats.num_over_budget} of its last {len(stats.durations)} calls "
+            f"(p50 {stats.percentile(50) * 1000:.1f}ms, p95 {stats.percentile(95) * 1000:.1f}ms)"
+        )
+
+        if action == SlowHandlerAction.DISABLE:
+            self.bot.execute_now(self._disable_module, stats, summary)
+        else:
+            stack_sample = stats.stack_sample or "(no stack sample was taken)\n"
+            log.warning(f"{summary}. Stack sample:\n{stack_sample}")
+
+    def _disable_module(self, stats, summary):
+        from pajbot.modules.base import BaseModule, ModuleType
+
+        module = getattr(stats.handler, "__self__", None)
+        if not isinstance(module, BaseModule) or module.MODULE_TYPE > ModuleType.TYPE_NORMAL:
+            log.warning(f"{summary}. The handler does not belong to a module that can be disabled")
+            return
+
+        if not self.bot.module_manager.disable_module(module.ID):
+            return
+
+        self.bot.commands.rebuild()
+        log.warning(f"{summary}, disabled the {module.ID} module")
+
+    def _sample_forever(self):
+        while not self.stopped.wait(self.sample_interval):
+            try:
+                self.sample()
+            except:
+                log.exception("Failed to sample the stacks of slow handlers")
+
+    def sample(self):
+        now = time.perf_counter()
+        frames = None
+
+        for thread_id, running in list(self.running.items()):
+            try:
+                stats, started_at = running[-1]
+            except IndexError:
+                continue
+
+            if now - started_at <= stats.budget or stats.sampled_call_started_at == started_at:
+                continue
+
+            if frames is None:
+                frames = sys._current_frames()
+
+            frame = frames.get(thread_id, None)
+            if frame is None:
+                continue
+
+            stats.stack_sample = "".join(traceback.format_stack(frame))
+            stats.sampled_call_started_at = started_at
+
+    def top_offenders(self, limit=5):
+        """ Returns the stats of the handlers that spent the most time over their budget, slowest first """
+        with self.lock:
+            all_stats = [stats for stats in self.stats.values() if stats.num_over_budget > 0]
+
+        all_stats.sort(key=lambda stats: (stats.num_over_budget, stats.percentile(95)), reverse=True)
+        return all_stats[:limit]
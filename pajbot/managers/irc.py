@@ -1,6 +1,7 @@
 import logging
 
 from pajbot.managers.connection import ConnectionManager
+from pajbot.managers.irc_recorder import IRCTrafficRecorder
 
 log = logging.getLogger(__name__)
 
@@ -32,21 +33,46 @@ class IRCManager:
             control_hub_channel=chub,
             host="irc.chat.twitch.tv",
             port=6697,
+            num_write_connections=self.bot.config["main"].getint("write_connections", 0),
+            control_hub_connection=self.bot.config["main"].getboolean("control_hub_connection", False),
         )
 
+        # Optionally record all inbound IRC traffic, so it can be replayed later (see scripts/benchmark-replay.py)
+        self.recorder = None
+        record_directory = self.bot.config["main"].get("irc_record_directory", None)
+        if record_directory:
+            self.recorder = IRCTrafficRecorder(
+                record_directory,
+                max_file_size=self.bot.config["main"].getint("irc_record_max_file_size", 64) * 1024 * 1024,
+                max_total_size=self.bot.config["main"].getint("irc_record_max_total_size", 1024) * 1024 * 1024,
+            )
+            log.info(f"Recording IRC traffic to {record_directory}")
+
     def start(self):
         self.connection_manager.start()
 
-    def whisper(self, username, message):
-        self.connection_manager.privmsg(f"#{self.bot.nickname}", f"/w {username} {message}")
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.stop(timeout=5)
+            self.recorder = None
+
+    def whisper(self, username, message, priority=None):
+        self.connection_manager.privmsg(f"#{self.bot.nickname}", f"/w {username} {message}", priority=priority)
 
-    def privmsg(self, message, channel, increase_message=True):
-        self.connection_manager.privmsg(channel, message, increase_message=increase_message)
+    def privmsg(self, message, channel, increase_message=True, priority=None):
+        self.connection_manager.privmsg(channel, message, increase_message=increase_message, priority=priority)
 
     def on_disconnect(self, chatconn, event):
         self.connection_manager.on_disconnect(chatconn)
 
     def _dispatcher(self, connection, event):
+        if not self.connection_manager.should_dispatch(connection, event):
+            # Every other connection receives these events too, see ConnectionManager.should_dispatch
+            return
+
+        if self.recorder is not None:
+            self.recorder.record(event)
+
         method = getattr(self.bot, "on_" + event.type, do_nothing)
         try:
             method(connection, event)
@@ -54,8 +80,9 @@ class IRCManager:
             log.exception("Logging an uncaught exception (IRC event handler)")
 
     def on_welcome(self, conn, event):
-        log.info("Successfully connected and authenticated with IRC")
-        conn.join(",".join(self.channels))
+        log.info(f"Successfully connected and authenticated with IRC ({conn.name} connection)")
+        if conn.reads:
+            conn.join(",".join(conn.channels))
 
     def on_connect(self, sock):
         pass
@@ -0,0 +1,233 @@
+import gzip
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+
+from irc.client import Event, NickMask
+
+log = logging.getLogger(__name__)
+
+# Every recording file starts with this
+MAGIC = b"PJIRC\x00\x01\n"
+# Every record is prefixed with its length, as an unsigned 32-bit big-endian integer
+LENGTH_PREFIX = struct.Struct(">I")
+
+
+class RecordedEvent:
+    __slots__ = ("received_at", "event")
+
+    def __init__(self, received_at, event):
+        # Unix timestamp of when the bot received the event
+        self.received_at = received_at
+        self.event = event
+
+    def encode(self):
+        event = self.event
+        tags = [[tag["key"], tag["value"]] for tag in event.tags] if event.tags else []
+        source = str(event.source) if event.source is not None else None
+        record = [self.received_at, event.type, source, event.target, list(event.arguments), tags]
+        return json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    @classmethod
+    def decode(cls, data):
+        received_at, event_type, source, target, arguments, tags = json.loads(data.decode("utf-8"))
+        source = NickMask(source) if source is not None else None
+        tags = [{"key": key, "value": value} for key, value in tags]
+        return cls(received_at, Event(event_type, source, target, arguments, tags))
+
+
+class IRCTrafficRecorder:
+    """
+    Records every inbound IRC event to gzip-compressed files in `directory`, for replaying it later
+    (see read_recordings and scripts/benchmark-replay.py).
+
+    record() only puts the event on a queue, the events are encoded, compressed and written by a background thread
+    so the IRC thread is never slowed down by disk I/O. If the writer can't keep up and more than `max_queue_size`
+    events are waiting, new events are dropped (and counted in num_dropped).
+
+    A new file is started once the current one holds `max_file_size` bytes of uncompressed records. The oldest files
+    are deleted whenever the files in the directory take up more than `max_total_size` bytes on disk.
+    """
+
+    FILE_PREFIX = "irc-"
+    FILE_SUFFIX = ".rec.gz"
+
+    # Seconds the writer waits for new events before flushing the current file, so a crash loses at most this much
+    FLUSH_INTERVAL = 5
+
+    def __init__(
+        self, directory, max_file_size=64 * 1024 * 1024, max_total_size=1024 * 1024 * 1024, max_queue_size=100000
+    ):
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.max_total_size = max_total_size
+
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.stopped = threading.Event()
+        self.num_recorded = 0
+        self.num_dropped = 0
+
+        self.current_file = None
+        self.current_file_size = 0
+        self.file_number = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.writer = threading.Thread(target=self._write_forever, name="IRCTrafficRecorder", daemon=True)
+        self.writer.start()
+
+    def record(self, event):
+        if event.type == "all_raw_messages" or self.stopped.is_set():
+            return
+
+        try:
+            self.queue.put_nowait(RecordedEvent(time.time(), event))
+        except queue.Full:
+            self.num_dropped += 1
+
+    def stop(self, timeout=None):
+        """ Writes the events that are already queued and closes the current file.
+        Waits at most `timeout` seconds for that, the rest of the queue is then written in the background. """
+        self.stopped.set()
+
+        # Wakes up the writer if it's waiting for events. If the queue is full, it isn't.
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+        self.writer.join(timeout)
+        if self.writer.is_alive():
+            log.warning(f"Still writing {self.queue.qsize()} recorded IRC events after stopping the recorder")
+
+    def _write_forever(self):
+        while True:
+            try:
+                # Once stopped, only the events that are already queued are written
+                recorded_event = self.queue.get(timeout=0 if self.stopped.is_set() else self.FLUSH_INTERVAL)
+            except queue.Empty:
+                if self.stopped.is_set():
+                    break
+
+                if self.current_file is not None:
+                    self.current_file.flush()
+                continue
+
+            if recorded_event is None:
+                break
+
+            try:
+                self._write(recorded_event)
+            except:
+                log.exception("Failed to record IRC event")
+
+        self._close_current_file()
+
+    def _write(self, recorded_event):
+        data = recorded_event.encode()
+
+        if self.current_file is None or self.current_file_size >= self.max_file_size:
+            self._rotate()
+
+        self.current_file.write(LENGTH_PREFIX.pack(len(data)))
+        self.current_file.write(data)
+        self.current_file_size += LENGTH_PREFIX.size + len(data)
+        self.num_recorded += 1
+
+    def _rotate(self):
+        self._close_current_file()
+
+        # Sorting the file names sorts the files by when they were started
+        self.file_number += 1
+        started_at = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        file_name = f"{self.FILE_PREFIX}{started_at}-{self.file_number:06d}{self.FILE_SUFFIX}"
+
+        self.current_file = gzip.open(os.path.join(self.directory, file_name), "wb", compresslevel=6)
+        self.current_file.write(MAGIC)
+        self.current_file_size = len(MAGIC)
+
+        self._delete_old_files()
+
+    def _close_current_file(self):
+        if self.current_file is not None:
+            self.current_file.close()
+            self.current_file = None
+
+    def _delete_old_files(self):
+        file_names = sorted(
+            file_name
+            for file_name in os.listdir(self.directory)
+            if file_name.startswith(self.FILE_PREFIX) and file_name.endswith(self.FILE_SUFFIX)
+        )
+        file_sizes = [(name, os.path.getsize(os.path.join(self.directory, name))) for name in file_names]
+        total_size = sum(size for _, size in file_sizes)
+
+        # The newest file is the one that was just started
+        for file_name, size in file_sizes[:-1]:
+            if total_size <= self.max_total_size:
+                break
+
+            os.remove(os.path.join(self.directory, file_name))
+            total_size -= size
+            log.info(f"Deleted IRC recording {file_name} to stay below {self.max_total_size} bytes")
+
+
+def read_recording(path):
+    """ Yields the RecordedEvents in the given recording file. A file that was cut off (e.g. because the bot
+    crashed while writing it) is read up to the last complete record. """
+    with gzip.open(path, "rb") as recording:
+        if recording.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an IRC recording")
+
+        while True:
+            try:
+                length_prefix = recording.read(LENGTH_PREFIX.size)
+                if len(length_prefix) < LENGTH_PREFIX.size:
+                    return
+
+                (length,) = LENGTH_PREFIX.unpack(length_prefix)
+                data = recording.read(length)
+            except EOFError:
+                log.warning(f"{path} was cut off, stopped reading at the last complete record")
+                return
+
+            if len(data) < length:
+                log.warning(f"{path} was cut off, stopped reading at the last complete record")
+                return
+
+            yield RecordedEvent.decode(data)
+
+
+def read_recordings(paths):
+    """ Yields the RecordedEvents of all given recording files, in order of their file names """
+    for path in sorted(paths, key=os.path.basename):
+        yield from read_recording(path)
+
+
+def paced(recorded_events, speed=1.0):
+    """
+    Yields the given RecordedEvents at the pace they were received at, sped up by `speed` (e.g. 2 = twice as fast).
+    With a speed of 0 (or None), the events are yielded as fast as possible.
+    """
+    if not speed:
+        yield from recorded_events
+        return
+
+    first_received_at = None
+    started_at = None
+    for recorded_event in recorded_events:
+        if first_received_at is None:
+            first_received_at = recorded_event.received_at
+            started_at = time.monotonic()
+
+        due_at = started_at + (recorded_event.received_at - first_received_at) / speed
+        delay = due_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        yield recorded_event
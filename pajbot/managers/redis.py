@@ -1,9 +1,16 @@
 import logging
+import time
+from contextlib import contextmanager
 
 import redis
 
+from pajbot.metrics import Counter, Histogram
+
 log = logging.getLogger(__name__)
 
+redis_pipeline_seconds = Histogram("pajbot_redis_pipeline_seconds", "Time spent executing redis pipelines")
+redis_pipeline_commands = Counter("pajbot_redis_pipeline_commands_total", "Commands sent to redis in pipelines")
+
 
 class RedisManager:
     """
@@ -23,8 +30,16 @@ class RedisManager:
         return RedisManager.redis
 
     @staticmethod
+    @contextmanager
     def pipeline_context():
-        return redis.utils.pipeline(RedisManager.get())
+        pipeline = RedisManager.get().pipeline()
+        yield pipeline
+
+        num_commands = len(pipeline)
+        started_at = time.perf_counter()
+        pipeline.execute()
+        redis_pipeline_seconds.observe(time.perf_counter() - started_at)
+        redis_pipeline_commands.inc(num_commands)
 
     @classmethod
     def publish(cls, channel, message):
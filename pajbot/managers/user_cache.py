@@ -0,0 +1,257 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import chain
+
+from psycopg2.extras import execute_values
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from pajbot.managers.db import DBManager
+from pajbot.models.user import User
+from pajbot.utils import time_method
+
+log = logging.getLogger(__name__)
+
+
+class PendingUserUpdate:
+    """ Coalesced write-behind data for a single user that has not been flushed to the database yet """
+
+    __slots__ = ("last_seen", "last_active", "num_lines")
+
+    def __init__(self):
+        self.last_seen = None
+        self.last_active = None
+        self.num_lines = 0
+
+    def merge(self, other):
+        self.last_seen = _max_or_none(self.last_seen, other.last_seen)
+        self.last_active = _max_or_none(self.last_active, other.last_active)
+        self.num_lines += other.num_lines
+
+
+def _login_or_name_changed(user):
+    state = inspect(user)
+    if not state.persistent:
+        # new or deleted
+        return True
+
+    return state.attrs["_login"].history.has_changes() or state.attrs["name"].history.has_changes()
+
+
+def _max_or_none(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+class UserCacheManager:
+    """
+    Keeps track of recently active users so the bot does not have to UPDATE the login and name of a user row
+    for every single chat message, and batches the per-message updates of those users.
+
+    The user row itself is always loaded fresh by the message's session. Modules write absolute values computed
+    from `source` (e.g. source.points -= cost), so handing them a copy that might have been changed by the web
+    interface, raw SQL or another session in the meantime would silently undo those changes.
+    What is cached is the login and name the user had when they were last seen, so the UPDATE that refreshes
+    login_last_updated (see User.from_basics) is only issued when the user is not cached or their name changed.
+
+    The high-frequency per-message updates (last_seen, last_active, num_lines) are not written by the message
+    session. They are instead applied to the user object in memory, coalesced per user, and written to the
+    database in one batch whenever commit() is called (Bot.commit_all, and on shutdown).
+
+    Entries are evicted by LRU once `max_size` is reached, and expire after `ttl` seconds.
+    Other sessions inside this process that change the login or name of a user evict that user immediately.
+    Code that changes logins or names with raw SQL should invalidate() the affected users. Changes to any other
+    column don't need to be invalidated, since those are always loaded from the database.
+    """
+
+    SESSION_INFO_KEY = "user_cache_source_id"
+
+    BULK_UPDATE_QUERY = """
+UPDATE "user" SET
+    last_seen = GREATEST("user".last_seen, v.last_seen),
+    last_active = GREATEST("user".last_active, v.last_active),
+    num_lines = "user".num_lines + v.num_lines
+FROM (VALUES %s) AS v(id, last_seen, last_active, num_lines)
+WHERE "user".id = v.id"""
+    BULK_UPDATE_TEMPLATE = "(%s, %s::timestamptz, %s::timestamptz, %s::bigint)"
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.lock = threading.Lock()
+
+        # user ID -> ((login, name), time.monotonic() of when it was cached)
+        self.users = OrderedDict()
+
+        # user ID -> PendingUserUpdate
+        self.pending = {}
+
+        # incremented every time a user is invalidated by something other than the user's own message session.
+        # Used to avoid re-caching a login and name that might have been made stale while the message was processed.
+        self.invalidations = 0
+
+        event.listen(Session, "after_flush", self._on_after_flush)
+
+    @contextmanager
+    def user_scope(self, basics):
+        """
+        Opens a session scope and yields the User for the given UserBasics, loaded by that session.
+        After the session has been committed successfully, the user is stored in the cache again.
+        """
+
+        invalidations_before = self.invalidations
+
+        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
+            db_session.info[self.SESSION_INFO_KEY] = basics.id
+            user = self._get(db_session, basics)
+            yield user
+
+        # Only reached when the session was committed without any exceptions
+        if self.invalidations == invalidations_before:
+            self._put(user)
+
+    def _get(self, db_session, basics):
+        cached_names = None
+
+        with self.lock:
+            entry = self.users.get(basics.id)
+            if entry is not None:
+                cached_names, cached_at = entry
+                if time.monotonic() - cached_at > self.ttl:
+                    del self.users[basics.id]
+                    cached_names = None
+                else:
+                    self.users.move_to_end(basics.id)
+
+        user = None
+        if cached_names == (basics.login, basics.name):
+            # The login and name in the database are up to date, only load the row
+            user = db_session.query(User).get(basics.id)
+
+        if user is None:
+            # Cache miss (or the user's name changed): This also updates the login and name of the user,
+            # which refreshes login_last_updated.
+            user = User.from_basics(db_session, basics)
+
+        # The database does not know about the changes we have not flushed yet, apply them on top.
+        with self.lock:
+            pending = self.pending.get(basics.id)
+            if pending is not None and inspect(user).persistent:
+                set_committed_value(user, "last_seen", _max_or_none(user.last_seen, pending.last_seen))
+                set_committed_value(user, "last_active", _max_or_none(user.last_active, pending.last_active))
+                set_committed_value(user, "num_lines", user.num_lines + pending.num_lines)
+
+        return user
+
+    def _put(self, user):
+        with self.lock:
+            self.users[user.id] = ((user.login, user.name), time.monotonic())
+            self.users.move_to_end(user.id)
+
+            while len(self.users) > self.max_size:
+                self.users.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.users.pop(user_id, None)
+            self.invalidations += 1
+
+    def invalidate_all(self):
+        with self.lock:
+            self.users.clear()
+            self.invalidations += 1
+
+    def _on_after_flush(self, session, _flush_context):
+        own_user_id = session.info.get(self.SESSION_INFO_KEY, None)
+
+        user_ids = {
+            obj.id
+            for obj in chain(session.new, session.dirty, session.deleted)
+            if isinstance(obj, User) and obj.id != own_user_id and _login_or_name_changed(obj)
+        }
+
+        if not user_ids:
+            return
+
+        with self.lock:
+            for user_id in user_ids:
+                self.users.pop(user_id, None)
+            self.invalidations += 1
+
+    def _pending_update(self, user):
+        """ Returns the PendingUserUpdate for the given user, or None if the user is not in the database yet.
+        New users are still INSERTed by their session, so the values can be set on the object directly. """
+
+        if not inspect(user).persistent:
+            return None
+
+        pending = self.pending.get(user.id)
+        if pending is None:
+            pending = self.pending[user.id] = PendingUserUpdate()
+        return pending
+
+    def touch(self, user, now):
+        """ Sets last_seen and last_active of the given user, without making the user's session issue an UPDATE """
+
+        with self.lock:
+            pending = self._pending_update(user)
+            if pending is None:
+                user.last_seen = now
+                user.last_active = now
+                return
+
+            pending.last_seen = _max_or_none(pending.last_seen, now)
+            pending.last_active = _max_or_none(pending.last_active, now)
+
+        set_committed_value(user, "last_seen", now)
+        set_committed_value(user, "last_active", now)
+
+    def increment_num_lines(self, user, amount=1):
+        """ Increments num_lines of the given user, without making the user's session issue an UPDATE """
+
+        with self.lock:
+            pending = self._pending_update(user)
+            if pending is None:
+                user.num_lines += amount
+                return
+
+            pending.num_lines += amount
+
+        set_committed_value(user, "num_lines", user.num_lines + amount)
+
+    @time_method
+    def commit(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+
+        if not pending:
+            return
+
+        rows = [(user_id, p.last_seen, p.last_active, p.num_lines) for user_id, p in pending.items()]
+
+        try:
+            with DBManager.create_dbapi_cursor_scope() as cursor:
+                execute_values(cursor, self.BULK_UPDATE_QUERY, rows, template=self.BULK_UPDATE_TEMPLATE, page_size=1000)
+        except:
+            log.exception(f"Failed to flush {len(rows)} cached user updates, will retry on next commit")
+
+            # Put the updates back, coalescing them with anything that came in since
+            with self.lock:
+                for user_id, p in pending.items():
+                    newer = self.pending.get(user_id)
+                    if newer is not None:
+                        p.merge(newer)
+                    self.pending[user_id] = p
+            return
+
+        log.debug(f"Flushed cached updates for {len(rows)} users")
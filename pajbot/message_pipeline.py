@@ -0,0 +1,143 @@
+import logging
+import queue
+import threading
+import time
+
+from pajbot.metrics import Gauge, Histogram
+
+log = logging.getLogger(__name__)
+
+message_pipeline_depth = Gauge("pajbot_message_pipeline_depth", "Chat messages waiting to be handled")
+message_queue_seconds = Histogram("pajbot_message_queue_seconds", "Time chat messages waited for a worker")
+message_handle_seconds = Histogram("pajbot_message_handle_seconds", "Time spent handling a chat message")
+
+
+class MessagePipelineStats:
+    """ Cumulative counters for one stage (waiting in the queue, or being handled) of the message pipeline """
+
+    __slots__ = ("count", "total_seconds", "max_seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total_seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "avg_seconds": self.total_seconds / self.count if self.count > 0 else 0.0,
+            "max_seconds": self.max_seconds,
+        }
+
+
+class MessagePipeline:
+    """
+    Handles incoming chat messages on a pool of worker threads, so the IRC reactor thread
+    only has to parse and enqueue them.
+
+    Every worker has its own queue, and messages are assigned to a worker by a key (the user ID),
+    so messages from the same user are always handled in the order they were received.
+
+    When a worker's queue is longer than `overload_threshold` messages, the worker is considered overloaded.
+    The handling function is then called with overloaded=True, so it can skip work that is not essential
+    (see Bot.parse_message).
+
+    `lock` is the lock the handling functions hold while they run module handlers (see Bot.handler_lock),
+    so stop() can let the workers finish even if it's called while holding it.
+    """
+
+    def __init__(self, num_workers=1, overload_threshold=200, lock=None):
+        self.overload_threshold = overload_threshold
+
+        # Notified whenever a worker stops
+        self.worker_stopped = threading.Condition(lock if lock is not None else threading.RLock())
+        self.num_running_workers = max(1, num_workers)
+
+        self.lock = threading.Lock()
+        self.queue_stats = MessagePipelineStats()
+        self.handle_stats = MessagePipelineStats()
+        self.num_overloaded = 0
+        self.last_overload_warning = 0
+
+        message_pipeline_depth.set_function(lambda: self.depth)
+
+        self.queues = []
+        self.workers = []
+        for i in range(max(1, num_workers)):
+            worker_queue = queue.Queue()
+            worker = threading.Thread(
+                target=self._run, args=(worker_queue,), name=f"MessagePipelineWorker-{i}", daemon=True
+            )
+            self.queues.append(worker_queue)
+            self.workers.append(worker)
+            worker.start()
+
+    def submit(self, key, function, *args, **kwargs):
+        worker_queue = self.queues[hash(key) % len(self.queues)]
+        worker_queue.put((time.monotonic(), function, args, kwargs))
+
+    def _run(self, worker_queue):
+        while True:
+            item = worker_queue.get()
+            if item is None:
+                with self.worker_stopped:
+                    self.num_running_workers -= 1
+                    self.worker_stopped.notify_all()
+                return
+
+            enqueued_at, function, args, kwargs = item
+            started_at = time.monotonic()
+            overloaded = worker_queue.qsize() > self.overload_threshold
+            if overloaded:
+                self._on_overloaded(worker_queue.qsize())
+
+            try:
+                function(*args, overloaded=overloaded, **kwargs)
+            except:
+                log.exception("Logging an uncaught exception (MessagePipeline)")
+
+            finished_at = time.monotonic()
+            with self.lock:
+                self.queue_stats.observe(started_at - enqueued_at)
+                self.handle_stats.observe(finished_at - started_at)
+            message_queue_seconds.observe(started_at - enqueued_at)
+            message_handle_seconds.observe(finished_at - started_at)
+
+    def _on_overloaded(self, depth):
+        with self.lock:
+            self.num_overloaded += 1
+            now = time.monotonic()
+            if now - self.last_overload_warning < 30:
+                return
+            self.last_overload_warning = now
+
+        log.warning(f"Message pipeline is overloaded ({depth} messages queued), skipping low-priority handlers")
+
+    @property
+    def depth(self):
+        return sum(worker_queue.qsize() for worker_queue in self.queues)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": len(self.workers),
+                "depth": self.depth,
+                "overloaded": self.num_overloaded,
+                "queue": self.queue_stats.as_dict(),
+                "handle": self.handle_stats.as_dict(),
+            }
+
+    def stop(self, timeout=None):
+        """ Stops the workers after they have handled the messages already queued """
+        for worker_queue in self.queues:
+            worker_queue.put(None)
+
+        # Waiting releases the lock, even if the caller holds it (e.g. the IRC thread)
+        with self.worker_stopped:
+            self.worker_stopped.wait_for(lambda: self.num_running_workers == 0, timeout)
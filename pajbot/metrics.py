@@ -0,0 +1,289 @@
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the histogram buckets used for latencies, from half a millisecond to ten seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(float(value))
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class MetricsRegistry:
+    """ Collection of metrics that can be exported in the Prometheus text exposition format """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"A metric named {metric.name} is already registered")
+
+            self.metrics[metric.name] = metric
+
+    def expose(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Metric:
+    """
+    Base class of all metrics. Metrics with label names need to be accessed through labels(),
+    e.g. some_counter.labels("on_message").inc(). Metrics without label names can be used directly.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self.lock = threading.Lock()
+        # tuple of label values -> child (the value for these label values)
+        self.children = {}
+
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *labelvalues):
+        child = self.children.get(labelvalues, None)
+        if child is not None:
+            return child
+
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {labelvalues}")
+
+        with self.lock:
+            return self.children.setdefault(labelvalues, self._new_child())
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def samples(self):
+        with self.lock:
+            children = list(self.children.items())
+
+        lines = []
+        for labelvalues, child in children:
+            lines.extend(child.samples(self.name, self.labelnames, labelvalues))
+        return lines
+
+
+class CounterChild:
+    __slots__ = ("lock", "value")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError("Counters can only be incremented")
+
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, labelvalues):
+        return [f"{name}{format_labels(labelnames, labelvalues)} {format_value(self.value)}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class GaugeChild:
+    __slots__ = ("lock", "value", "function")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set_function(self, function):
+        """ Makes the gauge call the given function for its value whenever it's exported """
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            return self.function()
+
+        return self.value
+
+    def samples(self, name, labelnames, labelvalues):
+        try:
+            value = self.get()
+        except:
+            log.exception(f"Failed to get the value of {name}")
+            return []
+
+        return [f"{name}{format_labels(labelnames, labelvalues)} {format_value(value)}"]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+
+class HistogramChild:
+    __slots__ = ("lock", "upper_bounds", "bucket_counts", "sum", "count")
+
+    def __init__(self, upper_bounds):
+        self.lock = threading.Lock()
+        self.upper_bounds = upper_bounds
+        # Not cumulative, the last bucket is +Inf
+        self.bucket_counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.upper_bounds, value)
+        with self.lock:
+            self.bucket_counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at)
+
+    def samples(self, name, labelnames, labelvalues):
+        with self.lock:
+            bucket_counts = list(self.bucket_counts)
+            total = self.sum
+            count = self.count
+
+        bucket_labelnames = labelnames + ("le",)
+        lines = []
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip(self.upper_bounds + (math.inf,), bucket_counts):
+            cumulative_count += bucket_count
+            bucket_labels = format_labels(bucket_labelnames, labelvalues + (format_value(upper_bound),))
+            lines.append(f"{name}_bucket{bucket_labels} {format_value(cumulative_count)}")
+
+        labels = format_labels(labelnames, labelvalues)
+        lines.append(f"{name}_sum{labels} {format_value(total)}")
+        lines.append(f"{name}_count{labels} {format_value(count)}")
+        return lines
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        self.upper_bounds = tuple(sorted(float(bucket) for bucket in buckets if not math.isinf(bucket)))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return HistogramChild(self.upper_bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class MetricsServer:
+    """ Serves the metrics of a registry on GET /metrics from a background thread """
+
+    def __init__(self, host, port, registry=REGISTRY):
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = registry.expose().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(f"{self.address_string()} - {format % args}")
+
+        self.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        log.info(f"Serving metrics on http://{self.server.server_address[0]}:{self.server.server_address[1]}/metrics")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -2,6 +2,7 @@ import collections
 import json
 import logging
 import sys
+from concurrent.futures.thread import ThreadPoolExecutor
 
 import irc
 import regex as re
@@ -52,31 +53,86 @@ class ActionParser:
         return action
 
 
-def apply_substitutions(text, substitutions, bot, extra):
-    for needle, sub in substitutions.items():
-        if sub.key and sub.argument:
-            param = sub.key
-            extra["argument"] = MessageAction.get_argument_value(extra["message"], sub.argument - 1)
-        elif sub.key:
-            param = sub.key
-        elif sub.argument:
-            param = MessageAction.get_argument_value(extra["message"], sub.argument - 1)
+class ResponseTemplate:
+    """
+    A response that is split up into its segments once, so rendering it for a message only needs to resolve
+    the substitutions and join the segments, instead of searching and replacing every substitution in the response.
+
+    Each segment is either literal text (str), a Substitution, or the index of a word in the message (int, for $(N)).
+    """
+
+    # Marks substitutions that haven't been resolved yet during a render
+    UNRESOLVED = object()
+
+    def __init__(self, text, bot):
+        self.text = text
+        if bot:
+            self.segments = compile_segments(text, get_substitutions(text, bot))
         else:
-            log.error("Unknown param for response.")
+            self.segments = [text]
+
+    def render(self, extra):
+        """ Returns the response with all substitutions applied, or None if any substitution had no value """
+        parts = []
+        # A substitution that is used multiple times in the same response is only resolved once
+        resolved = {}
+        message_words = None
+
+        for segment in self.segments:
+            if segment.__class__ is str:
+                parts.append(segment)
+            elif segment.__class__ is int:
+                if message_words is None:
+                    message = extra.get("message", None)
+                    message_words = message.split(" ") if message else []
+                try:
+                    parts.append(message_words[segment])
+                except IndexError:
+                    pass
+            else:
+                value = resolved.get(segment, self.UNRESOLVED)
+                if value is self.UNRESOLVED:
+                    value = resolved[segment] = segment.resolve(extra)
+                if value is None:
+                    return None
+                parts.append(value)
+
+        return "".join(parts)
+
+
+def compile_segments(text, substitutions):
+    """ Splits the given text into the segments of a ResponseTemplate """
+    segments = []
+
+    position = 0
+    for sub_key in Substitution.substitution_regex.finditer(text):
+        sub = substitutions.get(sub_key.group(0), None)
+        if sub is None:
+            # Unknown substitutions are left as they are
             continue
-        value = sub.cb(param, extra)
-        if value is None:
-            return None
-        try:
-            for f in sub.filters:
-                value = bot.apply_filter(value, f)
-        except:
-            log.exception("Exception caught in filter application")
-        if value is None:
-            return None
-        text = text.replace(needle, str(value))
 
-    return text
+        segments.extend(compile_argument_segments(text[position : sub_key.start()]))
+        segments.append(sub)
+        position = sub_key.end()
+
+    segments.extend(compile_argument_segments(text[position:]))
+    return segments
+
+
+def compile_argument_segments(text):
+    segments = []
+
+    position = 0
+    for sub_key in Substitution.argument_substitution_regex.finditer(text):
+        if sub_key.start() > position:
+            segments.append(text[position : sub_key.start()])
+        segments.append(int(sub_key.group(1)) - 1)
+        position = sub_key.end()
+
+    if position < len(text):
+        segments.append(text[position:])
+
+    return segments
 
 
 class IfSubstitution:
@@ -95,10 +151,10 @@ class IfSubstitution:
         return self.get_false_response(extra)
 
     def get_true_response(self, extra):
-        return apply_substitutions(self.true_response, self.true_subs, self.bot, extra)
+        return self.true_template.render(extra)
 
     def get_false_response(self, extra):
-        return apply_substitutions(self.false_response, self.false_subs, self.bot, extra)
+        return self.false_template.render(extra)
 
     def __init__(self, key, arguments, bot):
         self.bot = bot
@@ -114,8 +170,8 @@ class IfSubstitution:
         self.true_response = arguments[0][2:-1] if arguments else "Yes"
         self.false_response = arguments[1][2:-1] if len(arguments) > 1 else "No"
 
-        self.true_subs = get_substitutions(self.true_response, bot)
-        self.false_subs = get_substitutions(self.false_response, bot)
+        self.true_template = ResponseTemplate(self.true_response, bot)
+        self.false_template = ResponseTemplate(self.false_response, bot)
 
 
 class Substitution:
@@ -127,13 +183,45 @@ class Substitution:
     urlfetch_substitution_regex = re.compile(r"\$\(urlfetch ([A-Za-z0-9\-._~:/?#\[\]@!$%&\'()*+,;=]+)\)")
     urlfetch_substitution_regex_all = re.compile(r"\$\(urlfetch (.+?)\)")
 
-    def __init__(self, cb, needle, key=None, argument=None, filters=[]):
+    def __init__(self, cb, needle, key=None, argument=None, filters=[], bot=None):
         self.cb = cb
         self.key = key
         self.argument = argument
         self.filters = filters
         self.needle = needle
 
+        # (filter function, filter arguments) of the filters that exist, looked up once instead of on every use
+        self.filter_functions = []
+        if bot is not None:
+            for f in filters:
+                filter_function = bot.get_filter(f.name)
+                if filter_function is not None:
+                    self.filter_functions.append((filter_function, f.arguments))
+
+    def resolve(self, extra):
+        """ Returns the value of this substitution with its filters applied, as a string, or None if it has no value """
+        if self.key and self.argument:
+            param = self.key
+            extra["argument"] = MessageAction.get_argument_value(extra["message"], self.argument - 1)
+        elif self.key:
+            param = self.key
+        elif self.argument:
+            param = MessageAction.get_argument_value(extra["message"], self.argument - 1)
+        else:
+            log.error("Unknown param for response.")
+            return self.needle
+        value = self.cb(param, extra)
+        if value is None:
+            return None
+        try:
+            for filter_function, filter_arguments in self.filter_functions:
+                value = filter_function(value, filter_arguments)
+        except:
+            log.exception("Exception caught in filter application")
+        if value is None:
+            return None
+        return str(value)
+
 
 class SubstitutionFilter:
     def __init__(self, name, arguments):
@@ -326,7 +414,9 @@ def get_substitutions(string, bot):
                     if_substitution = IfSubstitution(key, if_arguments, bot)
                     if if_substitution.sub is None:
                         continue
-                    sub = Substitution(if_substitution, needle=sub_string, key=key, argument=argument, filters=filters)
+                    sub = Substitution(
+                        if_substitution, needle=sub_string, key=key, argument=argument, filters=filters, bot=bot
+                    )
                     substitutions[sub_string] = sub
         except:
             log.exception("BabyRage")
@@ -365,7 +455,9 @@ def get_substitutions(string, bot):
             continue
 
         if path in method_mapping:
-            sub = Substitution(method_mapping[path], needle=sub_string, key=key, argument=argument, filters=filters)
+            sub = Substitution(
+                method_mapping[path], needle=sub_string, key=key, argument=argument, filters=filters, bot=bot
+            )
             substitutions[sub_string] = sub
 
     return substitutions
@@ -415,13 +507,10 @@ class MessageAction(BaseAction):
 
     def __init__(self, response, bot):
         self.response = response
+        self.template = ResponseTemplate(self.response, bot)
         if bot:
-            self.argument_subs = get_argument_substitutions(self.response)
-            self.subs = get_substitutions(self.response, bot)
             self.num_urlfetch_subs = len(get_urlfetch_substitutions(self.response, all=True))
         else:
-            self.argument_subs = []
-            self.subs = {}
             self.num_urlfetch_subs = 0
 
     @staticmethod
@@ -436,19 +525,11 @@ class MessageAction(BaseAction):
         return ""
 
     def get_response(self, bot, extra):
-        resp = self.response
-
-        resp = apply_substitutions(resp, self.subs, bot, extra)
+        resp = self.template.render(extra)
 
         if resp is None:
             return None
 
-        for sub in self.argument_subs:
-            needle = sub.needle
-            value = str(MessageAction.get_argument_value(extra["message"], sub.argument - 1))
-            resp = resp.replace(needle, value)
-            log.debug(f"Replacing {needle} with {value}")
-
         if "command" in extra and extra["command"].run_through_banphrases is True and "source" in extra:
             if not is_message_good(bot, resp, extra):
                 return None
@@ -463,6 +544,17 @@ class MessageAction(BaseAction):
         raise NotImplementedError("Please implement the run method.")
 
 
+def fetch_url(bot, url):
+    headers = {
+        "Accept": "text/plain",
+        "Accept-Language": "en-US, en;q=0.9, *;q=0.5",
+        "User-Agent": bot.user_agent,
+    }
+    r = requests.get(url, allow_redirects=True, headers=headers)
+    r.raise_for_status()
+    return r.text.strip().replace("\n", "").replace("\r", "")[:400]
+
+
 def urlfetch_msg(method, message, num_urlfetch_subs, bot, extra={}, args=[], kwargs={}):
     urlfetch_subs = get_urlfetch_substitutions(message)
 
@@ -470,18 +562,17 @@ def urlfetch_msg(method, message, num_urlfetch_subs, bot, extra={}, args=[], kwa
         log.error(f"HIJACK ATTEMPT {message}")
         return False
 
-    for needle, url in urlfetch_subs.items():
-        try:
-            headers = {
-                "Accept": "text/plain",
-                "Accept-Language": "en-US, en;q=0.9, *;q=0.5",
-                "User-Agent": bot.user_agent,
-            }
-            r = requests.get(url, allow_redirects=True, headers=headers)
-            r.raise_for_status()
-            value = r.text.strip().replace("\n", "").replace("\r", "")[:400]
-        except:
-            return False
+    try:
+        if len(urlfetch_subs) > 1:
+            # The URLs don't depend on each other, so they are fetched at the same time
+            with ThreadPoolExecutor(max_workers=len(urlfetch_subs), thread_name_prefix="URLFetch") as executor:
+                values = list(executor.map(lambda url: fetch_url(bot, url), urlfetch_subs.values()))
+        else:
+            values = [fetch_url(bot, url) for url in urlfetch_subs.values()]
+    except:
+        return False
+
+    for needle, value in zip(urlfetch_subs.keys(), values):
         message = message.replace(needle, value)
 
     if "command" in extra and extra["command"].run_through_banphrases is True and "source" in extra:
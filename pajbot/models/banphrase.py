@@ -12,10 +12,24 @@ from unidecode import unidecode
 
 from pajbot.managers.db import Base
 from pajbot.managers.db import DBManager
+from pajbot.utils import AhoCorasick
 from pajbot.utils import find
 
 log = logging.getLogger("pajbot")
 
+# Regexes using backreferences, named groups or conditional groups can't safely be combined into one alternation
+# with other regexes
+UNCOMBINABLE_REGEX = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?\(")
+
+
+def format_banphrase_message(message, lowercase, remove_accents):
+    if lowercase:
+        message = message.lower()
+    if remove_accents:
+        message = unidecode(message).strip()
+
+    return message
+
 
 class Banphrase(Base):
     __tablename__ = "banphrase"
@@ -71,12 +85,7 @@ class Banphrase(Base):
         self.refresh_operator()
 
     def format_message(self, message):
-        if self.case_sensitive is False:
-            message = message.lower()
-        if self.remove_accents:
-            message = unidecode(message).strip()
-
-        return message
+        return format_banphrase_message(message, self.case_sensitive is False, self.remove_accents)
 
     def get_phrase(self):
         if self.case_sensitive is False:
@@ -210,11 +219,181 @@ class BanphraseData(Base):
         self.edited_by = options.get("edited_by", self.edited_by)
 
 
+class BanphraseMatcherGroup:
+    """
+    Matches all banphrases that share the same message normalization (case sensitivity and accent removal)
+    The message only has to be normalized once, and is then scanned once by an Aho-Corasick automaton for all
+    contains/startswith/endswith/exact banphrases, and once by a combined regex for all regex banphrases.
+    """
+
+    def __init__(self, lowercase, remove_accents):
+        self.lowercase = lowercase
+        self.remove_accents = remove_accents
+
+        self.automaton = AhoCorasick()
+        # index -> operator, for the banphrases in the automaton
+        self.operators = {}
+
+        # banphrases with an empty phrase, which are matched without the automaton
+        self.always_matching = []
+        self.matching_empty_message = []
+
+        # (combined regex, [(index, compiled_regex)]) - each combined regex is a prefilter for its regexes
+        self.combined_regexes = []
+        # [(index, compiled_regex)] for regexes that could not be combined
+        self.standalone_regexes = []
+
+        self.regexes_by_flags = {}
+
+    def add(self, index, banphrase):
+        if banphrase.operator == "regex":
+            if banphrase.compiled_regex is None:
+                return
+
+            self.regexes_by_flags.setdefault(banphrase.compiled_regex.flags, []).append(
+                (index, banphrase.compiled_regex)
+            )
+            return
+
+        phrase = banphrase.get_phrase()
+        if not phrase:
+            if banphrase.operator == "exact":
+                self.matching_empty_message.append(index)
+            else:
+                self.always_matching.append(index)
+            return
+
+        self.operators[index] = banphrase.operator
+        self.automaton.add(phrase, index)
+
+    def build(self):
+        self.automaton.build()
+
+        for flags, regexes in self.regexes_by_flags.items():
+            combinable = []
+            for index, compiled_regex in regexes:
+                if UNCOMBINABLE_REGEX.search(compiled_regex.pattern) is not None:
+                    self.standalone_regexes.append((index, compiled_regex))
+                    continue
+
+                try:
+                    re.compile(f"(?:{compiled_regex.pattern})", flags)
+                except re.error:
+                    # e.g. global inline flags like (?i) at the start of the regex
+                    self.standalone_regexes.append((index, compiled_regex))
+                    continue
+
+                combinable.append((index, compiled_regex))
+
+            if not combinable:
+                continue
+
+            try:
+                combined_regex = re.compile(
+                    "|".join(f"(?:{compiled_regex.pattern})" for _, compiled_regex in combinable), flags
+                )
+            except re.error:
+                log.exception("Unable to combine banphrase regexes, checking them one by one")
+                self.standalone_regexes.extend(combinable)
+                continue
+
+            self.combined_regexes.append((combined_regex, combinable))
+
+        self.regexes_by_flags = {}
+        return self
+
+    def find_matches(self, message, matches):
+        """ Adds the indices of all matching banphrases in this group to the `matches` set """
+
+        message = format_banphrase_message(message, self.lowercase, self.remove_accents)
+        message_length = len(message)
+
+        matches.update(self.always_matching)
+        if message_length == 0:
+            matches.update(self.matching_empty_message)
+
+        operators = self.operators
+        for start, end, index in self.automaton.iter(message):
+            if index in matches:
+                continue
+
+            operator = operators[index]
+            if operator == "contains":
+                matches.add(index)
+            elif operator == "startswith":
+                if start == 0:
+                    matches.add(index)
+            elif operator == "endswith":
+                if end == message_length:
+                    matches.add(index)
+            elif operator == "exact":
+                if start == 0 and end == message_length:
+                    matches.add(index)
+
+        for combined_regex, regexes in self.combined_regexes:
+            # A match of the combined regex only tells us that at least one of the regexes matches,
+            # not which ones, so each of them is checked afterwards
+            if combined_regex.search(message) is None:
+                continue
+
+            for index, compiled_regex in regexes:
+                if compiled_regex.search(message):
+                    matches.add(index)
+
+        for index, compiled_regex in self.standalone_regexes:
+            if compiled_regex.search(message):
+                matches.add(index)
+
+
+class BanphraseMatcher:
+    """
+    Compiled form of a list of banphrases. Finds all banphrases matching a message with one pass per
+    message normalization, instead of running every banphrase's predicate one by one.
+    The matcher must be rebuilt whenever the list of banphrases or any banphrase in it changes.
+    """
+
+    def __init__(self, banphrases):
+        self.banphrases = list(banphrases)
+        self.groups = {}
+
+        for index, banphrase in enumerate(self.banphrases):
+            if banphrase.predicate is None:
+                log.warning("Banphrase %s is missing a predicate", banphrase.id)
+                continue
+
+            key = (banphrase.case_sensitive is False, bool(banphrase.remove_accents))
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = BanphraseMatcherGroup(*key)
+
+            group.add(index, banphrase)
+
+        for group in self.groups.values():
+            group.build()
+
+    def matches(self, message, user):
+        """ Returns the banphrases that match the given message, in the same order as they were given """
+
+        matches = set()
+        for group in self.groups.values():
+            group.find_matches(message, matches)
+
+        ret = []
+        for index in sorted(matches):
+            banphrase = self.banphrases[index]
+            if user and banphrase.sub_immunity is True and user.subscriber is True:
+                continue
+            ret.append(banphrase)
+
+        return ret
+
+
 class BanphraseManager:
     def __init__(self, bot):
         self.bot = bot
         self.banphrases = []
         self.enabled_banphrases = []
+        self.matcher = BanphraseMatcher([])
         self.db_session = DBManager.create_session(expire_on_commit=False)
 
         if self.bot:
@@ -251,6 +430,8 @@ class BanphraseManager:
             if banphrase.enabled is False:
                 self.enabled_banphrases.remove(banphrase)
 
+        self.rebuild_matcher()
+
     def on_banphrase_remove(self, data):
         try:
             banphrase_id = int(data["id"])
@@ -269,13 +450,20 @@ class BanphraseManager:
             if removed_banphrase in self.banphrases:
                 self.banphrases.remove(removed_banphrase)
 
+            self.rebuild_matcher()
+
     def load(self):
         self.banphrases = self.db_session.query(Banphrase).all()
         for banphrase in self.banphrases:
             self.db_session.expunge(banphrase)
         self.enabled_banphrases = [banphrase for banphrase in self.banphrases if banphrase.enabled is True]
+        self.rebuild_matcher()
         return self
 
+    def rebuild_matcher(self):
+        # The matcher is replaced as a whole, so check_message never sees a half-built matcher
+        self.matcher = BanphraseMatcher(self.enabled_banphrases)
+
     def commit(self):
         self.db_session.commit()
 
@@ -294,6 +482,7 @@ class BanphraseManager:
 
         self.banphrases.append(banphrase)
         self.enabled_banphrases.append(banphrase)
+        self.rebuild_matcher()
 
         return banphrase, True
 
@@ -302,6 +491,8 @@ class BanphraseManager:
         if banphrase in self.enabled_banphrases:
             self.enabled_banphrases.remove(banphrase)
 
+        self.rebuild_matcher()
+
         self.db_session.expunge(banphrase.data)
         self.db_session.delete(banphrase)
         self.db_session.delete(banphrase.data)
@@ -343,15 +534,16 @@ class BanphraseManager:
 
     def check_message(self, message, user):
         matched_banphrase = None
-        for banphrase in self.enabled_banphrases:
-            if banphrase.match(message, user):
-                if not matched_banphrase:
-                    matched_banphrase = banphrase
-                    continue
-
-                if banphrase.greater_than(matched_banphrase):
-                    matched_banphrase = banphrase
-                    continue
+        # matches() returns the matching banphrases in the order of enabled_banphrases,
+        # so the selection below picks the same banphrase as checking them one by one would
+        for banphrase in self.matcher.matches(message, user):
+            if not matched_banphrase:
+                matched_banphrase = banphrase
+                continue
+
+            if banphrase.greater_than(matched_banphrase):
+                matched_banphrase = banphrase
+                continue
 
         return matched_banphrase or False
 
@@ -13,14 +13,21 @@ from sqlalchemy_utc import UtcDateTime
 
 import pajbot.utils
 from pajbot.exc import FailedCommand
+from pajbot.managers.cooldown import UserCooldowns
 from pajbot.managers.db import Base
 from pajbot.managers.schedule import ScheduleManager
+from pajbot.metrics import Counter
 from pajbot.models.action import ActionParser
 from pajbot.models.action import RawFuncAction
 from pajbot.models.action import Substitution
 
 log = logging.getLogger(__name__)
 
+command_invocations = Counter("pajbot_command_invocations_total", "Commands that were run", ["command"])
+command_rejections = Counter(
+    "pajbot_command_rejections_total", "Command invocations that were rejected, by reason", ["command", "reason"]
+)
+
 
 def parse_command_for_web(alias, command, list):
     import markdown
@@ -214,6 +221,9 @@ class Command(Base):
     DEFAULT_CD_USER = 15
     DEFAULT_LEVEL = 100
 
+    # SharedCooldowns used to share cooldowns between bot processes, or None to only keep them in memory
+    shared_cooldowns = None
+
     notify_on_error = False
 
     def __init__(self, **options):
@@ -236,7 +246,9 @@ class Command(Base):
         self.command = None
 
         self.last_run = 0
-        self.last_run_by_user = {}
+        self.last_run_by_user = UserCooldowns()
+        # Identifies the command in the shared (redis) cooldowns. Set for database commands and by CommandManager
+        self.cooldown_key = None if self.id is None else f"db-{self.id}"
 
         self.data = None
         self.run_in_thread = False
@@ -282,7 +294,8 @@ class Command(Base):
     @reconstructor
     def init_on_load(self):
         self.last_run = 0
-        self.last_run_by_user = {}
+        self.last_run_by_user = UserCooldowns()
+        self.cooldown_key = f"db-{self.id}"
         self.extra_args = {"command": self}
         self.action = ActionParser.parse(self.action_json, command=self.command)
         self.run_in_thread = False
@@ -345,14 +358,35 @@ class Command(Base):
     def is_enabled(self):
         return self.enabled == 1 and self.action is not None
 
+    def get_last_runs(self, source, now):
+        """ Returns (when anyone last ran this command, when the given user last ran this command) """
+        last_run = self.last_run
+        last_run_by_user = self.last_run_by_user.get(source.id, now, self.delay_user)
+
+        if (
+            Command.shared_cooldowns is not None
+            and self.cooldown_key is not None
+            and source.level < Command.BYPASS_DELAY_LEVEL
+            and (self.delay_all > 0 or self.delay_user > 0)
+        ):
+            shared_last_run, shared_last_run_by_user = Command.shared_cooldowns.get(self.cooldown_key, source.id)
+            last_run = max(last_run, shared_last_run)
+            last_run_by_user = max(last_run_by_user, shared_last_run_by_user)
+
+        return last_run, last_run_by_user
+
+    def reject(self, reason):
+        command_rejections.labels(self.command, reason).inc()
+        return False
+
     def run(self, bot, source, message, event={}, args={}, whisper=False):
         if self.action is None:
             log.warning("This command is not available.")
-            return False
+            return self.reject("unavailable")
 
         if source.level < self.level:
             # User does not have a high enough power level to run this command
-            return False
+            return self.reject("level")
 
         if (
             whisper
@@ -361,7 +395,7 @@ class Command(Base):
             and source.moderator is False
         ):
             # This user cannot execute the command through a whisper
-            return False
+            return self.reject("whisper")
 
         if (
             self.sub_only
@@ -370,26 +404,27 @@ class Command(Base):
             and source.moderator is False
         ):
             # User is not a sub or a moderator, and cannot use the command.
-            return False
+            return self.reject("sub_only")
 
         if self.mod_only and source.moderator is False and source.level < Command.BYPASS_MOD_ONLY_LEVEL:
             # User is not a twitch moderator, or a bot moderator
-            return False
+            return self.reject("mod_only")
 
         cd_modifier = 0.2 if source.level >= 500 or source.moderator is True else 1.0
 
         cur_time = pajbot.utils.now().timestamp()
-        time_since_last_run = (cur_time - self.last_run) / cd_modifier
+        last_run, last_run_by_user = self.get_last_runs(source, cur_time)
+        time_since_last_run = (cur_time - last_run) / cd_modifier
 
         if time_since_last_run < self.delay_all and source.level < Command.BYPASS_DELAY_LEVEL:
             log.debug(f"Command was run {time_since_last_run:.2f} seconds ago, waiting...")
-            return False
+            return self.reject("global_cooldown")
 
-        time_since_last_run_user = (cur_time - self.last_run_by_user.get(source.id, 0)) / cd_modifier
+        time_since_last_run_user = (cur_time - last_run_by_user) / cd_modifier
 
         if time_since_last_run_user < self.delay_user and source.level < Command.BYPASS_DELAY_LEVEL:
             log.debug(f"{source} ran command {time_since_last_run_user:.2f} seconds ago, waiting...")
-            return False
+            return self.reject("user_cooldown")
 
         if self.cost > 0 and not source.can_afford(self.cost):
             if self.notify_on_error:
@@ -398,7 +433,7 @@ class Command(Base):
                     f"You do not have the required {self.cost} points to execute this command. (You have {source.points} points)",
                 )
             # User does not have enough points to use the command
-            return False
+            return self.reject("points")
 
         if self.tokens_cost > 0 and not source.can_afford_with_tokens(self.tokens_cost):
             if self.notify_on_error:
@@ -407,7 +442,9 @@ class Command(Base):
                     f"You do not have the required {self.tokens_cost} tokens to execute this command. (You have {source.tokens} tokens)",
                 )
             # User does not have enough tokens to use the command
-            return False
+            return self.reject("tokens")
+
+        command_invocations.labels(self.command).inc()
 
         args.update(self.extra_args)
         if self.run_in_thread:
@@ -432,7 +469,9 @@ class Command(Base):
 
             # TODO: Will this be an issue?
             self.last_run = cur_time
-            self.last_run_by_user[source.id] = cur_time
+            self.last_run_by_user.set(source.id, cur_time, self.delay_user)
+            if Command.shared_cooldowns is not None and self.cooldown_key is not None:
+                Command.shared_cooldowns.set(self.cooldown_key, source.id, cur_time, self.delay_all, self.delay_user)
 
     def autogenerate_examples(self):
         if not self.examples and self.id is not None and self.action and self.action.type == "message":
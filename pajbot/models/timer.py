@@ -1,12 +1,17 @@
+import heapq
+import itertools
 import json
 import logging
+import time
 
 from sqlalchemy import INT, BOOLEAN, TEXT
 from sqlalchemy import Column
 from sqlalchemy.orm import reconstructor
 
+from pajbot.managers.connection import OutboundPriority, outbound_priority
 from pajbot.managers.db import Base
 from pajbot.managers.db import DBManager
+from pajbot.managers.handler import HandlerManager
 from pajbot.models.action import ActionParser
 from pajbot.utils import find
 
@@ -32,8 +37,6 @@ class Timer(Base):
         self.interval_offline = 30
         self.enabled = True
 
-        self.refresh_tts()
-
         self.set(**options)
 
     def set(self, **options):
@@ -51,32 +54,210 @@ class Timer(Base):
     def init_on_load(self):
         self.action = ActionParser.parse(self.action_json)
 
-        self.refresh_tts()
-
-    def refresh_tts(self):
-        self.time_to_send_online = self.interval_online
-        self.time_to_send_offline = self.interval_offline
-
     def refresh_action(self):
         self.action = ActionParser.parse(self.action_json)
 
     def run(self, bot):
-        self.action.run(bot, source=None, message=None)
+        with outbound_priority(OutboundPriority.TIMER):
+            self.action.run(bot, source=None, message=None)
+
+
+class TimerQueue:
+    """
+    Min-heap of timers, keyed by when they are due to run next.
+
+    There is one queue for the online intervals and one for the offline intervals.
+    Time only passes for a queue while it is active (i.e. while the stream is in the state the queue is for),
+    so due times are kept on the queue's own clock instead of the wall clock. Pausing and resuming a queue
+    is then O(1), no matter how many timers it contains.
+    """
+
+    def __init__(self, interval_attribute):
+        self.interval_attribute = interval_attribute
+
+        # [due time on the queue's clock, insertion counter, timer (or None if the entry has been removed)]
+        self.heap = []
+        # timer ID -> heap entry
+        self.entries = {}
+        self.counter = itertools.count()
+
+        # The queue's clock: Seconds the queue has been active for before it was last resumed
+        self.elapsed = 0.0
+        # time.monotonic() of when the queue was last resumed, or None if the queue is paused
+        self.resumed_at = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, timer):
+        return timer.id in self.entries
+
+    def interval(self, timer):
+        """ Returns the interval of the given timer in seconds """
+        return getattr(timer, self.interval_attribute) * 60
+
+    def clock(self, now):
+        if self.resumed_at is None:
+            return self.elapsed
+
+        return self.elapsed + (now - self.resumed_at)
+
+    def resume(self, now):
+        if self.resumed_at is None:
+            self.resumed_at = now
+
+    def pause(self, now):
+        if self.resumed_at is not None:
+            self.elapsed = self.clock(now)
+            self.resumed_at = None
+
+    def push(self, timer, delay, now):
+        """ Queues the given timer to be due in `delay` seconds of active time, replacing any earlier entry for it """
+        self.remove(timer)
+
+        entry = [self.clock(now) + delay, next(self.counter), timer]
+        self.entries[timer.id] = entry
+        heapq.heappush(self.heap, entry)
+
+    def remove(self, timer):
+        entry = self.entries.pop(timer.id, None)
+        if entry is None:
+            return
+
+        # Removed entries are skipped when they reach the top of the heap.
+        # Compact the heap if it consists mostly of removed entries.
+        entry[2] = None
+        if len(self.heap) > 2 * len(self.entries) + 32:
+            self.heap = [entry for entry in self.heap if entry[2] is not None]
+            heapq.heapify(self.heap)
+
+    def _discard_removed(self):
+        while self.heap and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+
+    def time_until_due(self, now):
+        """ Returns the amount of seconds until the next timer is due, or None if the queue is empty or paused """
+        self._discard_removed()
+        if not self.heap or self.resumed_at is None:
+            return None
+
+        return max(0.0, self.heap[0][0] - self.clock(now))
+
+    def pop_due(self, now):
+        """ Removes and returns the timer that is most overdue, or None if no timer is due yet """
+        self._discard_removed()
+        if not self.heap or self.heap[0][0] > self.clock(now):
+            return None
+
+        _, _, timer = heapq.heappop(self.heap)
+        del self.entries[timer.id]
+        return timer
 
 
 class TimerManager:
+    # At most one timer is run per this many seconds, so timers that are due at the same time are spaced out
+    MIN_RUN_INTERVAL = 60
+
+    # While timers of the other stream status are queued, the stream status is checked at least this often.
+    # The stream can come back online without on_stream_start (see StreamManager.create_stream)
+    ONLINE_CHECK_INTERVAL = 60
+
     def __init__(self, bot):
         self.bot = bot
 
         self.timers = []
-        self.online_timers = []
-        self.offline_timers = []
+        self.online_timers = TimerQueue("interval_online")
+        self.offline_timers = TimerQueue("interval_offline")
+        self.online = False
 
-        self.bot.execute_every(60, self.tick)
+        # time.monotonic() before which no timer is run
+        self.next_run_at = 0.0
+        # time.monotonic() of when the currently scheduled run_due_timer call happens, or None
+        self.scheduled_at = None
+        # Incremented to invalidate the currently scheduled run_due_timer call, since jobs can not be cancelled
+        self.schedule_generation = 0
 
         if self.bot:
             self.bot.socket_manager.add_handler("timer.update", self.on_timer_update)
             self.bot.socket_manager.add_handler("timer.remove", self.on_timer_remove)
+            HandlerManager.add_handler("on_stream_start", self.on_stream_start)
+            HandlerManager.add_handler("on_stream_stop", self.on_stream_stop)
+
+    @property
+    def active_timers(self):
+        return self.online_timers if self.online else self.offline_timers
+
+    @property
+    def inactive_timers(self):
+        return self.offline_timers if self.online else self.online_timers
+
+    def set_online(self, online):
+        now = time.monotonic()
+        self.online = online
+        if online:
+            self.offline_timers.pause(now)
+            self.online_timers.resume(now)
+        else:
+            self.online_timers.pause(now)
+            self.offline_timers.resume(now)
+
+        self.schedule_next_run()
+
+    def sync_online(self):
+        """ Switches to the timers of the current stream status if it changed without an event """
+        if self.online != self.bot.is_online:
+            log.info(f"Stream is {'online' if self.bot.is_online else 'offline'}, switching timers")
+            self.set_online(self.bot.is_online)
+
+    def on_stream_start(self, **rest):
+        self.set_online(True)
+        return True
+
+    def on_stream_stop(self, **rest):
+        self.set_online(False)
+        return True
+
+    def schedule_next_run(self):
+        now = time.monotonic()
+        time_until_due = self.active_timers.time_until_due(now)
+        if len(self.inactive_timers) > 0 and (time_until_due is None or time_until_due > self.ONLINE_CHECK_INTERVAL):
+            # Wake up in time to check whether the stream status changed, see sync_online()
+            time_until_due = self.ONLINE_CHECK_INTERVAL
+
+        if time_until_due is None:
+            # Nothing to run, invalidate the scheduled call (if any)
+            self.schedule_generation += 1
+            self.scheduled_at = None
+            return
+
+        run_at = max(now + time_until_due, self.next_run_at)
+        if self.scheduled_at is not None and self.scheduled_at <= run_at:
+            # The scheduled call will run the timer, or schedule the next call itself
+            return
+
+        self.schedule_generation += 1
+        self.scheduled_at = run_at
+        self.bot.execute_delayed(run_at - now, self.run_due_timer, self.schedule_generation)
+
+    def run_due_timer(self, generation):
+        if generation != self.schedule_generation:
+            return
+
+        self.scheduled_at = None
+        self.sync_online()
+        now = time.monotonic()
+
+        timer = None
+        if now >= self.next_run_at:
+            timer = self.active_timers.pop_due(now)
+            if timer is not None:
+                self.active_timers.push(timer, self.active_timers.interval(timer), now)
+                self.next_run_at = now + self.MIN_RUN_INTERVAL
+
+        self.schedule_next_run()
+
+        if timer is not None:
+            timer.run(self.bot)
 
     def on_timer_update(self, data):
         try:
@@ -96,28 +277,22 @@ class TimerManager:
             with DBManager.create_session_scope(expire_on_commit=False) as db_session:
                 updated_timer = db_session.query(Timer).filter_by(id=timer_id).one_or_none()
 
-        # Add the updated timer to the timer lists if required
-        if updated_timer:
-            if updated_timer not in self.timers:
-                self.timers.append(updated_timer)
-
-            if updated_timer not in self.online_timers:
-                if updated_timer.interval_online > 0:
-                    self.online_timers.append(updated_timer)
-                    updated_timer.refresh_tts()
+        if not updated_timer:
+            return True
 
-            if updated_timer not in self.offline_timers:
-                if updated_timer.interval_offline > 0:
-                    self.offline_timers.append(updated_timer)
-                    updated_timer.refresh_tts()
+        if updated_timer not in self.timers:
+            self.timers.append(updated_timer)
 
-        for timer in self.online_timers:
-            if timer.enabled is False or timer.interval_online <= 0:
-                self.online_timers.remove(timer)
+        # Add the updated timer to the timer queues if required. Timers that were already queued keep their due time
+        now = time.monotonic()
+        for timers in (self.online_timers, self.offline_timers):
+            interval = timers.interval(updated_timer)
+            if updated_timer.enabled is False or interval <= 0:
+                timers.remove(updated_timer)
+            elif updated_timer not in timers:
+                timers.push(updated_timer, interval, now)
 
-        for timer in self.offline_timers:
-            if timer.enabled is False or timer.interval_offline <= 0:
-                self.offline_timers.remove(timer)
+        self.schedule_next_run()
 
         return True
 
@@ -130,43 +305,22 @@ class TimerManager:
 
         removed_timer = find(lambda timer: timer.id == timer_id, self.timers)
         if removed_timer:
-            if removed_timer in self.timers:
-                self.timers.remove(removed_timer)
-            if removed_timer in self.online_timers:
-                self.online_timers.remove(removed_timer)
-            if removed_timer in self.offline_timers:
-                self.offline_timers.remove(removed_timer)
+            self.timers.remove(removed_timer)
+            self.online_timers.remove(removed_timer)
+            self.offline_timers.remove(removed_timer)
+            self.schedule_next_run()
 
         return True
 
-    def tick(self):
-        if self.bot.is_online:
-            for timer in self.online_timers:
-                timer.time_to_send_online -= 1
-            timer = find(lambda timer: timer.time_to_send_online <= 0, self.online_timers)
-            if timer:
-                timer.run(self.bot)
-                timer.time_to_send_online = timer.interval_online
-                self.online_timers.remove(timer)
-                self.online_timers.append(timer)
-        else:
-            for timer in self.offline_timers:
-                timer.time_to_send_offline -= 1
-            timer = find(lambda timer: timer.time_to_send_offline <= 0, self.offline_timers)
-            if timer:
-                timer.run(self.bot)
-                timer.time_to_send_offline = timer.interval_offline
-                self.offline_timers.remove(timer)
-                self.offline_timers.append(timer)
-
     def redistribute_timers(self):
-        for x in range(0, len(self.offline_timers)):
-            timer = self.offline_timers[x]
-            timer.time_to_send_offline = timer.interval_offline * ((x + 1) / len(self.offline_timers))
+        """ (Re-)queues all enabled timers, spreading their next runs evenly over their intervals """
+        now = time.monotonic()
+        for timers in (self.online_timers, self.offline_timers):
+            queued_timers = [timer for timer in self.timers if timer.enabled and timers.interval(timer) > 0]
+            for x, timer in enumerate(queued_timers):
+                timers.push(timer, timers.interval(timer) * ((x + 1) / len(queued_timers)), now)
 
-        for x in range(0, len(self.online_timers)):
-            timer = self.online_timers[x]
-            timer.time_to_send_online = timer.interval_online * ((x + 1) / len(self.online_timers))
+        self.schedule_next_run()
 
     def load(self):
         self.timers = []
@@ -176,9 +330,10 @@ class TimerManager:
             )
             db_session.expunge_all()
 
-        self.online_timers = [timer for timer in self.timers if timer.interval_online > 0 and timer.enabled]
-        self.offline_timers = [timer for timer in self.timers if timer.interval_offline > 0 and timer.enabled]
+        self.online_timers = TimerQueue("interval_online")
+        self.offline_timers = TimerQueue("interval_offline")
 
+        self.set_online(self.bot.is_online)
         self.redistribute_timers()
 
         log.info(
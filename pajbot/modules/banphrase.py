@@ -75,6 +75,7 @@ class BanphraseModule(BaseModule):
             banphrase.data.set(edited_by=options["edited_by"])
             DBManager.session_add_expunge(banphrase)
             bot.banphrase_manager.commit()
+            bot.banphrase_manager.rebuild_matcher()
             bot.whisper(
                 source,
                 f"Updated your banphrase (ID: {banphrase.id}) with ({', '.join([key for key in options if key != 'added_by'])})",
@@ -2,6 +2,7 @@ import logging
 
 from pajbot.managers.adminlog import AdminLogManager
 from pajbot.managers.db import DBManager
+from pajbot.managers.handler import HandlerManager
 from pajbot.models.command import Command
 from pajbot.models.command import CommandExample
 from pajbot.models.module import Module
@@ -236,6 +237,24 @@ class AdminCommandsModule(BaseModule):
 
             bot.say(f"Enabled module {module_id}")
 
+    @staticmethod
+    def cmd_slow_handlers(bot, **rest):
+        if HandlerManager.watchdog is None:
+            return False
+
+        offenders = [
+            f"{i}. {stats.name} ({stats.event}: {stats.num_over_budget}/{len(stats.durations)} calls over "
+            f"{stats.budget * 1000:.0f}ms, p95 {stats.percentile(95) * 1000:.1f}ms)"
+            for i, stats in enumerate(HandlerManager.watchdog.top_offenders(), start=1)
+        ]
+
+        messages = split_into_chunks_with_prefix(
+            [{"prefix": "Slowest handlers:", "parts": offenders}], " ", default="No handlers went over budget."
+        )
+
+        for message in messages:
+            bot.say(message)
+
     def load_commands(self, **options):
         self.commands["w"] = Command.raw_command(self.whisper, level=2000, description="Send a whisper from the bot")
         self.commands["editpoints"] = Command.raw_command(
@@ -280,6 +299,12 @@ class AdminCommandsModule(BaseModule):
         )
         self.commands["unmute"] = self.commands["unsilence"]
 
+        self.commands["slowhandlers"] = Command.raw_command(
+            self.cmd_slow_handlers,
+            level=1500,
+            description="Show the event handlers that went over their time budget most often",
+        )
+
         self.commands["module"] = Command.raw_command(
             self.cmd_module, level=1500, description="Modify module", delay_all=0, delay_user=0
         )
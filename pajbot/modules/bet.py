@@ -1,5 +1,6 @@
 import logging
 
+from sqlalchemy import text
 from sqlalchemy.orm import joinedload
 
 from pajbot import utils
@@ -13,6 +14,7 @@ from pajbot.models.command import CommandExample
 from pajbot.models.user import User
 from pajbot.modules import BaseModule
 from pajbot.modules import ModuleSetting
+from pajbot.utils import iterate_in_chunks
 
 log = logging.getLogger(__name__)
 
@@ -31,6 +33,15 @@ class BetModule(BaseModule):
             key="min_return", label="Minimum return odds", type="text", placeholder="", default="1.10"
         ),
         ModuleSetting(key="max_bet", label="Maximum bet", type="number", placeholder="", default="3000"),
+        ModuleSetting(
+            key="max_result_whispers",
+            label="Whisper every bettor their result if at most this many users bet (0 = never, the result is always announced in chat)",
+            type="number",
+            required=True,
+            placeholder="",
+            default=100,
+            constraints={"min_value": 0, "max_value": 10000},
+        ),
     ]
 
     def __init__(self, bot):
@@ -89,64 +100,89 @@ class BetModule(BaseModule):
         return tuple(ratioList)
     """
 
+    # Pays out the pot of a game in a single statement. Every bettor on the winning outcome gets a cut of the pot
+    # that's proportional to their bet. Returns one row per bet, with the bettor's points after the payout.
+    SETTLE_QUERY = """
+WITH pot AS (
+    SELECT
+        COALESCE(SUM(points), 0) AS total,
+        COALESCE(SUM(points) FILTER (WHERE outcome = CAST(:outcome AS bet_outcome)), 0) AS winning
+    FROM bet_bet
+    WHERE game_id = :game_id
+), settled_bets AS (
+    UPDATE bet_bet SET profit = CASE
+        WHEN bet_bet.outcome = CAST(:outcome AS bet_outcome)
+            THEN FLOOR(bet_bet.points::numeric * pot.total / pot.winning)::int - bet_bet.points
+        ELSE -bet_bet.points
+    END
+    FROM pot
+    WHERE bet_bet.game_id = :game_id
+    RETURNING bet_bet.user_id, bet_bet.outcome = CAST(:outcome AS bet_outcome) AS won, bet_bet.points, bet_bet.profit
+), paid_users AS (
+    UPDATE "user" SET points = "user".points + settled_bets.points + settled_bets.profit
+    FROM settled_bets
+    WHERE "user".id = settled_bets.user_id AND settled_bets.won
+    RETURNING "user".id, "user".points
+)
+SELECT
+    settled_bets.user_id, "user".login, settled_bets.won, settled_bets.points, settled_bets.profit,
+    COALESCE(paid_users.points, "user".points) AS new_points
+FROM settled_bets
+JOIN "user" ON "user".id = settled_bets.user_id
+LEFT JOIN paid_users ON paid_users.id = settled_bets.user_id
+"""
+
+    # Result whispers are sent in batches of this size, one batch per second, so they don't crowd out other messages
+    RESULT_WHISPERS_PER_SECOND = 3
+
     def spread_points(self, gameResult):
         with DBManager.create_session_scope() as db_session:
-            # What is faster? Doing it like this or with a generator afterwards?
-            winners = 0
-            losers = 0
-            current_game = self.get_current_game(db_session, with_bets=True, with_users=True)
+            current_game = self.get_current_game(db_session)
 
             current_game.outcome = gameResult
-            points_by_outcome = current_game.get_points_by_outcome(db_session)
-            total_pot = sum(points_by_outcome.values())
+            # Just to make sure
+            current_game.bets_closed = True
+            db_session.flush()
 
-            for bet in current_game.bets:
-                correct_bet = bet.outcome == current_game.outcome
-                newPoints = bet.user.points
-
-                if correct_bet:
-                    winners += 1
-                    investment_ratio = bet.points / points_by_outcome[bet.outcome]
-                    pot_cut = int(investment_ratio * total_pot)
-                    bet.profit = pot_cut - bet.points
-                    bet.user.points = User.points + pot_cut
-                    newPoints += pot_cut
-
-                    self.bot.whisper(
-                        bet.user,
-                        f"You bet {bet.points} points on the correct outcome and gained an extra {bet.profit} points, you now have {newPoints} points PogChamp",
-                    )
-                else:
-                    losers += 1
-                    bet.profit = -bet.points
+            results = db_session.execute(
+                text(self.SETTLE_QUERY), {"game_id": current_game.id, "outcome": gameResult.name}
+            ).fetchall()
 
-                    self.bot.whisper(
-                        bet.user,
-                        f"You bet {bet.points} points on the wrong outcome, so you lost it all :( . You now have {newPoints} points admiralCute",
-                    )
+        winners = sum(1 for result in results if result.won)
+        losers = len(results) - winners
+        total_winnings = sum(result.points for result in results if result.won)
+        total_losings = sum(result.points for result in results if not result.won)
 
-            total_winnings = sum(
-                points for outcome, points in points_by_outcome.items() if outcome == current_game.outcome
-            )
-            total_losings = sum(
-                points for outcome, points in points_by_outcome.items() if outcome != current_game.outcome
-            )
+        startString = f"The game ended as a {gameResult.name}. {winners} users won an extra {total_winnings} points, while {losers} lost {total_losings} points."
 
-            startString = f"The game ended as a {gameResult.name}. {winners} users won an extra {total_winnings} points, while {losers} lost {total_losings} points."
+        if self.spectating:
+            resultString = startString[:20] + "radiant " + startString[20:]
+        else:
+            resultString = startString
 
-            if self.spectating:
-                resultString = startString[:20] + "radiant " + startString[20:]
-            else:
-                resultString = startString
+        self.spectating = False
 
-            # Just to make sure
-            current_game.bets_closed = True
-            self.spectating = False
+        self.bot.websocket_manager.emit("notification", {"message": resultString, "length": 8})
+        self.bot.me(resultString)
 
-            self.bot.websocket_manager.emit("notification", {"message": resultString, "length": 8})
-            self.bot.me(resultString)
+        if 0 < len(results) <= self.settings["max_result_whispers"]:
+            self.whisper_results(results)
 
-            db_session.flush()
+    def whisper_results(self, results):
+        whispers = []
+        for result in results:
+            if result.won:
+                message = f"You bet {result.points} points on the correct outcome and gained an extra {result.profit} points, you now have {result.new_points} points PogChamp"
+            else:
+                message = f"You bet {result.points} points on the wrong outcome, so you lost it all :( . You now have {result.new_points} points admiralCute"
+            whispers.append((result.login, message))
+
+        for batch_index, batch in enumerate(iterate_in_chunks(whispers, self.RESULT_WHISPERS_PER_SECOND)):
+            self.bot.execute_delayed(batch_index, self.send_whispers, batch)
+
+    def send_whispers(self, whispers):
+        for login, message in whispers:
+            self.bot.whisper_login(login, message)
 
     def automated_end(self, winning_team, player_team):
         self.bot.say("Closing bet automatically...")
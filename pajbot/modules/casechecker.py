@@ -72,7 +72,7 @@ class CaseCheckerModule(BaseModule):
         return True
 
     def enable(self, bot):
-        HandlerManager.add_handler("on_message", self.on_message)
+        HandlerManager.add_handler("on_message", self.on_message, priority=100)
 
     def disable(self, bot):
         HandlerManager.remove_handler("on_message", self.on_message)
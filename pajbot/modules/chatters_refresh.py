@@ -1,7 +1,7 @@
 import logging
+import threading
 
 from datetime import timedelta
-from sqlalchemy import text
 
 from pajbot.managers.db import DBManager
 from pajbot.managers.schedule import ScheduleManager
@@ -50,10 +50,41 @@ class ChattersRefreshModule(BaseModule):
 
     UPDATE_INTERVAL = 10  # minutes
 
+    # Every FULL_REFRESH_EVERY updates, all chatters are looked up on Twitch again instead of only the new ones,
+    # so a login that changed owners (rename) is not credited to its previous owner for long
+    FULL_REFRESH_EVERY = 6
+
+    UPDATE_CONTINUING_QUERY = """
+UPDATE "user" SET
+    points = points + CASE WHEN subscriber THEN %(add_points_sub)s ELSE %(add_points_pleb)s END,
+    time_in_chat_online = time_in_chat_online + %(add_time_in_chat_online)s,
+    time_in_chat_offline = time_in_chat_offline + %(add_time_in_chat_offline)s,
+    last_seen = now()
+WHERE id = ANY(%(ids)s)
+"""
+
+    UPSERT_NEW_QUERY = """
+INSERT INTO "user"(id, login, name, points, time_in_chat_online, time_in_chat_offline, last_seen)
+    SELECT DISTINCT ON (id)
+        id, login, name, %(add_points_pleb)s, %(add_time_in_chat_online)s, %(add_time_in_chat_offline)s, now()
+    FROM new_chatters
+ON CONFLICT (id) DO UPDATE SET
+    points = "user".points + CASE WHEN "user".subscriber THEN %(add_points_sub)s ELSE %(add_points_pleb)s END,
+    time_in_chat_online = "user".time_in_chat_online + %(add_time_in_chat_online)s,
+    time_in_chat_offline = "user".time_in_chat_offline + %(add_time_in_chat_offline)s,
+    last_seen = now()
+"""
+
     def __init__(self, bot):
         super().__init__(bot)
         self.scheduled_job = None
 
+        # login -> user ID of the chatters found by the previous update
+        self.previous_chatters = {}
+        self.num_updates = 0
+        # The scheduled update and !reload chatters must not run at the same time
+        self.update_lock = threading.Lock()
+
     def update_chatters_cmd(self, bot, source, **rest):
         # TODO if you wanted to improve this: Provide the user with feedback
         #   whether the update succeeded, and if yes, how many users were updated
@@ -62,11 +93,30 @@ class ChattersRefreshModule(BaseModule):
 
     @time_method
     def _update_chatters(self, only_last_seen=False):
-        chatter_logins = self.bot.twitch_tmi_api.get_chatter_logins_by_login(self.bot.streamer)
-        chatter_basics = self.bot.twitch_helix_api.bulk_get_user_basics_by_login(chatter_logins)
+        with self.update_lock:
+            self._update_chatters_locked(only_last_seen)
+
+    def _update_chatters_locked(self, only_last_seen):
+        # dict.fromkeys removes duplicates but keeps the order
+        chatter_logins = list(dict.fromkeys(self.bot.twitch_tmi_api.get_chatter_logins_by_login(self.bot.streamer)))
+
+        if self.num_updates % self.FULL_REFRESH_EVERY == 0:
+            self.previous_chatters = {}
+
+        # Chatters that were already here during the previous update are known to exist, and we know their ID,
+        # so only the logins that are new since then need to be looked up
+        continuing_chatters = {
+            login: self.previous_chatters[login] for login in chatter_logins if login in self.previous_chatters
+        }
+        new_logins = [login for login in chatter_logins if login not in continuing_chatters]
+
+        if len(new_logins) > 0:
+            new_basics = self.bot.twitch_helix_api.bulk_get_user_basics_by_login(new_logins)
+        else:
+            new_basics = []
 
         # filter out invalid/deleted/etc. users
-        chatter_basics = [e for e in chatter_basics if e is not None]
+        new_chatters = {login: basics for login, basics in zip(new_logins, new_basics) if basics is not None}
 
         is_stream_online = self.bot.stream_manager.online
 
@@ -91,34 +141,40 @@ class ChattersRefreshModule(BaseModule):
             add_points_pleb = 0
             add_points_sub = 0
 
-        update_values = [
-            {
-                **basics.jsonify(),
-                "add_points_pleb": add_points_pleb,
-                "add_points_sub": add_points_sub,
-                "add_time_in_chat_online": add_time_in_chat_online,
-                "add_time_in_chat_offline": add_time_in_chat_offline,
-            }
-            for basics in chatter_basics
-        ]
-
-        with DBManager.create_session_scope() as db_session:
-            db_session.execute(
-                text(
-                    """
-INSERT INTO "user"(id, login, name, points, time_in_chat_online, time_in_chat_offline, last_seen)
-    VALUES (:id, :login, :name, :add_points_pleb, :add_time_in_chat_online, :add_time_in_chat_offline, now())
-ON CONFLICT (id) DO UPDATE SET
-    points = "user".points + CASE WHEN "user".subscriber THEN :add_points_sub ELSE :add_points_pleb END,
-    time_in_chat_online = "user".time_in_chat_online + :add_time_in_chat_online,
-    time_in_chat_offline = "user".time_in_chat_offline + :add_time_in_chat_offline,
-    last_seen = now()
-            """
-                ),
-                update_values,
-            )
+        increments = {
+            "add_points_pleb": add_points_pleb,
+            "add_points_sub": add_points_sub,
+            "add_time_in_chat_online": add_time_in_chat_online,
+            "add_time_in_chat_offline": add_time_in_chat_offline,
+        }
+
+        with DBManager.create_dbapi_cursor_scope() as cursor:
+            # Continuing chatters already have a row from the previous update, so one UPDATE covers all of them
+            if len(continuing_chatters) > 0:
+                cursor.execute(self.UPDATE_CONTINUING_QUERY, {**increments, "ids": list(continuing_chatters.values())})
+
+            # New chatters might not have a row yet. They are copied into a temporary table first,
+            # which is much faster than sending an INSERT for every one of them
+            if len(new_chatters) > 0:
+                cursor.execute("CREATE TEMPORARY TABLE new_chatters(id TEXT, login TEXT, name TEXT) ON COMMIT DROP")
+                DBManager.bulk_load(
+                    cursor,
+                    "new_chatters",
+                    ["id", "login", "name"],
+                    ((basics.id, basics.login, basics.name) for basics in new_chatters.values()),
+                )
+                cursor.execute(self.UPSERT_NEW_QUERY, increments)
 
-        log.info(f"Successfully updated {len(chatter_basics)} chatters")
+        self.previous_chatters = {
+            **continuing_chatters,
+            **{login: basics.id for login, basics in new_chatters.items()},
+        }
+        self.num_updates += 1
+
+        log.info(
+            f"Successfully updated {len(continuing_chatters) + len(new_chatters)} chatters "
+            f"({len(new_chatters)} new since the last update)"
+        )
 
     def load_commands(self, **options):
         self.commands["reload"] = Command.multiaction_command(
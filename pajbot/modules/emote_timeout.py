@@ -1,6 +1,6 @@
 import logging
 
-from pajbot.emoji import ALL_EMOJI
+from pajbot.emoji import contains_emoji
 from pajbot.managers.handler import HandlerManager
 from pajbot.modules import BaseModule
 from pajbot.modules import ModuleSetting
@@ -86,14 +86,14 @@ class EmoteTimeoutModule(BaseModule):
             self.delete_or_timeout(source, msg_id, "No BTTV emotes allowed")
             return False
 
-        if self.settings["timeout_emoji"] and any(emoji in message for emoji in ALL_EMOJI):
+        if self.settings["timeout_emoji"] and contains_emoji(message):
             self.delete_or_timeout(source, msg_id, "No emoji allowed")
             return False
 
         return True
 
     def enable(self, bot):
-        HandlerManager.add_handler("on_message", self.on_message)
+        HandlerManager.add_handler("on_message", self.on_message, priority=100)
 
     def disable(self, bot):
         HandlerManager.remove_handler("on_message", self.on_message)
@@ -1,20 +1,28 @@
 import argparse
 import logging
+import threading
+import time
 import urllib.parse
+from collections import OrderedDict
+from concurrent.futures.thread import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import requests
 from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 from datetime import timedelta
+from redis import RedisError
+from requests.adapters import HTTPAdapter
 from sqlalchemy import Column, INT, TEXT
 
 import pajbot.managers
 import pajbot.models
-import pajbot.utils
 from pajbot.apiwrappers.safebrowsing import SafeBrowsingAPI
 from pajbot.managers.adminlog import AdminLogManager
 from pajbot.managers.db import Base
 from pajbot.managers.db import DBManager
 from pajbot.managers.handler import HandlerManager
+from pajbot.managers.redis import RedisManager
 from pajbot.models.command import Command
 from pajbot.models.command import CommandExample
 from pajbot.modules import BaseModule
@@ -83,21 +91,400 @@ class Url:
 
 
 class LinkCheckerCache:
-    def __init__(self):
-        self.cache = {}
-        return
+    """
+    Remembers the verdict (True = safe, False = bad) for checked URLs.
+
+    Verdicts are kept in two tiers:
+    1. An in-process LRU of at most `max_size` entries
+    2. Redis, shared by all pajbot instances using the same Redis server, so verdicts survive restarts.
+       Every verdict is its own key with an expiry, so Redis removes expired verdicts by itself.
+
+    Safe verdicts expire after `safe_ttl` seconds, bad verdicts after `bad_ttl` seconds.
+    Expired in-process entries are ignored on lookup, and removed from memory by purge_expired().
+    If Redis is not initialized or not reachable, only the in-process tier is used.
+    """
+
+    REDIS_KEY_PREFIX = "linkchecker:verdict:"
+
+    def __init__(self, max_size=10000, safe_ttl=3600, bad_ttl=86400):
+        self.max_size = max_size
+        self.safe_ttl = safe_ttl
+        self.bad_ttl = bad_ttl
+
+        self.lock = threading.Lock()
+        # key -> (safe, expires_at)
+        self.cache = OrderedDict()
+
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(url):
+        return url.strip("/").lower()
+
+    def ttl(self, safe):
+        return self.safe_ttl if safe else self.bad_ttl
+
+    def get(self, url):
+        """ Returns True/False if the verdict for the URL is cached, otherwise None """
+        key = self.key(url)
+
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                safe, expires_at = entry
+                if expires_at >= time.monotonic():
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                    return safe
+
+                del self.cache[key]
+
+        safe, ttl = self._redis_get(key)
+        if safe is None:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.redis_hits += 1
+            self._put_local(key, safe, ttl)
+        return safe
+
+    def set(self, url, safe):
+        key = self.key(url)
+        ttl = self.ttl(safe)
+        if ttl <= 0:
+            return
+
+        with self.lock:
+            self._put_local(key, safe, ttl)
+
+        self._redis_set(key, safe, ttl)
+
+    def _put_local(self, key, safe, ttl):
+        self.cache[key] = (safe, time.monotonic() + ttl)
+        self.cache.move_to_end(key)
+
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def _redis_get(self, key):
+        """ Returns (safe, remaining ttl in seconds) from Redis, or (None, None) if it's not there """
+        redis = RedisManager.get()
+        if redis is None:
+            return None, None
+
+        try:
+            with redis.pipeline(transaction=False) as pipe:
+                pipe.get(self.REDIS_KEY_PREFIX + key)
+                pipe.pttl(self.REDIS_KEY_PREFIX + key)
+                value, pttl = pipe.execute()
+        except RedisError:
+            log.warning("LinkChecker: Unable to look up cached URL verdict in Redis", exc_info=True)
+            return None, None
+
+        if value is None or pttl is None or pttl <= 0:
+            return None, None
+
+        return value == "1", pttl / 1000
+
+    def _redis_set(self, key, safe, ttl):
+        redis = RedisManager.get()
+        if redis is None:
+            return
+
+        try:
+            redis.setex(self.REDIS_KEY_PREFIX + key, ttl, "1" if safe else "0")
+        except RedisError:
+            log.warning("LinkChecker: Unable to store URL verdict in Redis", exc_info=True)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self.lock:
+            for key in [key for key, (_safe, expires_at) in self.cache.items() if expires_at < now]:
+                del self.cache[key]
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.cache), "hits": self.hits, "redis_hits": self.redis_hits, "misses": self.misses}
 
     def __getitem__(self, url):
-        return self.cache[url.strip("/").lower()]
+        safe = self.get(url)
+        if safe is None:
+            raise KeyError(url)
+        return safe
 
     def __setitem__(self, url, safe):
-        self.cache[url.strip("/").lower()] = safe
+        self.set(url, safe)
 
     def __contains__(self, url):
-        return url.strip("/").lower() in self.cache
+        return self.get(url) is not None
+
+    def __len__(self):
+        return len(self.cache)
+
 
-    def __delitem__(self, url):
-        del self.cache[url.strip("/").lower()]
+class _URLCheck:
+    __slots__ = ("actions", "bad")
+
+    def __init__(self, action):
+        self.actions = [action]
+        self.bad = False
+
+
+class LinkCheckerPipeline:
+    """
+    Runs the in-depth URL checks on a dedicated, bounded thread pool, so a flood of links
+    can't use up the threads of the bot's action queue.
+
+     - At most MAX_IN_FLIGHT URLs are checked at the same time. Up to MAX_QUEUED URLs wait for their turn,
+       URLs beyond that are not checked.
+     - At most MAX_PER_HOST requests are made to the same host at the same time.
+     - A URL that is already being checked is not checked again. The action of the new message is
+       run as well if the URL turns out to be bad.
+     - All requests share one requests.Session, so connections to the same host are kept alive and reused.
+
+    The thread pool and the session are created when the module is enabled, and closed by shutdown()
+    when it is disabled.
+    """
+
+    MAX_IN_FLIGHT = 8
+    MAX_QUEUED = 500
+    MAX_PER_HOST = 2
+    HOST_WAIT_TIMEOUT = 5  # seconds
+
+    def __init__(self, check_url, user_agent):
+        self.check_url = check_url
+
+        self.executor = ThreadPoolExecutor(max_workers=self.MAX_IN_FLIGHT, thread_name_prefix="LinkChecker")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.MAX_IN_FLIGHT * 4, pool_maxsize=self.MAX_PER_HOST)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = user_agent
+
+        self.lock = threading.Lock()
+        # url key -> _URLCheck
+        self.checks = {}
+        # host -> [semaphore, number of threads using or waiting for the semaphore]
+        self.hosts = {}
+
+    def shutdown(self):
+        """ Stops accepting URLs and closes the session. URLs that are already being checked are finished. """
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    def submit(self, url, action):
+        key = LinkCheckerCache.key(url)
+
+        with self.lock:
+            check = self.checks.get(key)
+            if check is None:
+                if len(self.checks) >= self.MAX_QUEUED:
+                    log.warning(f"LinkChecker: Too many URLs queued up, not checking {url}")
+                    return
+
+                check = self.checks[key] = _URLCheck(action)
+                self.executor.submit(self._run, url, key, check)
+                return
+
+            if not check.bad:
+                # The URL is already being checked, the action will be run once it's found to be bad
+                check.actions.append(action)
+                return
+
+        # The URL is already being checked and was found to be bad
+        action()
+
+    def _run(self, url, key, check):
+        def run_actions():
+            with self.lock:
+                check.bad = True
+                actions = check.actions
+                check.actions = []
+
+            for action in actions:
+                try:
+                    action()
+                except:
+                    log.exception("LinkChecker unhandled exception while running bad link action")
+
+        try:
+            self.check_url(url, run_actions)
+        except:
+            log.exception("LinkChecker unhandled exception while checking URL")
+        finally:
+            with self.lock:
+                self.checks.pop(key, None)
+
+    @contextmanager
+    def host_slot(self, host):
+        """ Waits until less than MAX_PER_HOST requests are made to the given host.
+        Raises LinkCheckerHostBusy if the host stays busy for more than HOST_WAIT_TIMEOUT seconds. """
+
+        host = host.lower()
+        with self.lock:
+            entry = self.hosts.get(host)
+            if entry is None:
+                entry = self.hosts[host] = [threading.BoundedSemaphore(self.MAX_PER_HOST), 0]
+            entry[1] += 1
+
+        try:
+            if not entry[0].acquire(timeout=self.HOST_WAIT_TIMEOUT):
+                raise LinkCheckerHostBusy(host)
+
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self.hosts[host]
+
+    def head(self, url, timeout):
+        with self.host_slot(url.parsed.netloc):
+            return self.session.head(url.url, allow_redirects=True, timeout=timeout)
+
+    def fetch_html(self, url, timeout, receive_timeout, max_size):
+        """ Downloads at most max_size bytes of the given URL. Returns None if it takes longer than receive_timeout """
+
+        with self.host_slot(url.parsed.netloc):
+            with self.session.get(url.url, stream=True, timeout=timeout) as response:
+                chunks = []
+                size = 0
+                start = time.monotonic()
+
+                for chunk in response.iter_content(8192):
+                    if time.monotonic() - start > receive_timeout:
+                        log.error("The site took too long to load")
+                        return None
+
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= max_size:
+                        # Everything after this is not parsed
+                        break
+
+                return b"".join(chunks)[:max_size].decode(response.encoding or "utf-8", errors="replace")
+
+
+class LinkCheckerHostBusy(Exception):
+    pass
+
+
+class _PathNode:
+    __slots__ = ("children", "links")
+
+    def __init__(self):
+        self.children = {}
+        self.links = []
+
+
+class _DomainNode:
+    __slots__ = ("children", "paths")
+
+    def __init__(self):
+        self.children = {}
+        self.paths = None
+
+
+class LinkTrie:
+    """
+    Index of LinkCheckerLinks, for finding all links that match a domain and path without
+    having to check every single link.
+
+    Domains are stored in a trie of their labels in reverse order (pajlada.se is stored as se -> pajlada),
+    and every domain node that belongs to a link has a tree of path segments (/a/b is stored as "" -> a -> b).
+    Every node in the path tree keeps the links that were added with that domain and path.
+
+    Looking up a domain and path walks the domain labels and path segments once, and returns the same links as
+    link.is_subdomain(domain) and link.is_subpath(path) would for every link.
+    """
+
+    def __init__(self):
+        self.root = _DomainNode()
+        self.num_links = 0
+
+    def __len__(self):
+        return self.num_links
+
+    @staticmethod
+    def _domain_labels(domain):
+        # Same as LinkCheckerLink.is_subdomain, a leading www. of the link's domain is ignored
+        if domain.startswith("www."):
+            domain = domain[4:]
+        return reversed(domain.split("."))
+
+    @staticmethod
+    def _path_segments(path):
+        # LinkCheckerLink.is_subpath treats /a/ and /a the same way, and / matches every path
+        if path.endswith("/"):
+            path = path[:-1]
+        return path.split("/")
+
+    def _find_path_node(self, link, create):
+        node = self.root
+        for label in self._domain_labels(link.domain):
+            child = node.children.get(label)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[label] = _DomainNode()
+            node = child
+
+        if node.paths is None:
+            if not create:
+                return None
+            node.paths = _PathNode()
+        path_node = node.paths
+
+        for segment in self._path_segments(link.path):
+            child = path_node.children.get(segment)
+            if child is None:
+                if not create:
+                    return None
+                child = path_node.children[segment] = _PathNode()
+            path_node = child
+
+        return path_node
+
+    def add(self, link):
+        self._find_path_node(link, create=True).links.append(link)
+        self.num_links += 1
+
+    def remove(self, link):
+        # Empty nodes are left behind, they are cheap and links are rarely removed
+        path_node = self._find_path_node(link, create=False)
+        if path_node is None or link not in path_node.links:
+            return False
+
+        path_node.links.remove(link)
+        self.num_links -= 1
+        return True
+
+    def find(self, domain, path):
+        """ Yields all links that the given (lowercase) domain and path are a subdomain and subpath of """
+
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.children.get(label)
+            if node is None:
+                return
+
+            path_node = node.paths
+            if path_node is None:
+                continue
+
+            for segment in path.split("/"):
+                path_node = path_node.children.get(segment)
+                if path_node is None:
+                    break
+                yield from path_node.links
 
 
 class LinkCheckerLink:
@@ -181,6 +568,24 @@ class LinkCheckerModule(BaseModule):
             default=500,
             constraints={"min_value": 100, "max_value": 1000},
         ),
+        ModuleSetting(
+            key="safe_cache_ttl",
+            label="Remember safe links for (seconds)",
+            type="number",
+            required=True,
+            placeholder="",
+            default=3600,
+            constraints={"min_value": 0, "max_value": 604800},
+        ),
+        ModuleSetting(
+            key="bad_cache_ttl",
+            label="Remember bad links for (seconds)",
+            type="number",
+            required=True,
+            placeholder="",
+            default=86400,
+            constraints={"min_value": 0, "max_value": 604800},
+        ),
     ]
 
     def __init__(self, bot):
@@ -188,11 +593,13 @@ class LinkCheckerModule(BaseModule):
         self.db_session = None
         self.links = {}
 
-        self.blacklisted_links = []
-        self.whitelisted_links = []
+        self.blacklisted_links = LinkTrie()
+        self.whitelisted_links = LinkTrie()
 
         self.cache = LinkCheckerCache()  # cache[url] = True means url is safe, False means the link is bad
 
+        self.pipeline = None
+
         if bot and "safebrowsingapi" in bot.config["main"]:
             # XXX: This should be loaded as a setting instead.
             # There needs to be a setting for settings to have them as "passwords"
@@ -208,18 +615,25 @@ class LinkCheckerModule(BaseModule):
         HandlerManager.add_handler("on_message", self.on_message, priority=100)
         HandlerManager.add_handler("on_commit", self.on_commit)
 
+        self.cache.safe_ttl = self.settings["safe_cache_ttl"]
+        self.cache.bad_ttl = self.settings["bad_cache_ttl"]
+
+        if self.pipeline is not None:
+            self.pipeline.shutdown()
+        self.pipeline = LinkCheckerPipeline(self.check_url, bot.user_agent)
+
         if self.db_session is not None:
             self.db_session.commit()
             self.db_session.close()
             self.db_session = None
         self.db_session = DBManager.create_session()
-        self.blacklisted_links = []
+        self.blacklisted_links = LinkTrie()
         for link in self.db_session.query(BlacklistedLink):
-            self.blacklisted_links.append(link)
+            self.blacklisted_links.add(link)
 
-        self.whitelisted_links = []
+        self.whitelisted_links = LinkTrie()
         for link in self.db_session.query(WhitelistedLink):
-            self.whitelisted_links.append(link)
+            self.whitelisted_links.add(link)
 
     def disable(self, bot):
         if not bot:
@@ -228,12 +642,16 @@ class LinkCheckerModule(BaseModule):
         pajbot.managers.handler.HandlerManager.remove_handler("on_message", self.on_message)
         pajbot.managers.handler.HandlerManager.remove_handler("on_commit", self.on_commit)
 
+        # Checks that are still running keep using the pipeline until they're done
+        if self.pipeline is not None:
+            self.pipeline.shutdown()
+
         if self.db_session is not None:
             self.db_session.commit()
             self.db_session.close()
             self.db_session = None
-            self.blacklisted_links = []
-            self.whitelisted_links = []
+            self.blacklisted_links = LinkTrie()
+            self.whitelisted_links = LinkTrie()
 
     def reload(self):
 
@@ -289,23 +707,21 @@ class LinkCheckerModule(BaseModule):
 
             # First we perform a basic check
             if self.simple_check(url, action) == self.RET_FURTHER_ANALYSIS:
-                # If the basic check returns no relevant data, we queue up a proper check on the URL
-                self.bot.action_queue.submit(self.check_url, url, action)
+                # If the basic check returns no relevant data, we queue up a proper check on the URL.
+                self.pipeline.submit(url, action)
 
     def on_commit(self, **rest):
         if self.db_session is not None:
             self.db_session.commit()
 
-    def delete_from_cache(self, url):
-        if url in self.cache:
-            del self.cache[url]
+        self.cache.purge_expired()
+        log.debug(f"LinkChecker cache: {self.cache.stats()}")
 
     def cache_url(self, url, safe):
-        if url in self.cache and self.cache[url] == safe:
+        if self.cache.get(url) == safe:
             return
 
         self.cache[url] = safe
-        self.bot.execute_delayed(20, self.delete_from_cache, url)
 
     def counteract_bad_url(self, url, action=None, want_to_cache=True, want_to_blacklist=False):
         log.debug(f"LinkChecker: BAD URL FOUND {url.url}")
@@ -339,7 +755,7 @@ class LinkCheckerModule(BaseModule):
 
         link = BlacklistedLink(domain, path, level)
         self.db_session.add(link)
-        self.blacklisted_links.append(link)
+        self.blacklisted_links.add(link)
         self.db_session.commit()
 
     def whitelist_url(self, url, parsed_url=None):
@@ -362,7 +778,7 @@ class LinkCheckerModule(BaseModule):
 
         link = WhitelistedLink(domain, path)
         self.db_session.add(link)
-        self.whitelisted_links.append(link)
+        self.whitelisted_links.add(link)
         self.db_session.commit()
 
     def is_blacklisted(self, url, parsed_url=None, sublink=False):
@@ -377,15 +793,12 @@ class LinkCheckerModule(BaseModule):
         if len(domain_split) < 2:
             return False
 
-        for link in self.blacklisted_links:
-            if link.is_subdomain(domain):
-                if link.is_subpath(path):
-                    if not sublink:
-                        return True
-                    elif (
-                        link.level >= 1
-                    ):  # if it's a sublink, but the blacklisting level is 0, we don't consider it blacklisted
-                        return True
+        for link in self.blacklisted_links.find(domain, path):
+            if not sublink:
+                return True
+            elif link.level >= 1:
+                # if it's a sublink, but the blacklisting level is 0, we don't consider it blacklisted
+                return True
 
         return False
 
@@ -401,12 +814,7 @@ class LinkCheckerModule(BaseModule):
         if len(domain_split) < 2:
             return False
 
-        for link in self.whitelisted_links:
-            if link.is_subdomain(domain):
-                if link.is_subpath(path):
-                    return True
-
-        return False
+        return next(self.whitelisted_links.find(domain, path), None) is not None
 
     RET_BAD_LINK = -1
     RET_FURTHER_ANALYSIS = 0
@@ -420,19 +828,21 @@ class LinkCheckerModule(BaseModule):
         -1 = Link is bad
         0 = Link needs further analysis
         """
-        if url.url in self.cache:
-            if not self.cache[url.url]:  # link is bad
-                self.counteract_bad_url(url, action, False, False)
-                return self.RET_BAD_LINK
-
-            return self.RET_GOOD_LINK
-
+        # The blacklist and whitelist are checked before the cache (and their verdicts are not cached),
+        # since they differ between pajbot instances sharing the cache and can change at any time
         if self.is_blacklisted(url.url, url.parsed, sublink):
-            self.counteract_bad_url(url, action, want_to_blacklist=False)
+            self.counteract_bad_url(url, action, want_to_cache=False)
             return self.RET_BAD_LINK
 
         if self.is_whitelisted(url.url, url.parsed):
-            self.cache_url(url.url, True)
+            return self.RET_GOOD_LINK
+
+        safe = self.cache.get(url.url)
+        if safe is not None:
+            if not safe:  # link is bad
+                self.counteract_bad_url(url, action, False, False)
+                return self.RET_BAD_LINK
+
             return self.RET_GOOD_LINK
 
         return self.RET_FURTHER_ANALYSIS
@@ -445,7 +855,13 @@ class LinkCheckerModule(BaseModule):
 
         return self.basic_check(url, action)
 
+    # At most this many bytes of a page are downloaded and parsed to look for links
+    MAX_HTML_SIZE = 512 * 1024
+    # At most this many links to other sites are checked per page
+    MAX_SUBLINKS = 20
+
     def check_url(self, url, action):
+        """ Called from the LinkCheckerPipeline threads, for URLs that have already passed basic_check """
         url = Url(url)
         if len(url.parsed.netloc.split(".")) < 2:
             # The URL is broken, ignore it
@@ -457,19 +873,10 @@ class LinkCheckerModule(BaseModule):
             log.exception("LinkChecker unhandled exception while _check_url")
 
     def _check_url(self, url, action):
-        # XXX: The basic check is currently performed twice on links found in messages. Solve
-        res = self.basic_check(url, action)
-        if res == self.RET_GOOD_LINK:
-            return
-        elif res == self.RET_BAD_LINK:
-            return
-
         connection_timeout = 2
         read_timeout = 1
         try:
-            r = requests.head(
-                url.url, allow_redirects=True, timeout=connection_timeout, headers={"User-Agent": self.bot.user_agent}
-            )
+            r = self.pipeline.head(url, timeout=connection_timeout)
         except:
             self.cache_url(url.url, True)
             return
@@ -497,37 +904,15 @@ class LinkCheckerModule(BaseModule):
 
         if "content-type" not in r.headers or not r.headers["content-type"].startswith("text/html"):
             return  # can't analyze non-html content
-        maximum_size = 1024 * 1024 * 10  # 10 MB
+
         receive_timeout = 3
 
-        html = ""
         try:
-            response = requests.get(
-                url=url.url,
-                stream=True,
-                timeout=(connection_timeout, read_timeout),
-                headers={"User-Agent": self.bot.user_agent},
+            html = self.pipeline.fetch_html(
+                url, (connection_timeout, read_timeout), receive_timeout=receive_timeout, max_size=self.MAX_HTML_SIZE
             )
-
-            content_length = response.headers.get("Content-Length")
-            if content_length and int(response.headers.get("Content-Length")) > maximum_size:
-                log.error("This file is too big!")
+            if html is None:
                 return
-
-            size = 0
-            start = pajbot.utils.now().timestamp()
-
-            for chunk in response.iter_content(1024):
-                if pajbot.utils.now().timestamp() - start > receive_timeout:
-                    log.error("The site took too long to load")
-                    return
-
-                size += len(chunk)
-                if size > maximum_size:
-                    log.error("This file is too big! (fake header)")
-                    return
-                html += str(chunk)
-
         except requests.exceptions.ConnectTimeout:
             log.warning(f"Connection timed out while checking {url.url}")
             self.cache_url(url.url, True)
@@ -541,7 +926,8 @@ class LinkCheckerModule(BaseModule):
             return
 
         try:
-            soup = BeautifulSoup(html, "html.parser")
+            # We only care about links, so only the <a> tags are parsed
+            soup = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("a"))
         except:
             return
 
@@ -553,17 +939,25 @@ class LinkCheckerModule(BaseModule):
             if url is None:
                 continue
             if url.startswith("//"):
-                urls.append("http:" + url)
-            elif url.startswith("http://") or url.startswith("https://"):
-                urls.append(url)
+                url = "http:" + url
+            elif not (url.startswith("http://") or url.startswith("https://")):
+                continue
 
-        for url in urls:  # check if the site links to anything dangerous
             url = Url(url)
-
             if is_subdomain(url.parsed.netloc, original_url.parsed.netloc):
                 # log.debug('Skipping because internal link')
                 continue
 
+            if url.url not in urls:
+                urls.append(url.url)
+
+        if len(urls) > self.MAX_SUBLINKS:
+            log.debug(f"LinkChecker: Only checking {self.MAX_SUBLINKS} of {len(urls)} links on {original_url.url}")
+            urls = urls[: self.MAX_SUBLINKS]
+
+        for url in urls:  # check if the site links to anything dangerous
+            url = Url(url)
+
             res = self.basic_check(url, action, sublink=True)
             if res == self.RET_BAD_LINK:
                 self.counteract_bad_url(url)
@@ -574,12 +968,7 @@ class LinkCheckerModule(BaseModule):
                 continue
 
             try:
-                r = requests.head(
-                    url.url,
-                    allow_redirects=True,
-                    timeout=connection_timeout,
-                    headers={"User-Agent": self.bot.user_agent},
-                )
+                r = self.pipeline.head(url, timeout=connection_timeout)
             except:
                 continue
 
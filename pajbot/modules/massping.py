@@ -1,12 +1,19 @@
+import hashlib
 import logging
 import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
 from datetime import timedelta
 
 from sqlalchemy import and_, or_
 from sqlalchemy.sql.functions import count, func
 
+from pajbot import utils
 from pajbot.managers.db import DBManager
 from pajbot.managers.handler import HandlerManager
+from pajbot.managers.schedule import ScheduleManager
 from pajbot.models.user import User
 from pajbot.modules import BaseModule
 from pajbot.modules import ModuleSetting
@@ -16,6 +23,108 @@ log = logging.getLogger(__name__)
 USERNAME_IN_MESSAGE_PATTERN = re.compile("[A-Za-z0-9_]{4,}")
 
 
+class KnownUserIndex:
+    """
+    In-memory index of the logins and lowercase display names of all users seen in the last `MAX_AGE` seconds,
+    so checking whether a word is the name of a known user does not need a database query.
+
+    Names are stored as 60-bit hashes (the first 15 hex digits of their MD5) with the time they were last seen:
+    - The bulk of the names are loaded from the database by load(), into two arrays sorted by hash
+      (8 bytes for the hash + 4 bytes for the timestamp per name). Postgres computes the hashes and sorts them,
+      so loading does not need any memory apart from the arrays themselves.
+    - Names seen after that are kept in a dict by touch(), which is cleared whenever load() runs again.
+
+    Memory use: With 5 million users seen in the last two weeks, of which most have a display name that's
+    equal to their login, the arrays hold around 5-6 million names, which is roughly 60-70 MB.
+    The chance of a hash collision making an unknown word count as a known user is around 5 million / 2^60,
+    which is negligible.
+    """
+
+    MAX_AGE = int(timedelta(weeks=2).total_seconds())
+
+    # Names seen less than this many seconds before load() started are kept in the dict of recently seen names,
+    # since they might not have been written to the database yet (see UserCacheManager)
+    LOAD_OVERLAP = 300
+
+    LOAD_QUERY = """
+SELECT ('x' || substr(md5(known_name), 1, 15))::bit(60)::bigint AS name_hash, max(last_seen_epoch)::bigint
+FROM (
+    SELECT login AS known_name, extract(epoch FROM last_seen) AS last_seen_epoch FROM "user" WHERE last_seen >= %(since)s
+    UNION ALL
+    SELECT lower(name), extract(epoch FROM last_seen) FROM "user" WHERE last_seen >= %(since)s
+) AS known_names
+WHERE known_name ~ '^[a-z0-9_]{4,}$'
+GROUP BY name_hash
+ORDER BY name_hash"""
+
+    def __init__(self):
+        # (sorted array of name hashes, array of the last_seen timestamps for those hashes)
+        self.names = (array("q"), array("I"))
+        # name hash -> last seen timestamp, for names seen since the last load()
+        self.recent_names = {}
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    @staticmethod
+    def name_hash(name):
+        return int(hashlib.md5(name.encode("utf-8")).hexdigest()[:15], 16)
+
+    def load(self):
+        started_at = time.time()
+        hashes = array("q")
+        timestamps = array("I")
+
+        with DBManager.create_dbapi_connection_scope() as sql_conn:
+            # Named (server-side) cursors need to be used inside of a transaction
+            with sql_conn:
+                with sql_conn.cursor(name="massping_known_users") as cursor:
+                    cursor.itersize = 10000
+                    cursor.execute(self.LOAD_QUERY, {"since": utils.now() - timedelta(seconds=self.MAX_AGE)})
+                    for name_hash, last_seen in cursor:
+                        hashes.append(name_hash)
+                        timestamps.append(last_seen)
+
+        with self.lock:
+            self.names = (hashes, timestamps)
+            self.recent_names = {
+                name_hash: last_seen
+                for name_hash, last_seen in self.recent_names.items()
+                if last_seen >= started_at - self.LOAD_OVERLAP
+            }
+            self.loaded = True
+
+        log.info(f"Loaded {len(hashes)} known user names for mass ping protection in {time.time() - started_at:.2f}s")
+
+    def touch(self, names, now):
+        with self.lock:
+            for name in names:
+                self.recent_names[self.name_hash(name)] = int(now)
+
+    def get_last_seen(self, name):
+        """ Returns the unix timestamp of when a user with the given (lowercase) name was last seen, or None """
+        name_hash = self.name_hash(name)
+
+        last_seen = self.recent_names.get(name_hash, None)
+        if last_seen is not None:
+            return last_seen
+
+        hashes, timestamps = self.names
+        index = bisect_left(hashes, name_hash)
+        if index < len(hashes) and hashes[index] == name_hash:
+            return timestamps[index]
+
+        return None
+
+    def count_known(self, names, now):
+        since = now - self.MAX_AGE
+        known = 0
+        for name in names:
+            last_seen = self.get_last_seen(name)
+            if last_seen is not None and last_seen >= since:
+                known += 1
+        return known
+
+
 class MassPingProtectionModule(BaseModule):
 
     ID = __name__.split(".")[-1]
@@ -68,10 +177,23 @@ class MassPingProtectionModule(BaseModule):
         ),
     ]
 
-    @staticmethod
-    def count_known_users(usernames):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.known_users = KnownUserIndex()
+        self.reload_known_users_job = None
+
+    def count_known_users(self, usernames):
         if len(usernames) < 1:
             return 0
+
+        if self.known_users.loaded:
+            return self.known_users.count_known(usernames, time.time())
+
+        # The index is still being loaded
+        return MassPingProtectionModule.count_known_users_in_db(usernames)
+
+    @staticmethod
+    def count_known_users_in_db(usernames):
         with DBManager.create_session_scope() as db_session:
 
             # quick EXPLAIN ANALYZE for this query:
@@ -103,8 +225,7 @@ class MassPingProtectionModule(BaseModule):
                 .scalar()
             )
 
-    @staticmethod
-    def count_pings(message, source, emote_instances):
+    def count_pings(self, message, source, emote_instances):
         potential_users = set()
 
         for match in USERNAME_IN_MESSAGE_PATTERN.finditer(message):
@@ -126,10 +247,10 @@ class MassPingProtectionModule(BaseModule):
             potential_users.add(matched_part)
 
         # check how many words a known user (we have seen this username before)
-        return MassPingProtectionModule.count_known_users(potential_users)
+        return self.count_known_users(potential_users)
 
     def determine_timeout_length(self, message, source, emote_instances):
-        ping_count = MassPingProtectionModule.count_pings(message, source, emote_instances)
+        ping_count = self.count_pings(message, source, emote_instances)
         pings_too_many = ping_count - self.settings["max_ping_count"]
 
         if pings_too_many <= 0:
@@ -145,6 +266,8 @@ class MassPingProtectionModule(BaseModule):
         return self.determine_timeout_length(message, source, emote_instances) > 0
 
     def on_message(self, source, message, emote_instances, **rest):
+        self.known_users.touch((source.login, source.name.lower()), time.time())
+
         if source.level >= self.settings["bypass_level"] or source.moderator is True:
             return
 
@@ -166,5 +289,14 @@ class MassPingProtectionModule(BaseModule):
     def enable(self, bot):
         HandlerManager.add_handler("on_message", self.on_message, priority=150)
 
+        if bot and self.reload_known_users_job is None:
+            ScheduleManager.execute_now(self.known_users.load)
+            # Users that were seen without chatting (e.g. by the chatters refresh) are picked up by this
+            self.reload_known_users_job = ScheduleManager.execute_every(60 * 60, self.known_users.load)
+
     def disable(self, bot):
         HandlerManager.remove_handler("on_message", self.on_message)
+
+        if self.reload_known_users_job is not None:
+            self.reload_known_users_job.remove()
+            self.reload_known_users_job = None
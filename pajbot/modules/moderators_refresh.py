@@ -115,6 +115,10 @@ WHERE
                 )
             )
 
+        # the logins and names of the moderators were written with raw SQL
+        for basics in moderator_basics:
+            self.bot.user_cache.invalidate(basics.id)
+
         log.info(f"Successfully updated {len(moderator_basics)} moderators")
 
     def load_commands(self, **options):
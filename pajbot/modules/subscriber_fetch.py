@@ -1,7 +1,6 @@
 import logging
 
 from requests import HTTPError
-from sqlalchemy import text
 
 from pajbot.apiwrappers.authentication.token_manager import UserAccessTokenManager, NoTokenError
 from pajbot.managers.db import DBManager
@@ -66,10 +65,9 @@ class SubscriberFetchModule(BaseModule):
         sub_count = sum(1 for basics in user_basics if basics.id != self.bot.streamer_user_id)
         self.bot.kvi["active_subs"].set(sub_count)
 
-        with DBManager.create_session_scope() as db_session:
-            db_session.execute(
-                text(
-                    """
+        with DBManager.create_dbapi_cursor_scope() as cursor:
+            cursor.execute(
+                """
 CREATE TEMPORARY TABLE subscribers(
     id TEXT PRIMARY KEY NOT NULL,
     login TEXT NOT NULL,
@@ -77,32 +75,22 @@ CREATE TEMPORARY TABLE subscribers(
     tier INTEGER NOT NULL
 )
 ON COMMIT DROP"""
-                )
             )
 
-            if len(user_basics) > 0:
-                # The precondition check is to prevent an exception,
-                # if len(user_basics) was 0, then we would try to execute this SQL without any values,
-                # which would then fail.
-                # len(user_basics) can be 0 if the broadcaster does not have a subscription program.
-                def add_return_dict(dict_v, key, value):
-                    dict_v[key] = value
-                    return dict_v
-
-                db_session.execute(
-                    text("INSERT INTO subscribers(id, login, name, tier) VALUES (:id, :login, :name, :tier)"),
-                    [
-                        add_return_dict(basics.jsonify(), "tier", subscriber_ids_and_tier[basics.jsonify()["id"]])
-                        for basics in user_basics
-                    ],
-                )
+            # len(user_basics) can be 0 if the broadcaster does not have a subscription program,
+            # then nothing is copied into the table
+            DBManager.bulk_load(
+                cursor,
+                "subscribers",
+                ["id", "login", "name", "tier"],
+                ((basics.id, basics.login, basics.name, subscriber_ids_and_tier[basics.id]) for basics in user_basics),
+            )
 
             # hint to understand this query: "excluded" is a PostgreSQL keyword that referers
             # to the data we tried to insert but failed (so excluded.login would be equal to :login
             # if we only had one value for :login)
-            db_session.execute(
-                text(
-                    """
+            cursor.execute(
+                """
 WITH updated_users AS (
     INSERT INTO "user"(id, login, name, subscriber, tier)
         SELECT id, login, name, TRUE, tier FROM subscribers
@@ -120,9 +108,12 @@ SET
 WHERE
     id NOT IN (SELECT * FROM updated_users) AND
     subscriber IS TRUE"""
-                )
             )
 
+        # the logins and names of the subscribers were written with raw SQL
+        for basics in user_basics:
+            self.bot.user_cache.invalidate(basics.id)
+
         log.info(f"Successfully updated {len(user_basics)} subscribers")
 
     def load_commands(self, **options):
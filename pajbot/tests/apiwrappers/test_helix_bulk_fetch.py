@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+from requests import HTTPError, Response, Timeout
+
+from pajbot.apiwrappers.twitch.helix import TwitchHelixAPI
+from pajbot.apiwrappers.twitch.rate_limit import TokenBucket
+
+
+def make_api():
+    api = TwitchHelixAPI(redis=None, app_token_manager=None)
+    api.MAX_CHUNK_ATTEMPTS = 2
+    return api
+
+
+def http_error(status_code):
+    response = Response()
+    response.status_code = status_code
+    return HTTPError(response=response)
+
+
+def test_fetch_in_chunks_keeps_the_order():
+    api = make_api()
+    entries = [f"user{i}" for i in range(1050)]
+    running = []
+    max_running = [0]
+    lock = threading.Lock()
+
+    def fetch(chunk):
+        with lock:
+            running.append(chunk)
+            max_running[0] = max(max_running[0], len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(chunk)
+        return [entry.upper() for entry in chunk]
+
+    assert api._fetch_in_chunks(fetch, entries, 100) == [entry.upper() for entry in entries]
+    assert 1 < max_running[0] <= api.MAX_CONCURRENT_REQUESTS
+    assert api._fetch_in_chunks(fetch, [], 100) == []
+
+
+def test_failed_chunks_are_retried(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    api = make_api()
+    failures = {"user0": [Timeout()], "user200": [http_error(503)]}
+
+    def fetch(chunk):
+        chunk_failures = failures.get(chunk[0], [])
+        if chunk_failures:
+            raise chunk_failures.pop()
+        return chunk
+
+    entries = [f"user{i}" for i in range(300)]
+    assert api._fetch_in_chunks(fetch, entries, 100) == entries
+
+
+def test_client_errors_and_repeated_failures_are_raised(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    api = make_api()
+
+    def fetch_bad_request(chunk):
+        raise http_error(400)
+
+    with pytest.raises(HTTPError):
+        api._fetch_in_chunks(fetch_bad_request, ["a", "b"], 1)
+
+    def fetch_timeout(chunk):
+        raise Timeout()
+
+    with pytest.raises(Timeout):
+        api._fetch_in_chunks(fetch_timeout, ["a"], 1)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert bucket.tokens < 1
+
+    bucket.update({"Ratelimit-Limit": "120", "Ratelimit-Remaining": "100"})
+    assert bucket.capacity == 120
+    assert bucket.tokens < 1
+
+    # 120 tokens per minute = one token every half second
+    started_at = time.monotonic()
+    bucket.acquire()
+    assert 0.2 < time.monotonic() - started_at < 1
+
+
+def test_token_bucket_blocks_until_reset():
+    bucket = TokenBucket(capacity=6000)
+    bucket.block_until_reset({"Ratelimit-Reset": str(int(time.time()) + 1)})
+
+    started_at = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - started_at > 0.1
@@ -0,0 +1,113 @@
+from pajbot.apiwrappers.response_cache import APIResponseCache
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.expiries = {}
+        self.num_round_trips = 0
+
+    def mget(self, keys):
+        self.num_round_trips += 1
+        return [self.values.get(key, None) for key in keys]
+
+    def setex(self, key, expiry, value):
+        self.values[key] = value
+        self.expiries[key] = expiry
+
+    def pipeline(self, transaction=True):
+        redis = self
+
+        class FakePipeline:
+            def __init__(self):
+                self.commands = []
+
+            def setex(self, key, expiry, value):
+                self.commands.append((key, expiry, value))
+
+            def execute(self):
+                redis.num_round_trips += 1
+                for command in self.commands:
+                    redis.setex(*command)
+
+        return FakePipeline()
+
+
+def fetch_fn(fetched):
+    def fetch(logins):
+        fetched.append(list(logins))
+        return [None if login.startswith("missing") else {"login": login} for login in logins]
+
+    return fetch
+
+
+def bulk_fetch(cache, logins, fetched, **kwargs):
+    return cache.cache_bulk_fetch_fn(
+        logins,
+        redis_key_fn=lambda login: f"user:{login}",
+        fetch_fn=fetch_fn(fetched),
+        expiry=lambda response: 30 if response is None else 300,
+        **kwargs,
+    )
+
+
+def test_results_are_in_input_order():
+    redis = FakeRedis()
+    cache = APIResponseCache(redis)
+    fetched = []
+
+    assert bulk_fetch(cache, ["a", "b"], fetched) == [{"login": "a"}, {"login": "b"}]
+    assert fetched == [["a", "b"]]
+
+    results = bulk_fetch(cache, ["c", "a", "missing1", "b", "d"], fetched)
+    assert results == [{"login": "c"}, {"login": "a"}, None, {"login": "b"}, {"login": "d"}]
+    assert fetched[-1] == ["c", "missing1", "d"]
+    assert redis.expiries["user:missing1"] == 30
+    assert redis.expiries["user:d"] == 300
+
+    # None is cached too
+    assert bulk_fetch(cache, ["missing1", "d"], fetched) == [None, {"login": "d"}]
+    assert len(fetched) == 2
+
+
+def test_chunked_round_trips():
+    redis = FakeRedis()
+    cache = APIResponseCache(redis)
+    cache.BULK_CHUNK_SIZE = 10
+    fetched = []
+
+    logins = [f"user{i}" for i in range(95)]
+    results = bulk_fetch(cache, logins, fetched)
+    assert [result["login"] for result in results] == logins
+    # 10 MGETs and 10 pipelines
+    assert redis.num_round_trips == 20
+
+    results = bulk_fetch(cache, logins, fetched)
+    assert [result["login"] for result in results] == logins
+    assert redis.num_round_trips == 30
+    assert len(fetched) == 1
+
+
+def test_force_fetch():
+    redis = FakeRedis()
+    cache = APIResponseCache(redis)
+    fetched = []
+
+    bulk_fetch(cache, ["a", "b"], fetched)
+    assert bulk_fetch(cache, ["b", "a"], fetched, force_fetch=True) == [{"login": "b"}, {"login": "a"}]
+    assert fetched == [["a", "b"], ["b", "a"]]
+
+
+def test_memoize():
+    redis = FakeRedis()
+    cache = APIResponseCache(redis)
+    fetched = []
+
+    results = bulk_fetch(cache, ["a", "b", "a", "a"], fetched, memoize=True)
+    assert results == [{"login": "a"}, {"login": "b"}, {"login": "a"}, {"login": "a"}]
+    assert results[0] is results[2]
+    assert fetched == [["a", "b"]]
+
+    results = bulk_fetch(cache, ["b", "c", "b"], fetched, memoize=True)
+    assert results == [{"login": "b"}, {"login": "c"}, {"login": "b"}]
+    assert fetched[-1] == ["c"]
@@ -0,0 +1,42 @@
+from array import array
+
+from pajbot.modules.massping import KnownUserIndex
+
+
+def make_index(names):
+    index = KnownUserIndex()
+    entries = sorted((KnownUserIndex.name_hash(name), last_seen) for name, last_seen in names.items())
+    index.names = (array("q", [h for h, _ in entries]), array("I", [t for _, t in entries]))
+    index.loaded = True
+    return index
+
+
+def test_name_hash_fits_in_bigint():
+    for name in ["pajlada", "testaccount_420", "a" * 25]:
+        assert 0 <= KnownUserIndex.name_hash(name) < 2 ** 60
+
+
+def test_loaded_names():
+    now = 1_600_000_000
+    index = make_index({"pajlada": now - 60, "forsen": now - 3600, "snusbot": now - KnownUserIndex.MAX_AGE - 1})
+
+    assert index.get_last_seen("pajlada") == now - 60
+    assert index.get_last_seen("nobody") is None
+    assert index.count_known(["pajlada", "forsen", "nobody"], now) == 2
+
+
+def test_expired_names_are_not_known():
+    now = 1_600_000_000
+    index = make_index({"snusbot": now - KnownUserIndex.MAX_AGE - 1})
+
+    assert index.count_known(["snusbot"], now) == 0
+
+
+def test_touch():
+    now = 1_600_000_000
+    index = make_index({"snusbot": now - KnownUserIndex.MAX_AGE - 1})
+
+    index.touch(["snusbot", "newuser"], now)
+
+    assert index.get_last_seen("newuser") == now
+    assert index.count_known(["snusbot", "newuser", "nobody"], now) == 2
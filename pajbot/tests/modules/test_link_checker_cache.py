@@ -0,0 +1,36 @@
+from pajbot.modules.linkchecker import LinkCheckerCache
+
+
+def test_separate_ttls_for_safe_and_bad_verdicts():
+    cache = LinkCheckerCache(safe_ttl=60, bad_ttl=-1)
+
+    cache["http://example.com/"] = True
+    cache["http://bad.example.com/"] = False
+
+    assert cache.get("HTTP://EXAMPLE.COM") is True
+    assert cache.get("http://bad.example.com/") is None
+    assert cache.stats() == {"size": 1, "hits": 1, "redis_hits": 0, "misses": 1}
+
+
+def test_expired_entries_are_ignored_and_purged():
+    cache = LinkCheckerCache(safe_ttl=60, bad_ttl=60)
+    cache["http://example.com/"] = False
+    cache.cache["http://example.com"] = (False, 0)
+
+    assert "http://example.com/" not in cache
+
+    cache["http://example.org/"] = True
+    cache.cache["http://example.org"] = (True, 0)
+    cache.purge_expired()
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = LinkCheckerCache(max_size=2)
+    cache["http://a.com"] = True
+    cache["http://b.com"] = True
+    assert cache.get("http://a.com") is True
+
+    cache["http://c.com"] = False
+
+    assert list(cache.cache.keys()) == ["http://a.com", "http://c.com"]
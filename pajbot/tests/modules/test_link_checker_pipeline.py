@@ -0,0 +1,62 @@
+import threading
+
+from pajbot.modules.linkchecker import LinkCheckerPipeline
+
+
+def test_deduplicates_urls_being_checked():
+    started = threading.Event()
+    release = threading.Event()
+    finished = threading.Event()
+    checked_urls = []
+
+    def check_url(url, action):
+        checked_urls.append(url)
+        started.set()
+        release.wait(timeout=5)
+        action()
+        finished.set()
+
+    pipeline = LinkCheckerPipeline(check_url, "test")
+
+    actions_run = []
+    pipeline.submit("http://example.com/", lambda: actions_run.append(1))
+    assert started.wait(timeout=5)
+    pipeline.submit("HTTP://EXAMPLE.COM", lambda: actions_run.append(2))
+
+    release.set()
+    assert finished.wait(timeout=5)
+    pipeline.executor.shutdown(wait=True)
+
+    assert checked_urls == ["http://example.com/"]
+    assert sorted(actions_run) == [1, 2]
+    assert pipeline.checks == {}
+
+
+def test_host_slot_is_released():
+    pipeline = LinkCheckerPipeline(lambda url, action: None, "test")
+
+    with pipeline.host_slot("Example.com"):
+        assert pipeline.hosts["example.com"][1] == 1
+
+    assert pipeline.hosts == {}
+
+
+def test_shutdown_does_not_wait_for_running_checks():
+    started = threading.Event()
+    release = threading.Event()
+    finished = threading.Event()
+
+    def check_url(url, action):
+        started.set()
+        release.wait(timeout=5)
+        finished.set()
+
+    pipeline = LinkCheckerPipeline(check_url, "test")
+    pipeline.submit("http://example.com/", lambda: None)
+    assert started.wait(timeout=5)
+
+    pipeline.shutdown()
+    assert not finished.is_set()
+
+    release.set()
+    assert finished.wait(timeout=5)
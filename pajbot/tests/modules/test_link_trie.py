@@ -0,0 +1,77 @@
+from pajbot.modules.linkchecker import LinkCheckerLink, LinkTrie
+
+
+class FakeLink(LinkCheckerLink):
+    def __init__(self, domain, path):
+        self.domain = domain
+        self.path = path
+
+    def __repr__(self):
+        return f"FakeLink({self.domain!r}, {self.path!r})"
+
+
+LINKS = [
+    FakeLink("pajlada.se", "/"),
+    FakeLink("www.forsen.tv", "/"),
+    FakeLink("test.pajlada.com", "/foo"),
+    FakeLink("pajlada.com", "/foo/bar/"),
+    FakeLink("pajlada.com", "/foo//"),
+    FakeLink("example.com", "/a/b"),
+    FakeLink("example.com", "/a/b"),
+]
+
+LOOKUPS = [
+    ("pajlada.se", "/"),
+    ("pajlada.se", "/anything/at/all"),
+    ("www.pajlada.se", "/"),
+    ("notpajlada.se", "/"),
+    ("forsen.tv", "/"),
+    ("www.forsen.tv", "/x"),
+    ("test.pajlada.com", "/foo"),
+    ("test.pajlada.com", "/foo/"),
+    ("test.pajlada.com", "/foobar"),
+    ("a.test.pajlada.com", "/foo/x"),
+    ("pajlada.com", "/foo"),
+    ("pajlada.com", "/foo/bar"),
+    ("pajlada.com", "/foo/bar/baz"),
+    ("pajlada.com", "/foo//x"),
+    ("example.com", "/a"),
+    ("example.com", "/a/b"),
+    ("example.com", "/a/bc"),
+    ("example.com:8080", "/a/b"),
+    ("se", "/"),
+]
+
+
+def build_trie():
+    trie = LinkTrie()
+    for link in LINKS:
+        trie.add(link)
+    return trie
+
+
+def test_finds_same_links_as_linear_check():
+    trie = build_trie()
+    assert len(trie) == len(LINKS)
+
+    for domain, path in LOOKUPS:
+        expected = [link for link in LINKS if link.is_subdomain(domain) and link.is_subpath(path)]
+        assert sorted(trie.find(domain, path), key=id) == sorted(expected, key=id), (domain, path)
+
+
+def test_remove():
+    trie = build_trie()
+    assert trie.remove(LINKS[0])
+    assert not trie.remove(LINKS[0])
+    assert len(trie) == len(LINKS) - 1
+    assert list(trie.find("pajlada.se", "/")) == []
+
+    # the duplicate link is still there
+    assert trie.remove(LINKS[5])
+    assert list(trie.find("example.com", "/a/b")) == [LINKS[6]]
+
+
+def test_remove_unknown_link():
+    trie = build_trie()
+    assert not trie.remove(FakeLink("unknown.com", "/"))
+    assert not trie.remove(FakeLink("pajlada.se", "/unknown"))
@@ -0,0 +1,45 @@
+import pytest
+
+from pajbot.utils import AhoCorasick
+
+
+def build(*needles):
+    automaton = AhoCorasick()
+    for needle in needles:
+        automaton.add(needle, needle)
+    return automaton.build()
+
+
+def test_finds_overlapping_matches():
+    automaton = build("he", "she", "his", "hers")
+    assert sorted(automaton.iter("ushers")) == [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")]
+
+
+def test_no_matches():
+    automaton = build("abc")
+    assert list(automaton.iter("ab bc ac")) == []
+
+
+def test_repeated_matches():
+    automaton = build("aa")
+    assert list(automaton.iter("aaaa")) == [(0, 2, "aa"), (1, 3, "aa"), (2, 4, "aa")]
+
+
+def test_same_needle_multiple_values():
+    automaton = AhoCorasick()
+    automaton.add("xd", 1)
+    automaton.add("xd", 2)
+    automaton.build()
+    assert list(automaton.iter("lulxd")) == [(3, 5, 1), (3, 5, 2)]
+
+
+def test_empty_needle():
+    with pytest.raises(ValueError):
+        AhoCorasick().add("", None)
+
+
+def test_must_be_built():
+    automaton = AhoCorasick()
+    automaton.add("abc", None)
+    with pytest.raises(RuntimeError):
+        list(automaton.iter("abc"))
@@ -0,0 +1,88 @@
+from pajbot.models.banphrase import Banphrase, BanphraseMatcher
+from pajbot.models.user import User  # noqa: F401 (required for the Banphrase mappers to be configured)
+
+
+class FakeUser:
+    def __init__(self, subscriber):
+        self.subscriber = subscriber
+
+
+def create_banphrases():
+    banphrase_options = [
+        {"phrase": "forsen", "length": 300},
+        {"phrase": "Forsen", "length": 600, "case_sensitive": True},
+        {"phrase": "cafe", "length": 100, "remove_accents": True},
+        {"phrase": "start", "operator": "startswith", "length": 200},
+        {"phrase": "end", "operator": "endswith", "length": 200},
+        {"phrase": "exact message", "operator": "exact", "length": 700},
+        {"phrase": "perma", "permanent": True},
+        {"phrase": "perma2", "permanent": True},
+        {"phrase": "sub", "sub_immunity": True, "length": 900},
+        {"phrase": r"\bx+d+\b", "operator": "regex", "length": 50},
+        {"phrase": r"(ab)\1", "operator": "regex", "length": 60},
+        {"phrase": r"(foo|bar)baz", "operator": "regex", "length": 64},
+        {"phrase": r"(<)?qq(?(1)>|!)", "operator": "regex", "length": 65},
+        {"phrase": r"(?i)kappa", "operator": "regex", "length": 70, "case_sensitive": True},
+        {"phrase": r"[", "operator": "regex", "length": 80},
+        {"phrase": "", "operator": "exact", "length": 90},
+    ]
+
+    banphrases = []
+    for index, options in enumerate(banphrase_options):
+        banphrase = Banphrase(**options)
+        banphrase.id = index
+        banphrases.append(banphrase)
+    return banphrases
+
+
+MESSAGES = [
+    "",
+    "hello",
+    "forsen",
+    "FORSEN",
+    "Forsen",
+    "café",
+    "CAFÉ au lait",
+    "start of message",
+    "not start",
+    "message end",
+    "end of message",
+    "exact message",
+    "EXACT MESSAGE",
+    "exact message but longer",
+    "perma perma2",
+    "perma2 forsen",
+    "sub",
+    "sub forsen",
+    "xxdd",
+    "xddd lol",
+    "abab",
+    "foobaz",
+    "<qq>",
+    "qq!",
+    "qq>",
+    "KAPPA",
+    "[",
+]
+
+
+def test_matches_like_linear_check():
+    banphrases = create_banphrases()
+    matcher = BanphraseMatcher(banphrases)
+
+    for user in [None, FakeUser(True), FakeUser(False)]:
+        for message in MESSAGES:
+            expected = [banphrase for banphrase in banphrases if banphrase.match(message, user)]
+            assert matcher.matches(message, user) == expected, message
+
+
+def test_matches_in_original_order():
+    banphrases = create_banphrases()
+    matcher = BanphraseMatcher(banphrases)
+
+    matches = matcher.matches("perma2 forsen xd", None)
+    assert [banphrase.phrase for banphrase in matches] == ["forsen", "perma", "perma2", r"\bx+d+\b"]
+
+
+def test_empty_matcher():
+    assert BanphraseMatcher([]).matches("forsen", None) == []
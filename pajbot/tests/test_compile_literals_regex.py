@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from pajbot.utils import compile_literals_regex
+
+
+def find_longest_naive(literals, text):
+    literals = sorted(literals, key=len, reverse=True)
+    found = []
+    index = 0
+    while index < len(text):
+        for literal in literals:
+            if text.startswith(literal, index):
+                found.append(literal)
+                index += len(literal)
+                break
+        else:
+            index += 1
+    return found
+
+
+def test_prefers_longest_literal():
+    regex = compile_literals_regex(["a", "ab", "abc", "b", "bd"])
+
+    assert regex.findall("abcabdab") == ["abc", "ab", "ab"]
+    assert regex.findall("bdb") == ["bd", "b"]
+
+
+def test_special_characters_are_escaped():
+    literals = ["a.b", "[", "]", "-", "^", "\\", "(?:", "*+"]
+    regex = compile_literals_regex(literals)
+
+    assert regex.findall("axb a.b [-] ^\\ (?: *+ * +") == ["a.b", "[", "-", "]", "^", "\\", "(?:", "*+"]
+
+
+def test_matches_naive_search():
+    rng = random.Random(1)
+    literals = ["".join(rng.choices("abcd", k=rng.randint(1, 4))) for _ in range(30)]
+    regex = compile_literals_regex(literals)
+
+    for _ in range(500):
+        text = "".join(rng.choices("abcde", k=30))
+        assert regex.findall(text) == find_longest_naive(literals, text)
+
+
+def test_empty_literal():
+    with pytest.raises(ValueError):
+        compile_literals_regex(["a", ""])
@@ -0,0 +1,82 @@
+from irc.client import Event, NickMask
+
+from pajbot.managers.connection import Connection, ConnectionManager
+
+
+class FakeConnection(Connection):
+    def __init__(self, name, channels=[], connected=True):
+        super().__init__(None, name, channels)
+        self.fake_connected = connected
+
+    def is_connected(self):
+        return self.fake_connected
+
+
+def create_connection_manager(num_write_connections=2, control_hub_connection=True):
+    return ConnectionManager(
+        None,
+        None,
+        "streamer",
+        "hub",
+        "irc.example.com",
+        6697,
+        num_write_connections=num_write_connections,
+        control_hub_connection=control_hub_connection,
+    )
+
+
+def test_messages_are_spread_over_write_connections():
+    manager = create_connection_manager()
+    manager.main_conn = FakeConnection("main", ["#streamer"])
+    manager.write_conns = [FakeConnection("write #1"), FakeConnection("write #2")]
+
+    picked = []
+    for _ in range(4):
+        conn = manager.pick_connection("#streamer", 0)
+        conn.record_sent(0)
+        picked.append(conn.name)
+
+    assert sorted(picked) == ["write #1", "write #1", "write #2", "write #2"]
+    assert manager.write_conns[0].load(31) == 0
+
+
+def test_falls_back_to_main_connection():
+    manager = create_connection_manager()
+    manager.main_conn = FakeConnection("main", ["#streamer"])
+    manager.write_conns = [FakeConnection("write #1", connected=False), None]
+
+    assert manager.pick_connection("#streamer", 0) is manager.main_conn
+
+    manager.main_conn.fake_connected = False
+    assert manager.pick_connection("#streamer", 0) is None
+
+
+def test_control_hub_connection():
+    manager = create_connection_manager()
+    manager.main_conn = FakeConnection("main", ["#streamer"])
+    manager.control_hub_conn = FakeConnection("control hub", ["#hub"])
+    manager.write_conns = [FakeConnection("write #1")]
+
+    assert manager.pick_connection("#hub", 0) is manager.control_hub_conn
+    assert manager.pick_connection("#streamer", 0) is manager.write_conns[0]
+    assert not manager.write_conns[0].reads
+
+
+def test_events_are_dispatched_once():
+    manager = create_connection_manager()
+    manager.main_conn = FakeConnection("main", ["#streamer"])
+    manager.control_hub_conn = FakeConnection("control hub", ["#hub"])
+    manager.write_conns = [FakeConnection("write #1")]
+
+    def dispatched_by(event):
+        return [conn.name for conn in manager.connections if manager.should_dispatch(conn, event)]
+
+    whisper = Event("whisper", NickMask("user!user@user.tmi.twitch.tv"), "bot", ["!ping"])
+    assert dispatched_by(whisper) == ["main"]
+
+    # Channel events are only received by the connection that joined the channel
+    hub_message = Event("pubmsg", NickMask("user!user@user.tmi.twitch.tv"), "#hub", ["!quit"])
+    assert manager.should_dispatch(manager.control_hub_conn, hub_message)
+    assert not manager.should_dispatch(manager.write_conns[0], hub_message)
+
+    assert dispatched_by(Event("welcome", "tmi.twitch.tv", "bot", [])) == ["main", "control hub", "write #1"]
@@ -0,0 +1,39 @@
+import datetime
+
+from pajbot.managers.db import CSVRowStream, format_csv_value
+
+
+def test_format_csv_value():
+    assert format_csv_value(None) == ""
+    assert format_csv_value("") == '""'
+    assert format_csv_value('say "hi", chat') == '"say ""hi"", chat"'
+    assert format_csv_value("line\nbreak") == '"line\nbreak"'
+    assert format_csv_value(True) == "t"
+    assert format_csv_value(False) == "f"
+    assert format_csv_value(1337) == "1337"
+    assert format_csv_value(datetime.timedelta(minutes=10)) == '"600.0 seconds"'
+    assert format_csv_value({"a": 1}) == '"{""a"": 1}"'
+
+
+def test_stream_reads_all_rows_in_chunks():
+    rows = [(str(i), f"user{i}", None) for i in range(1000)]
+    expected = "".join(f'"{i}","user{i}",\n' for i in range(1000))
+
+    stream = CSVRowStream(row for row in rows)
+    chunks = []
+    while True:
+        chunk = stream.read(100)
+        if not chunk:
+            break
+        assert len(chunk) <= 100
+        chunks.append(chunk)
+
+    assert "".join(chunks) == expected
+    assert stream.num_rows == 1000
+
+
+def test_stream_read_everything():
+    stream = CSVRowStream([("a", 1), ("b", 2)])
+    assert stream.read() == '"a",1\n"b",2\n'
+    assert stream.read() == ""
+    assert stream.num_rows == 2
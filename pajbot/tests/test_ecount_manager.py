@@ -0,0 +1,89 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from pajbot.managers.emote import EcountManager
+from pajbot.managers.redis import RedisManager
+from pajbot.managers.schedule import ScheduleManager
+from pajbot.models.emote import EmoteInstanceCount
+from pajbot.streamhelper import StreamHelper
+
+
+class FakeRedis:
+    def __init__(self):
+        self.counts = {}
+        # Set to an Event to pause flushes right after their counts were written
+        self.pause_after_write = None
+        self.written = threading.Event()
+
+    def zscore(self, key, member):
+        return self.counts.get(member, None)
+
+    @contextmanager
+    def pipeline_context(self):
+        redis = self
+
+        class FakePipeline:
+            def zincrby(self, key, amount, member):
+                redis.counts[member] = redis.counts.get(member, 0) + amount
+
+        yield FakePipeline()
+
+        self.written.set()
+        if self.pause_after_write is not None:
+            self.pause_after_write.wait(5)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(RedisManager, "get", lambda: redis)
+    monkeypatch.setattr(RedisManager, "pipeline_context", redis.pipeline_context)
+    monkeypatch.setattr(StreamHelper, "get_streamer", lambda: "pajlada")
+    monkeypatch.setattr(ScheduleManager, "execute_every", lambda *args, **kwargs: None)
+    return redis
+
+
+def use_emote(manager, code, count):
+    manager.handle_emotes({code: EmoteInstanceCount(count=count, emote=None, emote_instances=[])})
+
+
+def test_pending_counts_are_included(redis):
+    manager = EcountManager()
+    assert manager.get_emote_count("Kappa") is None
+
+    use_emote(manager, "Kappa", 2)
+    assert manager.get_emote_count("Kappa") == 2
+
+    manager.commit()
+    use_emote(manager, "Kappa", 3)
+    assert redis.counts == {"Kappa": 2}
+    assert manager.get_emote_count("Kappa") == 5
+
+
+def test_count_is_exact_while_flushing(redis):
+    manager = EcountManager()
+    use_emote(manager, "Kappa", 2)
+    use_emote(manager, "Keepo", 1)
+
+    # The counts are in redis, but still in flight
+    redis.pause_after_write = threading.Event()
+    flush = threading.Thread(target=manager.commit)
+    flush.start()
+    redis.written.wait(5)
+
+    # Emotes that are not being written can be read right away
+    assert manager.get_emote_count("PogChamp") is None
+
+    result = []
+    reader = threading.Thread(target=lambda: result.append(manager.get_emote_count("Kappa")))
+    reader.start()
+    time.sleep(0.05)
+
+    redis.pause_after_write.set()
+    flush.join(5)
+    reader.join(5)
+
+    assert result == [2]
@@ -0,0 +1,13 @@
+from pajbot.emoji import contains_emoji, find_emoji
+
+
+def test_contains_emoji():
+    assert contains_emoji("hello 😀")
+    assert contains_emoji("#️⃣")
+    assert not contains_emoji("hello #1 ä")
+    assert not contains_emoji("")
+
+
+def test_find_emoji():
+    assert find_emoji("hi 👍🏽 there 😀😀 🇩🇪") == ["👍🏽", "😀", "😀", "🇩🇪"]
+    assert find_emoji("no emoji here") == []
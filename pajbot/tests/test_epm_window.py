@@ -0,0 +1,34 @@
+from pajbot.managers.emote import EpmWindow
+
+
+def test_counts_expire_after_a_minute():
+    window = EpmWindow()
+
+    window.add(100, 3)
+    window.add(130, 2)
+    assert window.get(130) == 5
+    assert window.get(159) == 5
+    assert window.get(160) == 2
+    assert window.get(189) == 2
+    assert window.get(190) == 0
+
+
+def test_same_second_is_accumulated():
+    window = EpmWindow()
+
+    window.add(5, 1)
+    window.add(5, 1)
+    window.add(5, 4)
+    assert window.get(5) == 6
+
+
+def test_long_gap_clears_window():
+    window = EpmWindow()
+
+    for second in range(0, 60):
+        window.add(second, 1)
+    assert window.get(59) == 60
+
+    window.add(1000, 7)
+    assert window.get(1000) == 7
+    assert sum(window.buckets) == 7
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from pajbot.managers.handler import HandlerManager
+from pajbot.managers.handler_watchdog import HandlerStats, HandlerWatchdog, SlowHandlerAction
+
+
+class MockBot:
+    def __init__(self):
+        self.executed = []
+
+    def execute_now(self, function, *args):
+        self.executed.append((function, args))
+
+
+@pytest.fixture
+def watchdog():
+    HandlerManager.init_handlers()
+    watchdog = HandlerWatchdog(MockBot(), action=SlowHandlerAction.DISABLE, default_budget=0.01, strikes=2, window=3)
+    HandlerManager.watchdog = watchdog
+    yield watchdog
+    HandlerManager.watchdog = None
+
+
+def test_rolling_window():
+    stats = HandlerStats("on_message", None, budget=0.1, window=3)
+    for seconds in [0.2, 0.2, 0.05, 0.05]:
+        stats.observe(seconds)
+
+    assert list(stats.durations) == [0.2, 0.05, 0.05]
+    assert stats.num_over_budget == 1
+    assert stats.num_calls == 4
+    assert stats.percentile(50) == 0.05
+    assert stats.percentile(100) == 0.2
+
+
+def test_event_budgets():
+    watchdog = HandlerWatchdog(MockBot(), default_budget=1, event_budgets={"on_tick": 2})
+    assert watchdog.budget("on_tick") == 2
+    assert watchdog.budget("on_message") == HandlerWatchdog.DEFAULT_EVENT_BUDGETS["on_message"]
+    assert watchdog.budget("on_commit") == 1
+
+
+def test_invalid_action():
+    with pytest.raises(ValueError):
+        HandlerWatchdog(MockBot(), action="explode")
+
+
+def test_slow_handler_module_is_disabled(watchdog):
+    calls = []
+
+    def slow_handler(**rest):
+        calls.append("slow")
+        time.sleep(0.02)
+        return False
+
+    def fast_handler(**rest):
+        calls.append("fast")
+
+    HandlerManager.add_handler("on_tick", slow_handler, priority=10)
+    HandlerManager.add_handler("on_tick", fast_handler)
+
+    # The slow handler keeps running on the triggering thread, and can still stop the event
+    for _ in range(3):
+        HandlerManager.trigger("on_tick")
+    assert calls == ["slow", "slow", "slow"]
+
+    # Its module is only disabled once
+    assert [function for function, args in watchdog.bot.executed] == [watchdog._disable_module]
+
+    assert [stats.handler for stats in watchdog.top_offenders()] == [slow_handler]
+
+
+def test_essential_handlers_are_only_logged(watchdog):
+    def slow_handler(**rest):
+        time.sleep(0.02)
+
+    HandlerManager.add_handler("on_tick", slow_handler, priority=HandlerManager.ESSENTIAL_PRIORITY)
+    for _ in range(3):
+        HandlerManager.trigger("on_tick")
+
+    assert watchdog.bot.executed == []
+    (stats,) = watchdog.stats.values()
+    assert stats.last_action_at is not None
+
+
+def test_stack_sample(watchdog):
+    started = threading.Event()
+    release = threading.Event()
+
+    def stuck_handler(**rest):
+        started.set()
+        release.wait(5)
+
+    HandlerManager.add_handler("on_tick", stuck_handler)
+    thread = threading.Thread(target=HandlerManager.trigger, args=("on_tick",))
+    thread.start()
+    started.wait(5)
+    time.sleep(0.02)
+
+    watchdog.sample()
+    release.set()
+    thread.join(5)
+
+    (stats,) = watchdog.stats.values()
+    assert "stuck_handler" in stats.stack_sample
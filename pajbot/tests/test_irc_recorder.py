@@ -0,0 +1,104 @@
+import gzip
+import os
+import threading
+import time
+
+from irc.client import Event, NickMask
+
+from pajbot.managers.irc_recorder import IRCTrafficRecorder, RecordedEvent, paced, read_recording, read_recordings
+
+
+def make_event(i):
+    return Event(
+        "pubmsg",
+        NickMask(f"user{i}!user{i}@user{i}.tmi.twitch.tv"),
+        "#pajlada",
+        [f"message number {i} PogChamp"],
+        [{"key": "user-id", "value": str(i)}, {"key": "emotes", "value": None}],
+    )
+
+
+def test_round_trip(tmp_path):
+    recorder = IRCTrafficRecorder(str(tmp_path))
+    for i in range(100):
+        recorder.record(make_event(i))
+    recorder.record(Event("all_raw_messages", None, None, ["PING :tmi.twitch.tv"]))
+    recorder.stop()
+
+    assert recorder.num_recorded == 100
+    recorded_events = list(read_recordings([str(path) for path in tmp_path.iterdir()]))
+    assert len(recorded_events) == 100
+
+    for i, recorded_event in enumerate(recorded_events):
+        expected = make_event(i)
+        assert recorded_event.received_at > 0
+        assert recorded_event.event.type == expected.type
+        assert recorded_event.event.source == expected.source
+        assert recorded_event.event.source.user == f"user{i}"
+        assert recorded_event.event.target == expected.target
+        assert recorded_event.event.arguments == expected.arguments
+        assert recorded_event.event.tags == expected.tags
+
+
+def test_rotation_and_total_size(tmp_path):
+    recorder = IRCTrafficRecorder(str(tmp_path), max_file_size=2000, max_total_size=3000)
+    for i in range(2000):
+        recorder.record(make_event(i))
+    recorder.stop()
+
+    paths = sorted(str(path) for path in tmp_path.iterdir())
+    assert len(paths) > 1
+    assert sum(os.path.getsize(path) for path in paths[:-1]) <= 3000
+
+    # The newest events are kept, in order
+    recorded_events = list(read_recordings(paths))
+    assert recorded_events[-1].event.arguments == make_event(1999).arguments
+    received_ats = [recorded_event.received_at for recorded_event in recorded_events]
+    assert received_ats == sorted(received_ats)
+
+
+def test_truncated_file_is_read_up_to_the_last_complete_record(tmp_path):
+    recorder = IRCTrafficRecorder(str(tmp_path))
+    for i in range(10):
+        recorder.record(make_event(i))
+    recorder.stop()
+
+    (path,) = tmp_path.iterdir()
+    with gzip.open(path, "rb") as recording:
+        data = recording.read()
+    with gzip.open(path, "wb") as recording:
+        recording.write(data[:-5])
+
+    recorded_events = list(read_recording(str(path)))
+    assert len(recorded_events) == 9
+
+
+def test_stop_does_not_wait_for_a_full_queue(tmp_path):
+    recorder = IRCTrafficRecorder(str(tmp_path), max_queue_size=5)
+
+    # Keep the writer busy with the first event
+    release = threading.Event()
+    write = recorder._write
+    recorder._write = lambda recorded_event: release.wait(5) and write(recorded_event)
+
+    for i in range(10):
+        recorder.record(make_event(i))
+    assert recorder.num_dropped > 0
+
+    started_at = time.monotonic()
+    recorder.stop(timeout=0.1)
+    assert time.monotonic() - started_at < 1
+    assert recorder.writer.is_alive()
+
+    # The events that were already queued are still written, new ones are ignored
+    recorder.record(make_event(10))
+    release.set()
+    recorder.writer.join(5)
+    assert recorder.num_recorded == 10 - recorder.num_dropped
+    assert len(list(read_recordings([str(path) for path in tmp_path.iterdir()]))) == recorder.num_recorded
+
+
+def test_paced():
+    recorded_events = [RecordedEvent(1000 + i * 0.01, make_event(i)) for i in range(5)]
+    assert list(paced(recorded_events, 0)) == recorded_events
+    assert list(paced(recorded_events, 100)) == recorded_events
@@ -0,0 +1,76 @@
+import threading
+
+from pajbot.managers.handler import HandlerManager
+from pajbot.message_pipeline import MessagePipeline
+
+
+def test_messages_from_the_same_key_are_handled_in_order():
+    pipeline = MessagePipeline(num_workers=4)
+    handled = {}
+    lock = threading.Lock()
+
+    def handle(key, index, overloaded=False):
+        with lock:
+            handled.setdefault(key, []).append(index)
+
+    for index in range(200):
+        for key in ("a", "b", "c", "d", "e"):
+            pipeline.submit(key, handle, key, index)
+
+    pipeline.stop(timeout=5)
+
+    assert handled == {key: list(range(200)) for key in ("a", "b", "c", "d", "e")}
+    stats = pipeline.stats()
+    assert stats["depth"] == 0
+    assert stats["queue"]["count"] == 1000
+    assert stats["handle"]["count"] == 1000
+
+
+def test_overloaded_worker_is_told_to_skip_work():
+    pipeline = MessagePipeline(num_workers=1, overload_threshold=2)
+    release = threading.Event()
+    overloaded_flags = []
+
+    def handle(overloaded=False):
+        release.wait(timeout=5)
+        overloaded_flags.append(overloaded)
+
+    for _ in range(6):
+        pipeline.submit("a", handle)
+    release.set()
+    pipeline.stop(timeout=5)
+
+    # The first message might have been picked up before the others were queued
+    assert overloaded_flags[1] is True
+    assert overloaded_flags[-1] is False
+    assert pipeline.stats()["overloaded"] > 0
+
+
+def test_trigger_skips_handlers_below_min_priority():
+    HandlerManager.init_handlers()
+    called = []
+    HandlerManager.add_handler("on_tick", lambda: called.append("low"))
+    HandlerManager.add_handler("on_tick", lambda: called.append("high"), priority=HandlerManager.ESSENTIAL_PRIORITY)
+
+    HandlerManager.trigger("on_tick", min_priority=HandlerManager.ESSENTIAL_PRIORITY)
+    assert called == ["high"]
+
+    HandlerManager.trigger("on_tick")
+    assert called == ["high", "high", "low"]
+
+
+def test_stop_while_holding_the_lock():
+    lock = threading.RLock()
+    pipeline = MessagePipeline(num_workers=2, lock=lock)
+    handled = []
+
+    def handle(index, overloaded=False):
+        with lock:
+            handled.append(index)
+
+    # e.g. quitting from a callback of the IRC thread, which holds the lock
+    with lock:
+        for index in range(10):
+            pipeline.submit(index, handle, index)
+        pipeline.stop(timeout=5)
+        assert sorted(handled) == list(range(10))
@@ -0,0 +1,90 @@
+import urllib.request
+
+import pytest
+
+from pajbot.apiwrappers.base import BaseAPI
+from pajbot.metrics import Counter, Gauge, Histogram, MetricsRegistry, MetricsServer
+
+
+def test_counter():
+    registry = MetricsRegistry()
+    counter = Counter("test_total", "Test counter", ["command"], registry=registry)
+    counter.labels("!ping").inc()
+    counter.labels("!ping").inc(2)
+    counter.labels('a"b').inc()
+
+    assert registry.expose() == (
+        "# HELP test_total Test counter\n"
+        "# TYPE test_total counter\n"
+        'test_total{command="!ping"} 3.0\n'
+        'test_total{command="a\\"b"} 1.0\n'
+    )
+
+
+def test_counter_can_not_decrease():
+    counter = Counter("test_total", "Test counter", registry=None)
+    with pytest.raises(ValueError):
+        counter.inc(-1)
+
+
+def test_wrong_amount_of_labels():
+    counter = Counter("test_total", "Test counter", ["a", "b"], registry=None)
+    with pytest.raises(ValueError):
+        counter.labels("a")
+
+
+def test_duplicate_names():
+    registry = MetricsRegistry()
+    Counter("test_total", "Test counter", registry=registry)
+    with pytest.raises(ValueError):
+        Gauge("test_total", "Test gauge", registry=registry)
+
+
+def test_gauge():
+    registry = MetricsRegistry()
+    gauge = Gauge("test_depth", "Test gauge", registry=registry)
+    gauge.set(5)
+    gauge.dec()
+    assert registry.expose().endswith("test_depth 4.0\n")
+
+    gauge.set_function(lambda: 7)
+    assert registry.expose().endswith("test_depth 7.0\n")
+
+
+def test_histogram():
+    registry = MetricsRegistry()
+    histogram = Histogram("test_seconds", "Test histogram", ["event"], registry=registry, buckets=(0.1, 1))
+    histogram.labels("on_message").observe(0.05)
+    histogram.labels("on_message").observe(0.1)
+    histogram.labels("on_message").observe(0.5)
+    histogram.labels("on_message").observe(5)
+
+    assert registry.expose().splitlines()[2:] == [
+        'test_seconds_bucket{event="on_message",le="0.1"} 2.0',
+        'test_seconds_bucket{event="on_message",le="1.0"} 3.0',
+        'test_seconds_bucket{event="on_message",le="+Inf"} 4.0',
+        'test_seconds_sum{event="on_message"} 5.65',
+        'test_seconds_count{event="on_message"} 4.0',
+    ]
+
+
+def test_metrics_server():
+    registry = MetricsRegistry()
+    Counter("test_total", "Test counter", registry=registry).inc()
+
+    server = MetricsServer("127.0.0.1", 0, registry=registry)
+    server.start()
+    try:
+        host, port = server.server.server_address
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics") as response:
+            assert response.read().decode("utf-8") == registry.expose()
+    finally:
+        server.stop()
+
+
+def test_api_endpoint_label():
+    assert BaseAPI.endpoint_label("https://api.twitch.tv/helix", "/users") == "/users"
+    assert BaseAPI.endpoint_label("https://api.twitch.tv/helix", "/users/follows") == "/users/follows"
+    assert BaseAPI.endpoint_label("https://api.twitch.tv/kraken", ["streams", "11148817"]) == "/streams/*"
+    assert BaseAPI.endpoint_label("https://api.example.com", "/streams/11148817/") == "/streams/*"
+    assert BaseAPI.endpoint_label(None, "https://example.com/some/path?query") == "example.com"
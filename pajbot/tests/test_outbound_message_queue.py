@@ -0,0 +1,58 @@
+from pajbot.managers.connection import OutboundMessageQueue, OutboundPriority
+
+
+def pop_all(queue, now, message_limit):
+    messages = []
+    while True:
+        outbound_message = queue.pop(now, message_limit)
+        if outbound_message is None:
+            return messages
+        messages.append(outbound_message.message)
+
+
+def test_higher_lanes_are_sent_first():
+    queue = OutboundMessageQueue()
+    queue.put("#c", "timer", OutboundPriority.TIMER)
+    queue.put("#c", "hello", OutboundPriority.REPLY)
+    queue.put("#c", "bets are open", OutboundPriority.ANNOUNCEMENT)
+    queue.put("#c", "/timeout spammer 60", OutboundPriority.TIMER)
+
+    assert pop_all(queue, 0, 100) == ["/timeout spammer 60", "hello", "bets are open", "timer"]
+
+
+def test_message_limit():
+    queue = OutboundMessageQueue(period=31)
+    for i in range(5):
+        queue.put("#c", f"message {i}", OutboundPriority.REPLY)
+    queue.put("#c", "not counted", OutboundPriority.TIMER, counts=False)
+
+    assert pop_all(queue, 0, 3) == ["message 0", "message 1", "message 2", "not counted"]
+    assert queue.wait_time(10) == 21
+    assert pop_all(queue, 30, 3) == []
+    assert pop_all(queue, 31, 3) == ["message 3", "message 4"]
+    assert queue.wait_time(31) is None
+
+
+def test_timeouts_for_the_same_user_are_coalesced():
+    queue = OutboundMessageQueue()
+    queue.put("#c", "/timeout Spammer 60 first", OutboundPriority.REPLY)
+    queue.put("#c", "/timeout spammer 600 second", OutboundPriority.REPLY)
+    queue.put("#c", "/timeout spammer 10 third", OutboundPriority.REPLY)
+    queue.put("#c", "/timeout other 10", OutboundPriority.REPLY)
+
+    assert pop_all(queue, 0, 100) == ["/timeout spammer 600 second", "/timeout other 10"]
+
+    queue.put("#c", "/timeout spammer 60", OutboundPriority.REPLY)
+    queue.put("#c", "/ban spammer", OutboundPriority.REPLY)
+    queue.put("#c", "/timeout spammer 600", OutboundPriority.REPLY)
+
+    assert pop_all(queue, 0, 100) == ["/ban spammer"]
+
+
+def test_timeouts_are_not_coalesced_across_untimeout():
+    queue = OutboundMessageQueue()
+    queue.put("#c", "/timeout spammer 600", OutboundPriority.REPLY)
+    queue.put("#c", "/untimeout spammer", OutboundPriority.REPLY)
+    queue.put("#c", "/timeout spammer 60", OutboundPriority.REPLY)
+
+    assert pop_all(queue, 0, 100) == ["/timeout spammer 600", "/untimeout spammer", "/timeout spammer 60"]
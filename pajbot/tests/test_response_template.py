@@ -0,0 +1,54 @@
+from unittest.mock import Mock
+
+from pajbot.models.action import ResponseTemplate
+
+
+def make_bot():
+    bot = Mock()
+
+    source_values = {"name": "pajlada", "points": 1337}
+    bot.get_source_value = Mock(side_effect=lambda key, extra: source_values.get(key, None))
+    bot.get_filter = lambda name: {"upper": lambda var, args: var.upper()}.get(name, None)
+
+    return bot
+
+
+def test_literal():
+    template = ResponseTemplate("Hello chat", make_bot())
+    assert template.segments == ["Hello chat"]
+    assert template.render({"message": "foo bar"}) == "Hello chat"
+
+
+def test_substitutions_and_arguments():
+    bot = make_bot()
+    template = ResponseTemplate("$(source:name) has $(source:points) points, $(1) and $(2)$(3)!", bot)
+    assert template.render({"message": "foo bar"}) == "pajlada has 1337 points, foo and bar!"
+    assert template.render({"message": None}) == "pajlada has 1337 points,  and !"
+
+
+def test_repeated_substitution_is_resolved_once():
+    bot = make_bot()
+    template = ResponseTemplate("$(source:name) $(source:name) $(source:name|upper)", bot)
+    assert template.render({"message": ""}) == "pajlada pajlada PAJLADA"
+    assert bot.get_source_value.call_count == 2
+
+
+def test_missing_value():
+    template = ResponseTemplate("You have $(source:nothing) points", make_bot())
+    assert template.render({"message": ""}) is None
+
+
+def test_unknown_substitutions_and_filters_are_kept():
+    template = ResponseTemplate("$(unknown:thing) $(source:name|doesnotexist)", make_bot())
+    assert template.render({"message": ""}) == "$(unknown:thing) pajlada"
+
+
+def test_if():
+    template = ResponseTemplate("$(if:$(1),'you said $(1) $(source:name|upper)','you said nothing')", make_bot())
+    assert template.render({"message": "hi there"}) == "you said hi PAJLADA"
+    assert template.render({"message": ""}) == "you said nothing"
+
+
+def test_no_bot():
+    template = ResponseTemplate("$(source:name) $(1)", None)
+    assert template.render({"message": "foo"}) == "$(source:name) $(1)"
@@ -0,0 +1,35 @@
+from pajbot.managers.emote import ThirdPartyEmoteIndex
+from pajbot.models.emote import Emote, EmoteInstance
+
+
+def emote(provider, code):
+    return Emote(code=code, provider=provider, id=f"{provider}-{code}", urls={})
+
+
+def test_precedence():
+    index = ThirdPartyEmoteIndex(
+        ffz_channel_emotes=[emote("ffz", "A")],
+        bttv_channel_emotes=[emote("bttv", "A"), emote("bttv", "B")],
+        ffz_global_emotes=[emote("ffz", "B"), emote("ffz", "C")],
+        bttv_global_emotes=[emote("bttv", "C"), emote("bttv", "D")],
+    )
+
+    assert index.match("A") == emote("ffz", "A")
+    assert index.match("B") == emote("bttv", "B")
+    assert index.match("C") == emote("ffz", "C")
+    assert index.match("D") == emote("bttv", "D")
+    assert index.match("E") is None
+    assert len(index) == 4
+
+
+def test_find_instances():
+    index = ThirdPartyEmoteIndex(ffz_channel_emotes=[emote("ffz", "pepeL")], bttv_global_emotes=None)
+
+    assert index.find_instances("no emotes here") == []
+    assert index.find_instances("pepeL hello pepeL") == [
+        EmoteInstance(start=0, end=5, emote=emote("ffz", "pepeL")),
+        EmoteInstance(start=12, end=17, emote=emote("ffz", "pepeL")),
+    ]
+    assert index.find_instances("pepeL hello pepeL", ignored_start_indices={0}) == [
+        EmoteInstance(start=12, end=17, emote=emote("ffz", "pepeL"))
+    ]
@@ -0,0 +1,64 @@
+import time
+
+from pajbot.models.timer import TimerManager
+
+
+class MockTimer:
+    def __init__(self, id, interval_online=5, interval_offline=30):
+        self.id = id
+        self.enabled = True
+        self.interval_online = interval_online
+        self.interval_offline = interval_offline
+        self.runs = 0
+
+    def run(self, bot):
+        self.runs += 1
+
+
+class MockBot:
+    def __init__(self):
+        self.is_online = False
+        self.delayed = []
+
+    def execute_delayed(self, delay, function, *args):
+        self.delayed.append((delay, function, args))
+
+    def run_delayed(self):
+        delay, function, args = self.delayed.pop()
+        function(*args)
+        return delay
+
+
+def create_manager(timers):
+    manager = TimerManager(None)
+    manager.bot = MockBot()
+    manager.timers = timers
+    manager.set_online(False)
+    manager.redistribute_timers()
+    return manager
+
+
+def test_online_check_while_the_other_status_has_timers():
+    manager = create_manager([MockTimer(1, interval_online=5, interval_offline=0)])
+
+    # No offline timers, but the stream status is still checked regularly
+    assert len(manager.offline_timers) == 0
+    assert manager.bot.delayed[-1][0] == TimerManager.ONLINE_CHECK_INTERVAL
+
+
+def test_stream_that_comes_back_online_without_an_event(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+
+    timer = MockTimer(1, interval_online=5, interval_offline=30)
+    manager = create_manager([timer])
+    manager.bot.is_online = True
+
+    # e.g. the stream went offline for a moment and came back with the same broadcast ID
+    now[0] += manager.bot.run_delayed()
+    assert manager.online
+
+    # The online timer is run after its online interval, even though the offline timer would take longer
+    while timer.runs == 0:
+        assert now[0] <= 1000 + 5 * 60 + TimerManager.MIN_RUN_INTERVAL
+        now[0] += manager.bot.run_delayed()
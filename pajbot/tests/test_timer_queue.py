@@ -0,0 +1,74 @@
+from pajbot.models.timer import TimerQueue
+
+
+class MockTimer:
+    def __init__(self, id, interval_online=5, interval_offline=30):
+        self.id = id
+        self.interval_online = interval_online
+        self.interval_offline = interval_offline
+
+
+def test_pop_due_in_order():
+    timers = TimerQueue("interval_online")
+    timers.resume(0)
+    a = MockTimer(1)
+    b = MockTimer(2)
+    timers.push(a, 120, 0)
+    timers.push(b, 60, 0)
+
+    assert timers.time_until_due(0) == 60
+    assert timers.pop_due(59) is None
+    assert timers.pop_due(200) is b
+    assert timers.pop_due(200) is a
+    assert timers.pop_due(200) is None
+    assert timers.time_until_due(200) is None
+
+
+def test_interval_is_in_minutes():
+    assert TimerQueue("interval_online").interval(MockTimer(1, interval_online=5)) == 300
+    assert TimerQueue("interval_offline").interval(MockTimer(1, interval_offline=30)) == 1800
+
+
+def test_paused_queue_does_not_advance():
+    timers = TimerQueue("interval_offline")
+    timers.resume(0)
+    a = MockTimer(1)
+    timers.push(a, 100, 0)
+
+    timers.pause(40)
+    assert timers.time_until_due(1000) is None
+    assert timers.pop_due(1000) is None
+
+    timers.resume(1000)
+    assert timers.time_until_due(1000) == 60
+    assert timers.pop_due(1059) is None
+    assert timers.pop_due(1060) is a
+
+
+def test_push_replaces_and_remove():
+    timers = TimerQueue("interval_online")
+    timers.resume(0)
+    a = MockTimer(1)
+    b = MockTimer(2)
+    timers.push(a, 10, 0)
+    timers.push(b, 20, 0)
+    timers.push(a, 30, 0)
+
+    assert len(timers) == 2
+    assert timers.pop_due(25) is b
+    assert timers.pop_due(25) is None
+
+    timers.remove(a)
+    assert a not in timers
+    assert len(timers) == 0
+    assert timers.pop_due(100) is None
+
+
+def test_removed_entries_are_compacted():
+    timers = TimerQueue("interval_online")
+    a = MockTimer(1)
+    for i in range(1000):
+        timers.push(a, i, 0)
+
+    assert len(timers) == 1
+    assert len(timers.heap) < 100
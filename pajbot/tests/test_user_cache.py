@@ -0,0 +1,189 @@
+import datetime
+
+import pytest
+from sqlalchemy import DefaultClause, MetaData, create_engine, event, text
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from pajbot import utils
+from pajbot.managers.db import DBManager
+from pajbot.managers.user_cache import UserCacheManager
+from pajbot.models.user import User, UserBasics
+
+
+@pytest.fixture
+def statements(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    # The server defaults are PostgreSQL expressions, which SQLite would store as strings
+    table = User.__table__.tometadata(MetaData())
+    for column in table.columns:
+        column.server_default = None
+    table.c.login_last_updated.server_default = DefaultClause(text("CURRENT_TIMESTAMP"))
+    table.create(engine)
+
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split()[0])
+
+    monkeypatch.setattr(DBManager, "Session", sessionmaker(bind=engine, autoflush=False))
+
+    with DBManager.create_session_scope() as db_session:
+        for user_id in ["1", "2"]:
+            db_session.add(User(id=user_id, login=f"user{user_id}", name=f"User{user_id}"))
+
+    statements.clear()
+    yield statements
+
+
+@pytest.fixture
+def cache(statements):
+    cache = UserCacheManager(max_size=10, ttl=300)
+    yield cache
+    event.remove(Session, "after_flush", cache._on_after_flush)
+
+
+def run_message(cache, basics, fn=None):
+    with cache.user_scope(basics) as user:
+        if fn is not None:
+            fn(user)
+        return user
+
+
+def test_hit_and_miss(cache, statements):
+    basics = UserBasics("1", "user1", "User1")
+
+    run_message(cache, basics)
+    # Cache miss: The login and name are written
+    assert statements == ["SELECT", "UPDATE"]
+    assert cache.users["1"][0] == ("user1", "User1")
+
+    statements.clear()
+    run_message(cache, basics)
+    # Cache hit: The row is still loaded, but nothing is written
+    assert statements == ["SELECT"]
+
+    statements.clear()
+    run_message(cache, UserBasics("1", "user1renamed", "User1Renamed"))
+    # The name changed, so it has to be written again
+    assert statements == ["SELECT", "UPDATE"]
+    assert cache.users["1"][0] == ("user1renamed", "User1Renamed")
+
+
+def test_hit_sees_changes_made_elsewhere(cache):
+    basics = UserBasics("1", "user1", "User1")
+    run_message(cache, basics)
+
+    # e.g. the web interface or raw SQL
+    with DBManager.create_session_scope() as db_session:
+        db_session.execute("UPDATE user SET points = 500 WHERE id = '1'")
+
+    def spend(user):
+        user.points -= 100
+
+    run_message(cache, basics, spend)
+
+    with DBManager.create_session_scope() as db_session:
+        assert db_session.query(User).get("1").points == 400
+
+
+def test_ttl_expiry(cache, statements):
+    basics = UserBasics("1", "user1", "User1")
+    run_message(cache, basics)
+
+    names, cached_at = cache.users["1"]
+    cache.users["1"] = (names, cached_at - cache.ttl - 1)
+
+    statements.clear()
+    run_message(cache, basics)
+    assert statements == ["SELECT", "UPDATE"]
+
+
+def test_lru_eviction(cache):
+    cache.max_size = 1
+    run_message(cache, UserBasics("1", "user1", "User1"))
+    run_message(cache, UserBasics("2", "user2", "User2"))
+    assert list(cache.users) == ["2"]
+
+
+def test_invalidation_during_scope(cache):
+    basics = UserBasics("1", "user1", "User1")
+
+    def rename_from_another_session(user):
+        with DBManager.create_session_scope() as db_session:
+            db_session.query(User).get("2").name = "User2Renamed"
+
+    run_message(cache, UserBasics("2", "user2", "User2"))
+    run_message(cache, basics, rename_from_another_session)
+
+    # User 2 was changed by another session, and user 1 could have been too, so neither is cached
+    assert "1" not in cache.users
+    assert "2" not in cache.users
+
+    run_message(cache, basics)
+    assert "1" in cache.users
+
+    cache.invalidate("1")
+    assert "1" not in cache.users
+
+
+def test_other_changes_are_not_invalidated(cache):
+    basics = UserBasics("1", "user1", "User1")
+
+    def give_points_from_another_session(user):
+        with DBManager.create_session_scope() as db_session:
+            db_session.query(User).get("2").points += 100
+
+    run_message(cache, UserBasics("2", "user2", "User2"))
+    run_message(cache, basics, give_points_from_another_session)
+
+    assert "1" in cache.users
+    assert "2" in cache.users
+
+
+def test_pending_changes(cache, statements):
+    basics = UserBasics("1", "user1", "User1")
+    now = utils.now()
+
+    def chat(user):
+        cache.touch(user, now)
+        cache.increment_num_lines(user)
+
+    run_message(cache, basics, chat)
+    run_message(cache, basics, chat)
+    # The per-message updates are not written by the message sessions
+    assert statements.count("UPDATE") == 1
+
+    with DBManager.create_session_scope() as db_session:
+        user = db_session.query(User).get("1")
+        assert user.num_lines == 0
+        assert user.last_seen is None
+
+    assert cache.pending["1"].num_lines == 2
+
+    # Both cache hits and misses apply the pending changes on top of what is in the database
+    user = run_message(cache, basics)
+    assert user.num_lines == 2
+    assert user.last_seen == now
+
+    cache.invalidate_all()
+    user = run_message(cache, basics)
+    assert user.num_lines == 2
+    assert user.last_active == now
+
+
+def test_new_user_is_inserted_by_its_session(cache):
+    now = utils.now()
+
+    def chat(user):
+        cache.touch(user, now)
+        cache.increment_num_lines(user)
+
+    run_message(cache, UserBasics("3", "user3", "User3"), chat)
+    assert "3" not in cache.pending
+
+    with DBManager.create_session_scope() as db_session:
+        user = db_session.query(User).get("3")
+        assert user.num_lines == 1
+        assert user.last_seen.replace(tzinfo=datetime.timezone.utc) == now
@@ -0,0 +1,43 @@
+from pajbot.managers.cooldown import UserCooldowns
+
+
+def test_get_and_set():
+    cooldowns = UserCooldowns()
+    assert cooldowns.get("123", 100, 15) == 0
+
+    cooldowns.set("123", 100, 15)
+    assert cooldowns.get("123", 110, 15) == 100
+    assert cooldowns.get("456", 110, 15) == 0
+
+
+def test_expired_entries_are_removed():
+    cooldowns = UserCooldowns()
+    cooldowns.set("1", 100, 15)
+    cooldowns.set("2", 105, 15)
+    cooldowns.set("3", 110, 15)
+    assert len(cooldowns) == 3
+
+    assert cooldowns.get("3", 115, 15) == 110
+    assert len(cooldowns) == 2
+
+    assert cooldowns.get("3", 125, 15) == 0
+    assert len(cooldowns) == 0
+
+
+def test_running_again_refreshes_the_entry():
+    cooldowns = UserCooldowns()
+    cooldowns.set("1", 100, 15)
+    cooldowns.set("2", 105, 15)
+    cooldowns.set("1", 110, 15)
+
+    assert cooldowns.get("2", 121, 15) == 0
+    assert cooldowns.get("1", 121, 15) == 110
+    assert len(cooldowns) == 1
+
+
+def test_size_is_bounded_by_the_cooldown():
+    cooldowns = UserCooldowns()
+    for i in range(10000):
+        cooldowns.set(str(i), i, 15)
+
+    assert len(cooldowns) == 15
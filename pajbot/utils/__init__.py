@@ -1,4 +1,6 @@
+from .aho_corasick import AhoCorasick
 from .clean_up_message import clean_up_message
+from .compile_literals_regex import compile_literals_regex
 from .datetime_from_utc_milliseconds import datetime_from_utc_milliseconds
 from .dump_threads import dump_threads
 from .extend_version_with_git_data import extend_version_with_git_data, extend_version_if_possible
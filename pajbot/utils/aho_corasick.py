@@ -0,0 +1,97 @@
+from collections import deque
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton for finding all occurrences of many needles in a text in a single pass.
+
+    Usage:
+    automaton = AhoCorasick()
+    automaton.add("abc", "some value")
+    automaton.add("bc", "some other value")
+    automaton.build()
+    list(automaton.iter("xabc")) == [(1, 4, "some value"), (2, 4, "some other value")]
+
+    iter() yields (start, end, value) for every (possibly overlapping) occurrence, ordered by end index.
+    Empty needles are not supported.
+    """
+
+    def __init__(self):
+        # goto[node] maps a character to the next node
+        self.goto = [{}]
+        # fail[node] is the node of the longest proper suffix of this node that is also in the trie
+        self.fail = [0]
+        # outputs[node] is a list of (needle length, value) for the needles ending exactly at this node
+        self.outputs = [[]]
+        # output_link[node] is the closest node on the fail chain that has outputs (or 0)
+        self.output_link = [0]
+        self.built = False
+
+    def __len__(self):
+        return sum(len(outputs) for outputs in self.outputs)
+
+    def add(self, needle, value):
+        if not needle:
+            raise ValueError("Empty needles can not be added to the automaton")
+
+        node = 0
+        for char in needle:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.output_link.append(0)
+            node = next_node
+
+        self.outputs[node].append((len(needle), value))
+        self.built = False
+
+    def build(self):
+        queue = deque()
+        for child in self.goto[0].values():
+            self.fail[child] = 0
+            self.output_link[child] = 0
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                child_fail = self.goto[fallback].get(char, 0)
+                if child_fail == child:
+                    child_fail = 0
+
+                self.fail[child] = child_fail
+                self.output_link[child] = child_fail if self.outputs[child_fail] else self.output_link[child_fail]
+
+        self.built = True
+        return self
+
+    def iter(self, text):
+        if not self.built:
+            raise RuntimeError("AhoCorasick.build() must be called before searching")
+
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+        output_link = self.output_link
+
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            end = index + 1
+            match_node = node if outputs[node] else output_link[node]
+            while match_node:
+                for length, value in outputs[match_node]:
+                    yield end - length, end, value
+                match_node = output_link[match_node]
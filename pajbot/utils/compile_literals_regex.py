@@ -0,0 +1,73 @@
+import re
+
+
+def compile_literals_regex(literals):
+    """Compiles a regex that matches any of the given literal strings.
+    If several of the literals match at the same position, the longest one is matched.
+
+    The regex is built from a trie of the literals (e.g. "ab", "ac" and "b" become "(?:a[bc]|b)"),
+    so the regex engine doesn't have to try every single literal at every position of the searched text."""
+    trie = {}
+    for literal in literals:
+        if not literal:
+            raise ValueError("Empty literals can not be matched")
+
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        # The empty string marks the end of a literal
+        node[""] = {}
+
+    return re.compile(_trie_to_pattern(trie))
+
+
+def _trie_to_pattern(node):
+    is_end = "" in node
+
+    single_chars = []
+    alternatives = []
+    for char, child in sorted(node.items()):
+        if char == "":
+            continue
+
+        if len(child) == 1 and "" in child:
+            # This char ends a literal, and no other literal continues from it
+            single_chars.append(char)
+        else:
+            alternatives.append(re.escape(char) + _trie_to_pattern(child))
+
+    if len(single_chars) == 1:
+        alternatives.append(re.escape(single_chars[0]))
+    elif len(single_chars) > 1:
+        alternatives.append(_char_class(single_chars))
+
+    if not alternatives:
+        return ""
+
+    if len(alternatives) == 1 and not is_end:
+        return alternatives[0]
+
+    pattern = "(?:" + "|".join(alternatives) + ")"
+    if is_end:
+        # Greedy, so the longest literal is preferred
+        pattern += "?"
+    return pattern
+
+
+def _char_class(chars):
+    """ Returns a character class matching the given (sorted) chars, with consecutive chars collapsed into ranges """
+    ranges = []
+    for char in chars:
+        if ranges and ord(ranges[-1][1]) == ord(char) - 1:
+            ranges[-1][1] = char
+        else:
+            ranges.append([char, char])
+
+    parts = []
+    for first, last in ranges:
+        if first == last:
+            parts.append(re.escape(first))
+        else:
+            parts.append(re.escape(first) + "-" + re.escape(last))
+
+    return "[" + "".join(parts) + "]"
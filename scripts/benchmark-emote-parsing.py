@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import string
+import timeit
+
+from pajbot.managers.emote import EmoteManager, ThirdPartyEmoteIndex, compute_emote_counts
+from pajbot.models.emote import Emote, EmoteInstance
+from pajbot.utils import iterate_split_with_index
+
+
+def random_code(rng):
+    return rng.choice(string.ascii_uppercase) + "".join(rng.choices(string.ascii_letters, k=rng.randint(3, 10)))
+
+
+def generate_emotes(rng, provider, amount):
+    return [Emote(code=random_code(rng), provider=provider, id=str(i), urls={}) for i in range(amount)]
+
+
+def generate_messages(rng, emote_codes, amount, emote_ratio):
+    words = ["hello", "chat", "xD", "what", "is", "this", "LUL", "no", "way", "pog", "gg", "wp", "!points", "?"]
+
+    messages = []
+    for _ in range(amount):
+        message_words = rng.choices(words, k=rng.randint(1, 15))
+        if rng.random() < emote_ratio:
+            message_words.insert(rng.randint(0, len(message_words)), rng.choice(emote_codes))
+        messages.append(" ".join(message_words))
+    return messages
+
+
+class LegacyEmoteParser:
+    """ The parsing of third-party emotes as it was before the merged ThirdPartyEmoteIndex """
+
+    def __init__(self, ffz_channel, bttv_channel, ffz_global, bttv_global):
+        self.lookup_tables = [
+            {emote.code: emote for emote in emotes} for emotes in (ffz_channel, bttv_channel, ffz_global, bttv_global)
+        ]
+
+    def match_word_to_emote(self, word):
+        for lookup_table in self.lookup_tables:
+            emote = lookup_table.get(word, None)
+            if emote is not None:
+                return emote
+
+        return None
+
+    def parse_all_emotes(self, message, twitch_emotes_tag=""):
+        twitch_emote_instances = EmoteManager.parse_twitch_emotes_tag(twitch_emotes_tag, message)
+        twitch_emote_start_indices = {instance.start for instance in twitch_emote_instances}
+
+        third_party_emote_instances = []
+
+        for current_word_index, word in iterate_split_with_index(message.split(" ")):
+            if current_word_index in twitch_emote_start_indices:
+                continue
+
+            emote = self.match_word_to_emote(word)
+            if emote is None:
+                continue
+
+            third_party_emote_instances.append(
+                EmoteInstance(start=current_word_index, end=current_word_index + len(word), emote=emote)
+            )
+
+        all_instances = twitch_emote_instances + third_party_emote_instances
+        all_instances.sort(key=lambda instance: instance.start)
+
+        return all_instances, compute_emote_counts(all_instances)
+
+
+def benchmark(name, parser, messages, repeat):
+    def run():
+        for message in messages:
+            parser.parse_all_emotes(message)
+
+    seconds = min(timeit.repeat(run, number=1, repeat=repeat))
+    print(f"{name:>8}: {len(messages) / seconds:>12,.0f} messages/sec")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how fast third-party (FFZ/BTTV) emotes are parsed")
+    parser.add_argument("--messages", type=int, default=100000, help="Amount of messages to parse")
+    parser.add_argument("--emotes", type=int, default=1000, help="Amount of emotes per provider/scope")
+    parser.add_argument("--emote-ratio", type=float, default=0.1, help="Ratio of messages containing an emote")
+    parser.add_argument("--repeat", type=int, default=5, help="Amount of runs, the fastest one is reported")
+    parser.add_argument("--seed", type=int, default=1337)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ffz_channel = generate_emotes(rng, "ffz", args.emotes)
+    bttv_channel = generate_emotes(rng, "bttv", args.emotes)
+    ffz_global = generate_emotes(rng, "ffz", args.emotes)
+    bttv_global = generate_emotes(rng, "bttv", args.emotes)
+    emote_codes = [emote.code for emote in ffz_channel + bttv_channel + ffz_global + bttv_global]
+    messages = generate_messages(rng, emote_codes, args.messages, args.emote_ratio)
+
+    legacy_parser = LegacyEmoteParser(ffz_channel, bttv_channel, ffz_global, bttv_global)
+
+    emote_manager = EmoteManager.__new__(EmoteManager)
+    emote_manager.third_party_emote_index = ThirdPartyEmoteIndex(ffz_channel, bttv_channel, ffz_global, bttv_global)
+
+    for message in messages:
+        legacy_instances, _ = legacy_parser.parse_all_emotes(message)
+        instances, _ = emote_manager.parse_all_emotes(message)
+        if legacy_instances != instances:
+            raise AssertionError(f"Different emotes parsed from {message!r}: {legacy_instances} != {instances}")
+
+    before = benchmark("before", legacy_parser, messages, args.repeat)
+    after = benchmark("after", emote_manager, messages, args.repeat)
+    print(f"{'speedup':>8}: {before / after:>12.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+from irc.client import Event, NickMask
+from irc.message import Tag
+
+from pajbot.bot import Bot
+from pajbot.managers.handler import HandlerManager
+from pajbot.managers.handler_watchdog import SlowHandlerAction
+from pajbot.managers.irc_recorder import RecordedEvent, paced, read_recordings
+from pajbot.utils import load_config
+
+log = logging.getLogger("benchmark-replay")
+
+# @tags :prefix COMMAND params :trailing
+IRC_LINE_REGEX = re.compile(r"^(?:@(?P<tags>\S+) )?(?::(?P<prefix>\S+) )?(?P<command>\S+)(?P<params>.*)$")
+
+EVENT_TYPES = {"PRIVMSG": "pubmsg", "WHISPER": "whisper", "USERNOTICE": "usernotice"}
+
+# Twitch emote IDs and codes that are used in the synthetic messages
+TWITCH_EMOTES = [("25", "Kappa"), ("354", "4Head"), ("425618", "LUL"), ("88", "PogChamp"), ("1902", "Keepo")]
+WORDS = ["hello", "chat", "what", "is", "this", "no", "way", "pog", "gg", "wp", "xD", "?", "omegalul", "true", "KEKW"]
+URLS = ["https://www.youtube.com/watch?v=dQw4w9WgXcQ", "https://clips.twitch.tv/SomeClip", "example.com/some/page"]
+
+
+def parse_irc_line(line):
+    """ Parses a raw IRC line (as sent by the Twitch IRC servers) into an irc.client.Event.
+    Returns None for lines that are not chat messages, whispers or user notices. """
+    match = IRC_LINE_REGEX.match(line.rstrip("\r\n"))
+    if match is None:
+        return None
+
+    event_type = EVENT_TYPES.get(match.group("command"), None)
+    if event_type is None:
+        return None
+
+    params, _, trailing = match.group("params").partition(" :")
+    target = params.split()[0] if params.split() else None
+    arguments = [trailing] if trailing else []
+    tags = Tag.from_group(match.group("tags")) or []
+
+    return Event(event_type, NickMask(match.group("prefix") or ""), target, arguments, tags)
+
+
+def format_tags(tags):
+    return ";".join(f"{key}={value}" for key, value in tags.items())
+
+
+class SyntheticTraffic:
+    """ Generates raw IRC lines that look like the traffic of a busy channel """
+
+    def __init__(self, rng, channel, room_id, commands, num_users):
+        self.rng = rng
+        self.channel = channel
+        self.room_id = room_id
+        self.commands = commands
+        # Synthetic users get IDs far above those of real Twitch users
+        self.users = [(str(900000000 + i), f"benchuser{i}") for i in range(num_users)]
+
+    def pick_user(self):
+        # Some users chat a lot more than others
+        return self.users[min(int(self.rng.paretovariate(1.2)) - 1, len(self.users) - 1)]
+
+    def base_tags(self, user_id, login):
+        return {
+            "badge-info": "",
+            "badges": self.rng.choice(["", "subscriber/12", "subscriber/0,premium/1", "vip/1"]),
+            "color": "#1E90FF",
+            "display-name": login.capitalize(),
+            "emotes": "",
+            "flags": "",
+            "id": str(uuid.UUID(int=self.rng.getrandbits(128))),
+            "mod": "0",
+            "room-id": self.room_id,
+            "subscriber": "0",
+            "tmi-sent-ts": str(int(time.time() * 1000)),
+            "turbo": "0",
+            "user-id": user_id,
+            "user-type": "",
+        }
+
+    def message_text(self):
+        words = self.rng.choices(WORDS, k=self.rng.randint(1, 12))
+
+        roll = self.rng.random()
+        if roll < 0.05 and self.commands:
+            return "!" + self.rng.choice(self.commands)
+        if roll < 0.08:
+            words.insert(self.rng.randint(0, len(words)), self.rng.choice(URLS))
+        elif roll < 0.10:
+            words.extend("@" + login for _, login in self.rng.sample(self.users, min(5, len(self.users))))
+
+        return " ".join(words)
+
+    def emotes_tag(self, text):
+        emote_positions = {}
+        index = 0
+        for word in text.split(" "):
+            for emote_id, code in TWITCH_EMOTES:
+                if word == code:
+                    emote_positions.setdefault(emote_id, []).append(f"{index}-{index + len(word) - 1}")
+            index += len(word) + 1
+        return "/".join(f"{emote_id}:{','.join(positions)}" for emote_id, positions in emote_positions.items())
+
+    def line(self):
+        user_id, login = self.pick_user()
+        prefix = f":{login}!{login}@{login}.tmi.twitch.tv"
+
+        if self.rng.random() < 0.005:
+            tags = self.base_tags(user_id, login)
+            months = self.rng.randint(1, 48)
+            tags.update(
+                {
+                    "login": login,
+                    "msg-id": "sub" if months == 1 else "resub",
+                    "msg-param-cumulative-months": str(months),
+                    "msg-param-sub-plan": "1000",
+                    "system-msg": f"{login}\\ssubscribed\\sat\\sTier\\s1.",
+                }
+            )
+            return f"@{format_tags(tags)} :tmi.twitch.tv USERNOTICE {self.channel} :{self.message_text()}"
+
+        text = self.message_text()
+        if self.rng.random() < 0.3:
+            text += " " + " ".join(code for _, code in self.rng.sample(TWITCH_EMOTES, self.rng.randint(1, 3)))
+
+        tags = self.base_tags(user_id, login)
+        tags["emotes"] = self.emotes_tag(text)
+        return f"@{format_tags(tags)} {prefix} PRIVMSG {self.channel} :{text}"
+
+
+class InlineMessagePipeline:
+    """ Handles every message right away on the calling thread, so each message's latency can be measured """
+
+    def submit(self, key, function, *args, **kwargs):
+        function(*args, overloaded=False, **kwargs)
+
+    def stats(self):
+        return {}
+
+    def stop(self, timeout=None):
+        pass
+
+
+class ReplayMeasurements:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.submitted_at = {}
+        self.latencies = []
+        self.done = threading.Condition(self.lock)
+        self.num_sent = 0
+
+    def wrap_handle_function(self, function):
+        def timed(event, *args, **kwargs):
+            try:
+                return function(event, *args, **kwargs)
+            finally:
+                finished_at = time.perf_counter()
+                with self.lock:
+                    self.latencies.append(finished_at - self.submitted_at.pop(id(event)))
+                    self.done.notify_all()
+
+        return timed
+
+    def submit(self, event):
+        with self.lock:
+            self.submitted_at[id(event)] = time.perf_counter()
+
+    def wait_until_handled(self, amount):
+        with self.lock:
+            self.done.wait_for(lambda: len(self.latencies) >= amount)
+
+    def count_sent(self, *args, **kwargs):
+        with self.lock:
+            self.num_sent += 1
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+
+    index = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def replay(bot, recorded_events, measurements, speed=0):
+    on_event = {"pubmsg": bot.on_pubmsg, "whisper": bot.on_whisper, "usernotice": bot.on_usernotice}
+    for recorded_event in paced(recorded_events, speed):
+        event = recorded_event.event
+        measurements.submit(event)
+        on_event[event.type](None, event)
+
+
+def print_report(events, seconds, measurements, top_handlers):
+    latencies = sorted(measurements.latencies)
+
+    print(f"{'messages':>12}: {len(events)}")
+    print(f"{'seconds':>12}: {seconds:.2f}")
+    print(f"{'msgs/sec':>12}: {len(events) / seconds:,.0f}")
+    for percent in (50, 90, 99):
+        print(f"{f'p{percent}':>12}: {percentile(latencies, percent) * 1000:.3f} ms")
+    print(f"{'max':>12}: {latencies[-1] * 1000 if latencies else 0:.3f} ms")
+    print(f"{'sent':>12}: {measurements.num_sent} messages/whispers/moderation commands")
+
+    all_stats = sorted(HandlerManager.watchdog.stats.values(), key=lambda stats: stats.total_seconds, reverse=True)
+    print()
+    print(f"{'event':<16} {'handler':<56} {'calls':>8} {'total ms':>10} {'mean ms':>8} {'p99 ms':>8}")
+    for stats in all_stats[:top_handlers]:
+        mean = stats.total_seconds / stats.num_calls if stats.num_calls > 0 else 0.0
+        print(
+            f"{stats.event:<16} {stats.name:<56} {stats.num_calls:>8} {stats.total_seconds * 1000:>10.1f} "
+            f"{mean * 1000:>8.3f} {stats.percentile(99) * 1000:>8.3f}"
+        )
+
+
+def print_allocations(snapshot_before, snapshot_after, num_events, top_allocations):
+    differences = snapshot_after.compare_to(snapshot_before, "lineno")
+    total_size = sum(difference.size_diff for difference in differences if difference.size_diff > 0)
+    total_count = sum(difference.count_diff for difference in differences if difference.count_diff > 0)
+    _, peak = tracemalloc.get_traced_memory()
+
+    print()
+    print(f"retained: {total_size / 1024:,.1f} KiB in {total_count:,} blocks ({total_size / num_events:,.0f} B/message)")
+    print(f"peak traced memory: {peak / 1024 / 1024:,.1f} MiB")
+    for difference in differences[:top_allocations]:
+        print(f"  {difference}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replays recorded or synthetic Twitch chat traffic through the bot and its enabled modules"
+    )
+    parser.add_argument("--config", "-c", default="config.ini", help="Bot config to use. Use a throwaway database!")
+    parser.add_argument("--input", help="File with raw IRC lines to replay. Synthetic traffic is used if not set")
+    parser.add_argument(
+        "--recording", nargs="+", help="Recording files (see irc_record_directory in example.ini) to replay"
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="Replay recordings at this multiple of their original pace (e.g. 1 or 10), as fast as possible if 0",
+    )
+    parser.add_argument("--messages", type=int, default=10000, help="Amount of synthetic messages to generate")
+    parser.add_argument("--users", type=int, default=5000, help="Amount of synthetic users")
+    parser.add_argument("--save-synthetic", help="Write the generated synthetic traffic to this file")
+    parser.add_argument("--warmup", type=int, default=500, help="Amount of messages to replay before measuring")
+    parser.add_argument("--pipeline", action="store_true", help="Handle messages on the message pipeline workers")
+    parser.add_argument("--trace-allocations", action="store_true", help="Trace allocations (slows the replay down)")
+    parser.add_argument("--top", type=int, default=15, help="Amount of handlers/allocation sites to show")
+    parser.add_argument("--seed", type=int, default=1337)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    config = load_config(args.config)
+    bot = Bot(config, argparse.Namespace(config=args.config, silent=True))
+
+    # Make sure the replay stays reproducible, and nothing is sent to Twitch
+    HandlerManager.watchdog.action = SlowHandlerAction.LOG
+    measurements = ReplayMeasurements()
+    bot.irc.connection_manager.privmsg = measurements.count_sent
+
+    if not args.pipeline:
+        bot.message_pipeline.stop()
+        bot.message_pipeline = InlineMessagePipeline()
+
+    bot.handle_pubmsg = measurements.wrap_handle_function(bot.handle_pubmsg)
+    bot.handle_whisper = measurements.wrap_handle_function(bot.handle_whisper)
+    bot.handle_usernotice = measurements.wrap_handle_function(bot.handle_usernotice)
+
+    if args.recording:
+        recorded_events = list(read_recordings(args.recording))
+    elif args.input:
+        with open(args.input, encoding="utf-8") as input_file:
+            lines = input_file.readlines()
+    else:
+        traffic = SyntheticTraffic(
+            random.Random(args.seed), bot.channel, bot.streamer_user_id, list(bot.commands.keys()), args.users
+        )
+        lines = [traffic.line() + "\n" for _ in range(args.warmup + args.messages)]
+        if args.save_synthetic:
+            with open(args.save_synthetic, "w", encoding="utf-8") as output_file:
+                output_file.writelines(lines)
+
+    if not args.recording:
+        # Raw lines have no receive timestamps, so they are always replayed as fast as possible
+        recorded_events = [RecordedEvent(0, event) for event in map(parse_irc_line, lines) if event is not None]
+
+    # Messages without a user ID and the bot's own messages are never handled by the bot
+    events = [
+        recorded_event
+        for recorded_event in recorded_events
+        if recorded_event.event.type in EVENT_TYPES.values()
+        and any(tag["key"] == "user-id" for tag in recorded_event.event.tags or [])
+        and recorded_event.event.source.user != bot.nickname
+    ]
+    if len(events) <= args.warmup:
+        print(f"Only {len(events)} messages to replay, need more than the {args.warmup} warmup messages")
+        sys.exit(1)
+
+    warmup_events, events = events[: args.warmup], events[args.warmup :]
+    replay(bot, warmup_events, measurements, args.speed)
+    measurements.wait_until_handled(len(warmup_events))
+    measurements.latencies = []
+    measurements.num_sent = 0
+    HandlerManager.watchdog.stats.clear()
+
+    if args.trace_allocations:
+        tracemalloc.start()
+        snapshot_before = tracemalloc.take_snapshot()
+
+    started_at = time.perf_counter()
+    replay(bot, events, measurements, args.speed)
+    measurements.wait_until_handled(len(events))
+    seconds = time.perf_counter() - started_at
+
+    print_report(events, seconds, measurements, args.top)
+
+    if args.trace_allocations:
+        print_allocations(snapshot_before, tracemalloc.take_snapshot(), len(events), args.top)
+        tracemalloc.stop()
+
+    bot.message_pipeline.stop()
+    bot.commit_all()
+
+
+if __name__ == "__main__":
+    main()
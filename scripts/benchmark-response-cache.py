@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import redis
+
+from pajbot.apiwrappers.response_cache import APIResponseCache, JsonSerializer
+from pajbot.utils import iterate_in_chunks
+
+KEY_PREFIX = "benchmark:response-cache:"
+
+
+class LegacyAPIResponseCache(APIResponseCache):
+    """ cache_bulk_fetch_fn as it was before the lookups and writes were chunked and pipelined """
+
+    def cache_bulk_fetch_fn(
+        self, input_data, redis_key_fn, fetch_fn, serializer=JsonSerializer(), expiry=120, force_fetch=False
+    ):
+        results = []
+        to_fetch = []
+
+        cache_results = self.redis.mget([redis_key_fn(input_entry) for input_entry in input_data])
+        for idx, cache_result in enumerate(cache_results):
+            if cache_result is not None:
+                results.insert(idx, serializer.deserialize(cache_result))
+            else:
+                to_fetch.append((idx, input_data[idx]))
+
+        if len(to_fetch) > 0:
+            to_fetch_indexes, to_fetch_values = tuple(zip(*to_fetch))
+            fetch_results = fetch_fn(to_fetch_values)
+            for idx, fetch_result in zip(to_fetch_indexes, fetch_results):
+                results.insert(idx, fetch_result)
+
+                expiry_value = expiry(fetch_result) if callable(expiry) else expiry
+                if expiry_value > 0:
+                    self.redis.setex(redis_key_fn(input_data[idx]), expiry_value, serializer.serialize(fetch_result))
+
+        return results
+
+
+def fake_fetch(logins):
+    """ Stands in for the Helix API, so only the cache itself is measured """
+    return [{"id": str(i), "login": login, "display_name": login.upper()} for i, login in enumerate(logins)]
+
+
+def delete_keys(redis_connection, keys=None):
+    if keys is None:
+        keys = list(redis_connection.scan_iter(f"{KEY_PREFIX}*", count=10000))
+
+    for keys_chunk in iterate_in_chunks(keys, 10000):
+        redis_connection.delete(*keys_chunk)
+
+
+def run(cache, logins):
+    started_at = time.perf_counter()
+    results = cache.cache_bulk_fetch_fn(
+        logins,
+        redis_key_fn=lambda login: f"{KEY_PREFIX}{login}",
+        fetch_fn=fake_fetch,
+        expiry=lambda response: 30 if response is None else 300,
+    )
+    seconds = time.perf_counter() - started_at
+
+    if [result["login"] for result in results] != logins:
+        raise AssertionError("The results are not in the same order as the input")
+
+    return seconds
+
+
+def benchmark(name, cache, redis_connection, num_keys):
+    logins = [f"user{i}" for i in range(num_keys)]
+
+    delete_keys(redis_connection)
+    # Nothing is cached: Every key is fetched and written to redis
+    cold = run(cache, logins)
+    # Everything is cached
+    warm = run(cache, logins)
+
+    # Every second key is cached, like when most chatters were already looked up a few minutes ago
+    delete_keys(redis_connection, [f"{KEY_PREFIX}{login}" for login in logins[::2]])
+    mixed = run(cache, logins)
+
+    print(
+        f"{name:>8} {num_keys:>8,} keys: "
+        f"cold {cold:>7.2f}s ({cold / num_keys * 1e6:>6.1f}µs/key), "
+        f"warm {warm:>7.2f}s ({warm / num_keys * 1e6:>6.1f}µs/key), "
+        f"mixed {mixed:>7.2f}s ({mixed / num_keys * 1e6:>6.1f}µs/key)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures how APIResponseCache.cache_bulk_fetch_fn scales with the amount of keys"
+    )
+    parser.add_argument(
+        "--redis-url", default="redis://localhost:6379/15", help="Redis to use. Use a throwaway redis database!"
+    )
+    parser.add_argument("--sizes", default="25000,50000,100000,200000", help="Comma-separated amounts of keys")
+    parser.add_argument("--compare", action="store_true", help="Also measure the previous implementation")
+    args = parser.parse_args()
+
+    redis_connection = redis.Redis.from_url(args.redis_url, decode_responses=True)
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    try:
+        for num_keys in sizes:
+            benchmark("after", APIResponseCache(redis_connection), redis_connection, num_keys)
+            if args.compare:
+                benchmark("before", LegacyAPIResponseCache(redis_connection), redis_connection, num_keys)
+    finally:
+        delete_keys(redis_connection)
+
+
+if __name__ == "__main__":
+    main()
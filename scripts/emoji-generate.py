@@ -13,6 +13,37 @@ def download_emoji_data():
 
 data_line_regex = re.compile("^[^#]*# (\\S+).*$")
 
+HEADER = """from pajbot.utils import compile_literals_regex
+
+# This file is generated by scripts/emoji-generate.py, don't edit it by hand.
+
+"""
+
+FOOTER = """
+
+# Every emoji contains at least one non-ASCII character. If a message contains none of these,
+# it can't contain any emoji, which is a lot cheaper to check than searching for the emoji.
+EMOJI_CANARY_CHARS = frozenset(next(char for char in emoji if not char.isascii()) for emoji in ALL_EMOJI)
+
+# Matches any emoji, preferring the longest one if several emoji start at the same position
+EMOJI_REGEX = compile_literals_regex(ALL_EMOJI)
+
+
+def contains_emoji(message):
+    if EMOJI_CANARY_CHARS.isdisjoint(message):
+        return False
+
+    return EMOJI_REGEX.search(message) is not None
+
+
+def find_emoji(message):
+    \"\"\" Returns all emoji in the given message, in order of appearance \"\"\"
+    if EMOJI_CANARY_CHARS.isdisjoint(message):
+        return []
+
+    return EMOJI_REGEX.findall(message)
+"""
+
 
 def parse_emoji_data(text):
     lines = text.splitlines()
@@ -46,4 +77,4 @@ if __name__ == "__main__":
     all_emoji = parse_emoji_data(emoji_data_text)
 
     list_str = json.dumps(all_emoji, ensure_ascii=False, indent=4)
-    print("ALL_EMOJI = " + list_str)
+    print(HEADER + "ALL_EMOJI = " + list_str + FOOTER, end="")
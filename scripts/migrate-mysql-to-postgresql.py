@@ -5,15 +5,15 @@ import functools
 import logging
 import os
 import sys
+import time
 
 import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import execute_values
 
 import MySQLdb
 import pajbot.migration_revisions.db  # noqa E402 module level import not at top of file
 from pajbot.migration.db import DatabaseMigratable  # noqa E402 module level import not at top of file
 from pajbot.migration.migrate import Migration  # noqa E402 module level import not at top of file
+from pajbot.managers.db import DBManager  # noqa E402 module level import not at top of file
 
 # add /opt/pajbot (parent directory) to the PYTHONPATH
 # so we can import from pajbot.migration, etc..
@@ -88,15 +88,13 @@ with mysql_conn.cursor() as mysql, psql_conn.cursor() as psql:
             row_id = columns.index(column_name)
             rows = coercion(rows, row_id)
 
-        rows = list(rows)
+        print("Copying into PostgreSQL... ", end="")
 
-        print("Inserting into PostgreSQL... ", end="")
+        started_at = time.perf_counter()
+        num_rows = DBManager.bulk_load(psql, destination_table_name, columns, rows)
+        seconds = time.perf_counter() - started_at
 
-        # psql.execute(sql.SQL("DELETE FROM {}").format(sql.Identifier(destination_table_name)))
-        psql_sql = sql.SQL("INSERT INTO {} VALUES %s").format(sql.Identifier(destination_table_name))
-        execute_values(psql, psql_sql, rows)
-
-        print("done.")
+        print(f"done ({num_rows} rows, {num_rows / seconds if seconds > 0 else 0:,.0f} rows/sec).")
 
     def copy_auto_increment(destination_table_name, column_name):
         source_table_name = "tb_" + destination_table_name